@@ -0,0 +1,59 @@
+"""
+Benchmark the RPC path of FlockingAirsimAccelEnv against the local AirSim stand-in, with serial and pipelined stepping.
+
+    python benchmarks/bench_airsim_rpc.py --n-agents 20 --latency 0.002 --jitter 0.001
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+import numpy as np
+from gym_flock.envs.airsim_standin import AirsimStandInServer, write_settings
+from gym_flock.envs.flocking_airsim_accel import FlockingAirsimAccelEnv
+from gym_flock.envs.utils import grid
+
+
+def run(env, n_steps, pipelined, control_period):
+    env.set_stepping(pipelined=pipelined, control_period=control_period)
+    env.reset()
+    start = perf_counter()
+    for _ in range(n_steps):
+        env.step(env.controller())
+    elapsed = perf_counter() - start
+    env.join_commands()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-agents', type=int, default=20)
+    parser.add_argument('--n-steps', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--jitter', type=float, default=0.001)
+    parser.add_argument('--control-period', type=float, default=None)
+    args = parser.parse_args()
+
+    names = ['Drone' + str(i) for i in range(args.n_agents)]
+    homes = np.hstack((grid(args.n_agents) * 4.0, np.zeros((args.n_agents, 1))))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = os.path.join(tmp, 'settings.json')
+        write_settings(settings, names, homes)
+
+        with AirsimStandInServer(names, port=0, latency=args.latency, jitter=args.jitter, seed=0) as server:
+            env = FlockingAirsimAccelEnv(settings_file=settings, ip=server.address[0], port=server.address[1])
+            for pipelined in (False, True):
+                env.fetcher.recent_calls.clear()
+                env.fetcher.recent_steps.clear()
+                elapsed = run(env, args.n_steps, pipelined, args.control_period)
+                latency = env.latency_percentiles()
+                print('pipelined=%s: %.1f steps/s' % (pipelined, args.n_steps / elapsed))
+                print('  state RPC latency (ms):', {k: round(v, 2) for k, v in latency['call'].items()})
+                print('  state fetch time (ms):', {k: round(v, 2) for k, v in latency['fetch'].items()})
+                if args.control_period is not None:
+                    print('  pacing:', env.pacing_stats())
+            env.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measure the startup cost of gym_flock in fresh interpreters, and check it against the import-time targets:
+importing gym_flock adds at most TARGET_IMPORT_MS on top of importing gym, and neither importing gym_flock nor making
+a flocking env loads plotting, sklearn or AirSim.
+
+    python benchmarks/bench_import.py
+"""
+import subprocess
+import sys
+import numpy as np
+
+TARGET_IMPORT_MS = 10.0
+N_RUNS = 7
+
+HEAVY_MODULES = ('matplotlib', 'sklearn', 'airsim')
+
+TIMER = """
+import sys
+from time import perf_counter
+start = perf_counter()
+{statement}
+print(1000.0 * (perf_counter() - start))
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def measure(statement, setup=''):
+    """
+    Returns: median time in milliseconds of statement in fresh interpreters after setup, and the heavy modules loaded
+    """
+    times = []
+    loaded = ''
+    for _ in range(N_RUNS):
+        code = setup + '\n' + TIMER.format(statement=statement, heavy=HEAVY_MODULES)
+        out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                             universal_newlines=True).stdout.split('\n')
+        times.append(float(out[0]))
+        loaded = out[1]
+    return float(np.median(times)), loaded
+
+
+def main():
+    ok = True
+    t_gym, _ = measure('import gym')
+    t_flock, loaded = measure('import gym_flock', setup='import gym')
+    print('import gym: %.1f ms' % t_gym)
+    print('import gym_flock after gym: %.1f ms (target %.1f ms)' % (t_flock, TARGET_IMPORT_MS))
+    if t_flock > TARGET_IMPORT_MS or loaded:
+        print('  FAILED, heavy modules loaded: ' + (loaded or 'none'))
+        ok = False
+
+    t_make, loaded = measure("gym.make('FlockingRelative-v0')", setup='import gym, gym_flock')
+    print("gym.make('FlockingRelative-v0'): %.1f ms" % t_make)
+    if loaded:
+        print('  FAILED, heavy modules loaded: ' + loaded)
+        ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
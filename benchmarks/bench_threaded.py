@@ -0,0 +1,75 @@
+"""
+Benchmark the dense, tiled and threaded executions of compute_helpers and controller on one large flock, and report
+the speedup of the threaded execution.
+
+    python benchmarks/bench_threaded.py --n-agents 4000 --threads 1 2 4 8
+"""
+import argparse
+import configparser
+import os
+from time import perf_counter
+import numpy as np
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+def make_env(n_agents, comm_radius):
+    config = configparser.ConfigParser()
+    config['flock'] = {'n_agents': str(n_agents), 'comm_radius': str(comm_radius), 'v_max': '3.0', 'dt': '0.01'}
+    env = FlockingRelativeEnv()
+    env.params_from_cfg(config['flock'])
+
+    # agents spread uniformly, with about 6 neighbors each, rather than by reset, which is slow for large flocks
+    side = np.sqrt(n_agents * np.pi * comm_radius * comm_radius / 6.0)
+    env.x = np.zeros((n_agents, env.nx_system))
+    env.x[:, 0:2] = np.random.uniform(0, side, size=(n_agents, 2))
+    env.x[:, 2:4] = np.random.uniform(-env.v_max, env.v_max, size=(n_agents, 2))
+    return env
+
+
+def run(env, n_steps):
+    """
+    Returns: median time in milliseconds of compute_helpers followed by controller, and the controls
+    """
+    times = []
+    controls = None
+    for _ in range(n_steps):
+        start = perf_counter()
+        env.compute_helpers()
+        controls = env.controller()
+        times.append(perf_counter() - start)
+    return 1000.0 * float(np.median(times)), controls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-agents', type=int, default=4000)
+    parser.add_argument('--n-steps', type=int, default=5)
+    parser.add_argument('--comm-radius', type=float, default=1.0)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--tile-bytes', type=int, default=None)
+    args = parser.parse_args()
+
+    np.random.seed(0)
+    env = make_env(args.n_agents, args.comm_radius)
+    print('%d agents, %d CPUs' % (args.n_agents, os.cpu_count()))
+
+    env.set_execution('dense')
+    t_dense, reference = run(env, args.n_steps)
+    print('dense: %.1f ms' % t_dense)
+
+    env.set_execution('tiled', tile_bytes=args.tile_bytes)
+    t_tiled, controls = run(env, args.n_steps)
+    print('tiled: %.1f ms, %d row blocks' % (t_tiled, len(env.row_blocks())))
+    assert np.array_equal(controls, reference)
+
+    for n_threads in sorted(set(args.threads)):
+        env.set_execution('threaded', tile_bytes=args.tile_bytes, n_threads=n_threads)
+        t_threaded, controls = run(env, args.n_steps)
+        assert np.array_equal(controls, reference)
+        print('threaded, %d threads: %.1f ms, speedup %.2fx over dense, %.2fx over tiled'
+              % (n_threads, t_threaded, t_dense / t_threaded, t_tiled / t_threaded))
+    env.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+from importlib.util import find_spec
 from gym.envs.registration import register
 
 register(
@@ -38,8 +39,17 @@ register(
 )
 
 
-try:
-    import airsim
+# the JAX backend is only registered if JAX is installed
+if find_spec('jax') is not None:
+    register(
+        id='FlockingRelativeJax-v0',
+        entry_point='gym_flock.envs:FlockingRelativeJaxEnv',
+        max_episode_steps=1000,
+    )
+
+
+# the AirSim env is only registered if the AirSim client is installed, without importing it
+if find_spec('airsim') is not None:
     # register(
     #     id='FlockingAirsim-v0',
     #     entry_point='gym_flock.envs:FlockingAirsimEnv',
@@ -51,8 +61,6 @@ try:
         entry_point='gym_flock.envs:FlockingAirsimAccelEnv',
         max_episode_steps=200,
     )
-except ImportError:
-    print('AirSim not installed.')
 
 
 
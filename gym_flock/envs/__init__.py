@@ -1,16 +1,32 @@
+import importlib
 
-from gym_flock.envs.flocking_relative import FlockingRelativeEnv
-from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
-from gym_flock.envs.flocking_leader import FlockingLeaderEnv
-from gym_flock.envs.formation_flying import FormationFlyingEnv
-from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
-from gym_flock.envs.flocking_twoflocks import FlockingTwoFlocksEnv
+# env classes are imported on first access, so that importing gym_flock, or making one env, only pays for the
+# dependencies of that env
+_ENV_MODULES = {
+    'FlockingRelativeEnv': 'gym_flock.envs.flocking_relative',
+    'FlockingObstacleEnv': 'gym_flock.envs.flocking_obstacle',
+    'FlockingLeaderEnv': 'gym_flock.envs.flocking_leader',
+    'FormationFlyingEnv': 'gym_flock.envs.formation_flying',
+    'FlockingStochasticEnv': 'gym_flock.envs.flocking_stoch',
+    'FlockingTwoFlocksEnv': 'gym_flock.envs.flocking_twoflocks',
+    'FlockingRelativeJaxEnv': 'gym_flock.envs.flocking_jax',
+    'FlockingRaggedEnv': 'gym_flock.envs.flocking_ragged',
+    'LQREnv': 'gym_flock.envs.lqr',
+    'LQRBatchEnv': 'gym_flock.envs.lqr_batch',
+    # 'FlockingAirsimEnv': 'gym_flock.envs.old.flocking_airsim',
+    'FlockingAirsimAccelEnv': 'gym_flock.envs.flocking_airsim_accel',
+}
 
-try:
-	import airsim
-	# from gym_flock.envs.old.flocking_airsim import FlockingAirsimEnv
-	from gym_flock.envs.flocking_airsim_accel import FlockingAirsimAccelEnv
-except ImportError:
-	print('AirSim not installed.')
+__all__ = list(_ENV_MODULES)
 
 
+def __getattr__(name):
+    if name not in _ENV_MODULES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    env_class = getattr(importlib.import_module(_ENV_MODULES[name]), name)
+    globals()[name] = env_class
+    return env_class
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
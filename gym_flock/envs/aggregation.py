@@ -0,0 +1,111 @@
+import numpy as np
+import scipy.sparse
+
+POOLING = ('sum', 'mean', 'min', 'max')
+
+
+class KHopAggregator(object):
+    """
+    Delayed multi-hop aggregation of agent features over a sparse communication graph.
+
+    At every step agent i receives the (k-1)-hop information its neighbors held at the previous step and pools
+    it into its own k-hop information, for k = 1, ..., filter_len - 1. The 0-hop information is the agent's own
+    current features. Levels are kept in a ring buffer, so the only work per step is one pooling pass over the
+    edges for each level, O(filter_len * E * n_features).
+    """
+
+    def __init__(self, n_nodes, n_features, filter_len, pooling=('sum',)):
+        """
+        Args:
+            n_nodes (): number of agents
+            n_features (): number of features per agent
+            filter_len (): number of hops of information kept per agent, including its own features
+            pooling (): pooling operations applied to the neighbors' information, from 'sum', 'mean', 'min', 'max'
+        """
+        for pool in pooling:
+            if pool not in POOLING:
+                raise ValueError('Unknown pooling operation: ' + str(pool))
+
+        self.n_nodes = n_nodes
+        self.n_features = n_features
+        self.filter_len = filter_len
+        self.pooling = tuple(pooling)
+        self.n_pools = len(self.pooling)
+        self.n_outputs = self.filter_len * self.n_features * self.n_pools
+
+        self.buffer = np.zeros((self.n_pools, self.filter_len, self.n_nodes, self.n_features))
+        self.head = 0
+
+    def reset(self):
+        """
+        Forget all forwarded information, e.g. at the start of an episode
+        """
+        self.buffer.fill(0)
+        self.head = 0
+
+    def get_state(self):
+        return self.buffer.copy(), self.head
+
+    def set_state(self, state):
+        buffer, self.head = state
+        np.copyto(self.buffer, buffer)
+
+    def update(self, values, adj):
+        """
+        Advance the aggregation by one step
+        Args:
+            values (): current features of all agents, with shape (n_nodes, n_features)
+            adj (): adjacency matrix, dense or scipy.sparse, where adj[i, j] is the weight with which i receives from j
+
+        Returns: aggregated features with shape (n_nodes, n_outputs), ordered as (hop, feature, pool)
+
+        """
+        adj = scipy.sparse.csr_matrix(adj)
+        adj.sum_duplicates()
+        degree = np.diff(adj.indptr)
+
+        # the slot holding the oldest level is overwritten by the new 0-hop features,
+        # every other slot moves up one hop by pooling over the neighbors
+        self.head = (self.head + 1) % self.filter_len
+        for p, pool in enumerate(self.pooling):
+            for k in range(1, self.filter_len):
+                slot = (self.head - k) % self.filter_len
+                self.buffer[p, slot] = self.pool(self.buffer[p, slot], adj, degree, pool)
+            self.buffer[p, self.head] = values
+
+        return self.get_features()
+
+    def get_features(self):
+        """
+        Returns: aggregated features with shape (n_nodes, n_outputs), ordered as (hop, feature, pool)
+        """
+        order = (self.head - np.arange(self.filter_len)) % self.filter_len
+        features = self.buffer[:, order].transpose((2, 1, 3, 0))
+        return features.reshape((self.n_nodes, self.n_outputs))
+
+    def pool(self, values, adj, degree, pool):
+        """
+        Pool neighbors' values over the edges of the graph. Agents without neighbors receive zeros.
+        Args:
+            values (): values held by all agents, with shape (n_nodes, n_features)
+            adj (): CSR adjacency matrix with duplicates summed
+            degree (): number of neighbors of each agent
+            pool (): pooling operation
+
+        Returns: pooled values with shape (n_nodes, n_features)
+
+        """
+        if pool == 'sum':
+            return adj.dot(values)
+        if pool == 'mean':
+            return adj.dot(values) / np.maximum(degree, 1).reshape((-1, 1))
+
+        pooled = np.zeros_like(values)
+        has_neighbors = degree > 0
+        if np.any(has_neighbors):
+            edge_values = adj.data.reshape((-1, 1)) * values[adj.indices]
+            # consecutive non-empty rows of a CSR matrix are contiguous, so empty rows can simply be skipped
+            starts = adj.indptr[:-1][has_neighbors]
+            reduce = np.minimum if pool == 'min' else np.maximum
+            pooled[has_neighbors] = reduce.reduceat(edge_values, starts, axis=0)
+        return pooled
@@ -0,0 +1,194 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+import numpy as np
+
+
+def quaternion_to_yaw(q):
+    # yaw (z-axis rotation) from quaternion
+    w = float(q.w_val)
+    x = float(q.x_val)
+    y = float(q.y_val)
+    z = float(q.z_val)
+    siny_cosp = +2.0 * (w * z + x * y)
+    cosy_cosp = +1.0 - 2.0 * (y * y + z * z)
+    yaw = np.arctan2(siny_cosp, cosy_cosp)
+    return yaw
+
+
+def latency_percentiles(latencies, percentiles=(50, 90, 99)):
+    """
+    Summarize RPC latencies
+    Args:
+        latencies (): latencies in seconds
+        percentiles (): percentiles to report
+
+    Returns: dict of latency percentiles in milliseconds, keyed 'p50', 'p90', ..., and the maximum, keyed 'max'
+
+    """
+    latencies = 1000.0 * np.asarray(latencies)
+    if latencies.size == 0:
+        return {}
+    stats = {'p' + str(p): float(v) for p, v in zip(percentiles, np.percentile(latencies, percentiles))}
+    stats['max'] = float(np.max(latencies))
+    return stats
+
+
+class AirsimStateFetcher(object):
+    """
+    Queries the states of all vehicles concurrently. Each worker thread owns one client connection, since RPC
+    clients are not thread-safe, and writes the results of its queries into preallocated state arrays.
+    The arrays are double-buffered, so the states returned by one fetch stay valid while the next one is running.
+    """
+
+    def __init__(self, names, home, client_factory, n_clients=8, window=1000):
+        """
+        Args:
+            names (): vehicle names
+            home (): home location of each vehicle, added to its reported position
+            client_factory (): callable returning a new connected client, e.g. airsim.MultirotorClient
+            n_clients (): number of worker threads, and of pooled client connections
+            window (): number of recent RPC latencies kept for percentiles
+        """
+        self.names = names
+        self.home = home
+        self.n_agents = len(names)
+        self.client_factory = client_factory
+        self.n_clients = max(1, min(n_clients, self.n_agents))
+
+        self.buffers = [(np.zeros(shape=(self.n_agents, 4)), np.zeros(shape=(self.n_agents, 1))) for _ in range(2)]
+        self.n_fetches = 0
+        self.states, self.yaws = self.buffers[0]
+        self.pending = None
+        self.fetch_start = None
+        self.call_latencies = np.zeros(shape=(self.n_agents,))
+
+        self.recent_calls = deque(maxlen=window)
+        self.recent_steps = deque(maxlen=window)
+
+        self.local = threading.local()
+        self.clients = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.n_clients)
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.client_factory()
+            self.local.client = client
+            with self.lock:
+                self.clients.append(client)
+        return client
+
+    def fetch_one(self, i):
+        start = perf_counter()
+        state = self.client().getMultirotorState(vehicle_name=self.names[i])
+        self.call_latencies[i] = perf_counter() - start
+
+        kinematics = state.kinematics_estimated
+        self.states[i][0] = float(kinematics.position.x_val) + self.home[i][0]
+        self.states[i][1] = float(kinematics.position.y_val) + self.home[i][1]
+        self.states[i][2] = float(kinematics.linear_velocity.x_val)
+        self.states[i][3] = float(kinematics.linear_velocity.y_val)
+        self.yaws[i] = quaternion_to_yaw(kinematics.orientation)
+
+    def fetch_async(self):
+        """
+        Start querying the states of all vehicles, without waiting for the results
+        """
+        if self.pending is not None:
+            raise RuntimeError('The previous fetch has not been waited for.')
+        self.states, self.yaws = self.buffers[self.n_fetches % 2]
+        self.n_fetches += 1
+        self.fetch_start = perf_counter()
+        self.pending = [self.executor.submit(self.fetch_one, i) for i in range(self.n_agents)]
+
+    def fetch_wait(self):
+        """
+        Wait for the queries started by fetch_async. The returned arrays are overwritten by the fetch after next.
+        Returns: states with shape (n_agents, 4) of positions and velocities, and yaws with shape (n_agents, 1)
+        """
+        pending, self.pending = self.pending, None
+        for f in pending:
+            f.result()
+        self.recent_steps.append(perf_counter() - self.fetch_start)
+        self.recent_calls.extend(self.call_latencies)
+        return self.states, self.yaws
+
+    def fetch(self):
+        """
+        Query the states of all vehicles. The returned arrays are overwritten by the fetch after next.
+        Returns: states with shape (n_agents, 4) of positions and velocities, and yaws with shape (n_agents, 1)
+        """
+        self.fetch_async()
+        return self.fetch_wait()
+
+    def step_latency(self):
+        """
+        Returns: percentiles of the RPC latencies of the last fetch, and the wall-clock time of the whole fetch
+        """
+        stats = latency_percentiles(self.call_latencies)
+        if self.recent_steps:
+            stats['fetch'] = 1000.0 * self.recent_steps[-1]
+        return stats
+
+    def latency_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Returns: percentiles of the recent RPC latencies, and of the recent wall-clock times of whole fetches
+        """
+        return {'call': latency_percentiles(self.recent_calls, percentiles),
+                'fetch': latency_percentiles(self.recent_steps, percentiles)}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class ControlPacer(object):
+    """
+    Paces a control loop at a fixed period, and counts the ticks at which the loop was already late
+    """
+
+    def __init__(self, period):
+        """
+        Args:
+            period (): control period in seconds
+        """
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        self.next_tick = None
+        self.n_ticks = 0
+        self.n_misses = 0
+        self.max_lateness = 0.0
+
+    def wait(self):
+        """
+        Sleep until the next tick of the control loop
+        Returns: whether the deadline of this tick was already missed
+        """
+        now = perf_counter()
+        self.n_ticks += 1
+        if self.next_tick is None:
+            self.next_tick = now + self.period
+            return False
+
+        lateness = now - self.next_tick
+        if lateness > 0:
+            # a late tick restarts the schedule rather than trying to catch up with shorter periods
+            self.n_misses += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.next_tick = now + self.period
+            return True
+
+        sleep(-lateness)
+        self.next_tick = self.next_tick + self.period
+        return False
+
+    def stats(self):
+        """
+        Returns: number of ticks, of missed deadlines, miss rate and worst lateness in milliseconds
+        """
+        return {'ticks': self.n_ticks, 'misses': self.n_misses, 'miss_rate': self.n_misses / max(self.n_ticks, 1),
+                'max_lateness': 1000.0 * self.max_lateness}
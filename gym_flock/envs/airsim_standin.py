@@ -0,0 +1,313 @@
+"""
+A local stand-in for the AirSim simulator, for benchmarking and testing the RPC path of FlockingAirsimAccelEnv on
+machines without a simulator. It speaks the msgpack-RPC subset used by the env, integrates double-integrator
+dynamics for every vehicle, and can inject latency and jitter into each call.
+
+Run it with, e.g.:
+    python -m gym_flock.envs.airsim_standin --settings settings.json --latency 0.002 --jitter 0.001
+"""
+import argparse
+import json
+import socketserver
+import threading
+from time import sleep, time
+import msgpack
+import numpy as np
+from gym_flock.envs.utils import parse_settings
+
+GRAVITY = 9.8
+TAKEOFF_Z = -3.0
+
+
+def write_settings(fname, names, homes):
+    """
+    Write an AirSim settings file with one multirotor per name, in the format read by utils.parse_settings
+    Args:
+        fname (): path of the settings file
+        names (): vehicle names
+        homes (): home locations of the vehicles, with shape (n_vehicles, 3)
+    """
+    lines = ['{', '  "SettingsVersion": 1.2,', '  "SimMode": "Multirotor",', '  "Vehicles": {']
+    for i, (name, home) in enumerate(zip(names, homes)):
+        sep = ',' if i < len(names) - 1 else ''
+        lines.append('    "%s": {"VehicleType": "SimpleFlight", "X": %g, "Y": %g, "Z": %g}%s'
+                     % (name, home[0], home[1], home[2], sep))
+    lines += ['  }', '}']
+    with open(fname, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def vector(v):
+    return {'x_val': float(v[0]), 'y_val': float(v[1]), 'z_val': float(v[2])}
+
+
+class AirsimStandIn(object):
+    """
+    Vehicle dynamics behind the stand-in server. Positions are relative to each vehicle's home, as in AirSim.
+    """
+
+    def __init__(self, names, latency=0.0, jitter=0.0, method_latency=None, realtime=False, seed=None):
+        """
+        Args:
+            names (): vehicle names
+            latency (): delay in seconds added to every call
+            jitter (): extra delay in seconds, drawn uniformly at random for every call
+            method_latency (): per-method delays in seconds, replacing latency for those methods
+            realtime (): if True, commands with a duration only return after that duration
+            seed (): seed of the jitter
+        """
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.latency = latency
+        self.jitter = jitter
+        self.method_latency = method_latency or {}
+        self.realtime = realtime
+        self.rng = np.random.RandomState(seed)
+
+        self.lock = threading.Lock()
+        self.n_calls = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            n = len(self.names)
+            self.pos = np.zeros((n, 3))
+            self.vel = np.zeros((n, 3))
+            self.yaw = np.zeros((n,))
+            self.start_time = time()
+        return None
+
+    def delay(self, method):
+        with self.lock:
+            self.n_calls += 1
+            jitter = self.rng.uniform(0, self.jitter) if self.jitter > 0 else 0.0
+        delay = self.method_latency.get(method, self.latency) + jitter
+        if delay > 0:
+            sleep(delay)
+
+    def vehicle(self, vehicle_name):
+        if vehicle_name == '' and self.names:
+            return 0
+        if vehicle_name not in self.index:
+            raise ValueError('Unknown vehicle: ' + str(vehicle_name))
+        return self.index[vehicle_name]
+
+    def wait(self, duration):
+        if self.realtime and duration > 0:
+            sleep(duration)
+
+    def call(self, method, params):
+        """
+        Execute one RPC
+        Args:
+            method (): name of the method, as sent on the wire
+            params (): list of parameters
+
+        Returns: the result of the call
+
+        """
+        handler = getattr(self, 'rpc_' + method, None)
+        if handler is None:
+            raise ValueError('Unknown method: ' + str(method))
+        self.delay(method)
+        return handler(*params)
+
+    # connection and setup
+    def rpc_ping(self):
+        return True
+
+    def rpc_getServerVersion(self):
+        return 1
+
+    def rpc_getMinRequiredClientVersion(self):
+        return 1
+
+    def rpc_reset(self):
+        return self.reset()
+
+    def rpc_enableApiControl(self, is_enabled, vehicle_name=''):
+        self.vehicle(vehicle_name)
+        return None
+
+    def rpc_armDisarm(self, arm, vehicle_name=''):
+        self.vehicle(vehicle_name)
+        return True
+
+    def rpc_simPrintLogMessage(self, message, message_param='', severity=0):
+        return None
+
+    # flight control
+    def rpc_takeoff(self, timeout_sec=20, vehicle_name=''):
+        i = self.vehicle(vehicle_name)
+        with self.lock:
+            self.pos[i, 2] = min(self.pos[i, 2], TAKEOFF_Z)
+            self.vel[i] = 0
+        return True
+
+    def rpc_moveByAngleZ(self, pitch, roll, z, yaw, duration, vehicle_name=''):
+        i = self.vehicle(vehicle_name)
+        # small-angle tilt accelerates the vehicle along its body axes
+        body = np.array([-GRAVITY * pitch, GRAVITY * roll])
+        rot = np.array([[np.cos(yaw), -np.sin(yaw)], [np.sin(yaw), np.cos(yaw)]])
+        accel = rot.dot(body)
+        with self.lock:
+            self.yaw[i] = yaw
+            self.pos[i, 0:2] = self.pos[i, 0:2] + self.vel[i, 0:2] * duration + accel * duration * duration * 0.5
+            self.vel[i, 0:2] = self.vel[i, 0:2] + accel * duration
+            self.pos[i, 2] = z
+            self.vel[i, 2] = 0
+        self.wait(duration)
+        return True
+
+    def rpc_moveByRollPitchYawZ(self, roll, pitch, yaw, z, duration, vehicle_name=''):
+        # newer clients send moveByAngleZAsync(pitch, roll, z, yaw, ...) as moveByRollPitchYawZ(roll, -pitch, -yaw, ...)
+        return self.rpc_moveByAngleZ(-pitch, roll, z, -yaw, duration, vehicle_name)
+
+    def rpc_moveByVelocityZ(self, vx, vy, z, duration, drivetrain=None, yaw_mode=None, vehicle_name=''):
+        i = self.vehicle(vehicle_name)
+        with self.lock:
+            self.vel[i] = [vx, vy, 0]
+            self.pos[i, 0:2] = self.pos[i, 0:2] + self.vel[i, 0:2] * duration
+            self.pos[i, 2] = z
+        self.wait(duration)
+        return True
+
+    def rpc_moveToPosition(self, x, y, z, velocity, timeout_sec=None, drivetrain=None, yaw_mode=None, lookahead=-1,
+                           adaptive_lookahead=1, vehicle_name=''):
+        i = self.vehicle(vehicle_name)
+        with self.lock:
+            self.pos[i] = [x, y, z]
+            self.vel[i] = 0
+        return True
+
+    # state
+    def rpc_getMultirotorState(self, vehicle_name=''):
+        i = self.vehicle(vehicle_name)
+        with self.lock:
+            pos = self.pos[i].copy()
+            vel = self.vel[i].copy()
+            yaw = self.yaw[i]
+        zero = vector((0, 0, 0))
+        timestamp = int((time() - self.start_time) * 1e9)
+        return {
+            'collision': {'has_collided': False, 'normal': zero, 'impact_point': zero, 'position': zero,
+                          'penetration_depth': 0.0, 'time_stamp': 0, 'object_name': '', 'object_id': -1},
+            'kinematics_estimated': {
+                'position': vector(pos),
+                'orientation': {'w_val': float(np.cos(yaw / 2)), 'x_val': 0.0, 'y_val': 0.0,
+                                'z_val': float(np.sin(yaw / 2))},
+                'linear_velocity': vector(vel),
+                'angular_velocity': zero,
+                'linear_acceleration': zero,
+                'angular_acceleration': zero},
+            'gps_location': {'latitude': 0.0, 'longitude': 0.0, 'altitude': 0.0},
+            'timestamp': timestamp,
+            'landed_state': 1 if pos[2] < 0 else 0,
+            'rc_data': {'timestamp': 0, 'pitch': 0.0, 'roll': 0.0, 'throttle': 0.0, 'yaw': 0.0,
+                        'switch1': 0, 'switch2': 0, 'switch3': 0, 'switch4': 0,
+                        'switch5': 0, 'switch6': 0, 'switch7': 0, 'switch8': 0,
+                        'is_initialized': False, 'is_valid': False},
+            'ready': True,
+            'ready_message': '',
+            'can_arm': True,
+        }
+
+
+class _RPCHandler(socketserver.BaseRequestHandler):
+    """
+    Serves msgpack-RPC requests [0, msgid, method, params] and notifications [2, method, params] on one connection
+    """
+
+    def handle(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            unpacker.feed(data)
+            for message in unpacker:
+                if message[0] == 2:
+                    self.execute(message[1], message[2])
+                    continue
+                _, msgid, method, params = message
+                result, error = self.execute(method, params)
+                self.request.sendall(msgpack.packb([1, msgid, error, result], use_bin_type=True))
+
+    def execute(self, method, params):
+        try:
+            return self.server.standin.call(method, params), None
+        except Exception as e:
+            return None, str(e)
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class AirsimStandInServer(object):
+    """
+    msgpack-RPC server in front of an AirsimStandIn, running in a background thread
+    """
+
+    def __init__(self, names, host='127.0.0.1', port=41451, **kwargs):
+        """
+        Args:
+            names (): vehicle names
+            host (): address to listen on
+            port (): port to listen on, 0 picks a free port
+            **kwargs (): latency, jitter, method_latency, realtime and seed of the AirsimStandIn
+        """
+        self.standin = AirsimStandIn(names, **kwargs)
+        self.server = _ThreadingServer((host, port), _RPCHandler)
+        self.server.standin = self.standin
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the AirSim simulator.')
+    parser.add_argument('--settings', required=True, help='AirSim settings file with the vehicle names')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=41451)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay added to every call, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random extra delay, in seconds')
+    parser.add_argument('--method-latency', type=json.loads, default=None,
+                        help='per-method delays as JSON, e.g. \'{"getMultirotorState": 0.003}\'')
+    parser.add_argument('--realtime', action='store_true', help='commands return after their duration')
+    args = parser.parse_args()
+
+    names, _ = parse_settings(args.settings)
+    server = AirsimStandInServer(names, host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+                                 method_latency=args.method_latency, realtime=args.realtime)
+    print('AirSim stand-in serving %d vehicles on %s:%d' % ((len(names),) + server.address))
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
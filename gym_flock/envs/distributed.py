@@ -0,0 +1,429 @@
+"""
+Flocks too large for one process, stepped by a group of processes that each own a vertical strip of the plane.
+
+At every step, each process integrates its agents, hands the agents that left its strip to the neighboring strip, and
+exchanges with both neighbors the agents within the halo width of their common border. The halo width is the range of
+the pairwise interactions, so each process then computes the observed features and the expert controls of its agents
+exactly as the single-process engine does. The centralized controller only needs the sum of all velocities besides
+neighbor pairs, which is reduced by the coordinating process. Strips are moved with the mean velocity of the flock,
+and rebalanced to equal numbers of agents every rebalance_interval steps.
+
+    flock = DistributedFlock.from_env(env, n_workers=8)
+    flock.load(env.x)
+    for _ in range(1000):
+        cost = flock.step()
+    x, state_values, controls = flock.gather()
+    flock.close()
+"""
+import multiprocessing
+import traceback
+from multiprocessing.connection import wait
+import numpy as np
+import scipy.sparse
+from scipy.spatial import cKDTree
+
+
+def strip_bounds(x, n_strips, min_width):
+    """
+    Borders between strips with equal numbers of agents
+    Args:
+        x (): horizontal positions of all agents
+        n_strips (): number of strips
+        min_width (): smallest width of the inner strips
+
+    Returns: the n_strips - 1 inner borders; the outer strips extend to infinity
+
+    """
+    if n_strips == 1 or len(x) == 0:
+        return np.zeros((n_strips - 1,))
+    bounds = np.quantile(x, np.arange(1, n_strips) / n_strips)
+    for k in range(1, n_strips - 1):
+        bounds[k] = max(bounds[k], bounds[k - 1] + min_width)
+    return bounds
+
+
+class StripWorker(object):
+    """
+    The agents of one strip, in one process
+    """
+
+    def __init__(self, index, n_strips, left, right, params):
+        self.index = index
+        self.n_strips = n_strips
+        self.left = left
+        self.right = right
+        self.comm_radius = params['comm_radius']
+        self.comm_radius2 = self.comm_radius * self.comm_radius
+        self.dt = params['dt']
+        self.centralized = params['centralized']
+        self.halo = params['halo']
+
+        self.lo = -np.Inf
+        self.hi = np.Inf
+        self.ids = np.zeros((0,), dtype=int)
+        self.x = np.zeros((0, 4))
+        self.u = np.zeros((0, 2))
+        self.clear_helpers()
+
+    def clear_helpers(self):
+        n = len(self.ids)
+        self.grad = np.zeros((n, 2))
+        self.alignment = np.zeros((n, 2))
+        self.state_values = np.zeros((n, 6))
+        self.edges = (np.zeros((0,), dtype=int), np.zeros((0,), dtype=int))
+
+    def set_bounds(self, bounds):
+        self.lo = bounds[self.index - 1] if self.index > 0 else -np.Inf
+        self.hi = bounds[self.index] if self.index < self.n_strips - 1 else np.Inf
+
+    def exchange(self, to_left, to_right):
+        """
+        Send data to both neighbors and receive theirs. Neighbors pair up first across the borders after even strips,
+        then across the borders after odd strips, so that every send has a matching receive and no exchange deadlocks.
+        Returns: the data from the left and right neighbors, or None without a neighbor
+        """
+        from_left = None
+        from_right = None
+        for phase in (0, 1):
+            if self.index % 2 == phase:
+                if self.right is not None:
+                    self.right.send(to_right)
+                    from_right = self.right.recv()
+            elif self.left is not None:
+                from_left = self.left.recv()
+                self.left.send(to_left)
+        return from_left, from_right
+
+    def migrate(self):
+        """
+        Hand the agents outside of the strip to the neighboring strips
+        """
+        leave_left = self.x[:, 0] < self.lo
+        leave_right = self.x[:, 0] >= self.hi
+        stay = ~(leave_left | leave_right)
+        from_left, from_right = self.exchange((self.ids[leave_left], self.x[leave_left]),
+                                              (self.ids[leave_right], self.x[leave_right]))
+        ids = [self.ids[stay]]
+        x = [self.x[stay]]
+        for arrived in (from_left, from_right):
+            if arrived is not None:
+                ids.append(arrived[0])
+                x.append(arrived[1])
+        self.ids = np.concatenate(ids)
+        self.x = np.concatenate(x)
+        if np.any(self.x[:, 0] < self.lo) or np.any(self.x[:, 0] >= self.hi):
+            raise RuntimeError('Agents moved past a whole strip in one step. Use fewer strips or rebalance more often.')
+
+    def compute_helpers(self):
+        """
+        Exchange the halos with the neighboring strips, and compute the features and controller sums of the agents
+        Returns: number of agents, and sums of their velocities and squared velocities
+        """
+        near_left = self.x[:, 0] < self.lo + self.halo
+        near_right = self.x[:, 0] >= self.hi - self.halo
+        from_left, from_right = self.exchange((self.ids[near_left], self.x[near_left]),
+                                              (self.ids[near_right], self.x[near_right]))
+        ids = [self.ids]
+        x = [self.x]
+        for halo in (from_left, from_right):
+            if halo is not None:
+                ids.append(halo[0])
+                x.append(halo[1])
+        all_ids = np.concatenate(ids)
+        all_x = np.concatenate(x)
+        n_own = len(self.ids)
+        n_all = len(all_ids)
+
+        pairs = cKDTree(all_x[:, 0:2]).query_pairs(self.halo, output_type='ndarray')
+        i = pairs[:, 0]
+        j = pairs[:, 1]
+        # pairs of two halo agents are computed by their own strips
+        own_pair = (i < n_own) | (j < n_own)
+        i = i[own_pair]
+        j = j[own_pair]
+        diff = all_x[i] - all_x[j]
+        r2 = np.multiply(diff[:, 0], diff[:, 0]) + np.multiply(diff[:, 1], diff[:, 1])
+
+        def pair_sums(weights):
+            # the pair terms are odd in the difference of the states, so agent j gets the opposite of agent i
+            return (np.bincount(i, weights=weights, minlength=n_all)
+                    - np.bincount(j, weights=weights, minlength=n_all))[0:n_own]
+
+        adjacent = r2 < self.comm_radius2
+        near = r2 <= self.comm_radius
+        if not self.centralized:
+            near = near & adjacent
+
+        ia = i[adjacent]
+        ja = j[adjacent]
+        da = diff[adjacent]
+        r2a = r2[adjacent]
+        features = (da[:, 2], np.divide(da[:, 0], np.multiply(r2a, r2a)), np.divide(da[:, 0], r2a),
+                    da[:, 3], np.divide(da[:, 1], np.multiply(r2a, r2a)), np.divide(da[:, 1], r2a))
+        self.state_values = np.zeros((n_own, 6))
+        for k, feature in enumerate(features):
+            self.state_values[:, k] = (np.bincount(ia, weights=feature, minlength=n_all)
+                                       - np.bincount(ja, weights=feature, minlength=n_all))[0:n_own]
+
+        self.grad = np.zeros((n_own, 2))
+        for k in range(2):
+            pos_diff = np.where(near, diff[:, k], 0.0)
+            r2_near = np.where(near, r2, 1.0)
+            self.grad[:, k] = pair_sums(-2.0 * np.divide(pos_diff, np.multiply(r2_near, r2_near))
+                                        + 2 * np.divide(pos_diff, r2_near))
+
+        # edges of the agents of this strip, by global ids
+        rows = np.concatenate((ia[ia < n_own], ja[ja < n_own]))
+        cols = np.concatenate((all_ids[ja[ia < n_own]], all_ids[ia[ja < n_own]]))
+        self.edges = (self.ids[rows], cols)
+
+        if not self.centralized:
+            self.alignment = np.zeros((n_own, 2))
+            for k in range(2):
+                self.alignment[:, k] = pair_sums(np.where(adjacent, diff[:, k + 2], 0.0))
+
+        vel = self.x[:, 2:4]
+        return n_own, np.sum(vel, axis=0), np.sum(np.square(vel), axis=0)
+
+    def controls(self, sum_vel, n_agents):
+        """
+        The controller for flocking from Turner 2003, as FlockingRelativeEnv.controller
+        """
+        if self.centralized:
+            alignment = n_agents * self.x[:, 2:4] - sum_vel
+        else:
+            alignment = self.alignment
+        return np.clip(-self.grad - alignment, -100, 100)
+
+    def step(self, u, bounds, sum_vel, n_agents):
+        if u is None:
+            u = self.controls(sum_vel, n_agents)
+        else:
+            u = u[self.ids]
+        self.x[:, 0:2] = self.x[:, 0:2] + self.x[:, 2:4] * self.dt + u * self.dt * self.dt * 0.5
+        self.x[:, 2:4] = self.x[:, 2:4] + u * self.dt
+        self.set_bounds(bounds)
+        self.migrate()
+        return self.compute_helpers()
+
+    def gather(self, sum_vel, n_agents, network):
+        result = [self.ids, self.x, self.state_values, self.controls(sum_vel, n_agents)]
+        if network:
+            result.append(self.edges)
+        return result
+
+    def serve(self, conn):
+        handlers = {
+            'load': self.load,
+            'compute': self.compute_helpers,
+            'step': self.step,
+            'gather': self.gather,
+            'take': self.take,
+        }
+        while True:
+            request = conn.recv()
+            if request[0] == 'close':
+                return
+            conn.send(('ok', handlers[request[0]](*request[1:])))
+
+    def load(self, ids, x, bounds):
+        self.ids = ids
+        self.x = x
+        self.set_bounds(bounds)
+        self.clear_helpers()
+
+    def take(self):
+        ids, x = self.ids, self.x
+        self.ids = np.zeros((0,), dtype=int)
+        self.x = np.zeros((0, 4))
+        self.clear_helpers()
+        return ids, x
+
+
+def _strip_worker(index, n_strips, conn, left, right, params):
+    try:
+        StripWorker(index, n_strips, left, right, params).serve(conn)
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+
+
+class DistributedFlock(object):
+    """
+    Coordinates the strip processes of a distributed flock
+    """
+
+    def __init__(self, n_workers, comm_radius, dt, centralized=True, mean_pooling=True, rebalance_interval=100,
+                 start_method='spawn'):
+        """
+        Args:
+            n_workers (): number of processes, and of strips
+            comm_radius (): communication radius of the agents
+            dt (): time step
+            centralized (): whether the expert controller uses all agents, or only neighbors
+            mean_pooling (): whether the observed network is normalized by the number of neighbors
+            rebalance_interval (): number of steps between rebalancings of the strips, or 0 to never rebalance
+            start_method (): multiprocessing start method of the processes
+        """
+        self.n_workers = n_workers
+        self.comm_radius = comm_radius
+        self.dt = dt
+        self.mean_pooling = mean_pooling
+        self.rebalance_interval = rebalance_interval
+        # the range of the interactions: neighbors within comm_radius, and the potential within sqrt(comm_radius)
+        self.halo = max(comm_radius, np.sqrt(comm_radius)) * (1 + 1e-6)
+        params = {'comm_radius': comm_radius, 'dt': dt, 'centralized': centralized, 'halo': self.halo}
+
+        ctx = multiprocessing.get_context(start_method)
+        borders = [ctx.Pipe() for _ in range(n_workers - 1)]
+        self.conns = []
+        self.processes = []
+        for k in range(n_workers):
+            conn, child_conn = ctx.Pipe()
+            left = borders[k - 1][1] if k > 0 else None
+            right = borders[k][0] if k < n_workers - 1 else None
+            process = ctx.Process(target=_strip_worker, args=(k, n_workers, child_conn, left, right, params),
+                                  daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+        for a, b in borders:
+            a.close()
+            b.close()
+
+        self.n_agents = 0
+        self.bounds = np.zeros((n_workers - 1,))
+        self.sum_vel = np.zeros((2,))
+        self.sum_vel2 = np.zeros((2,))
+        self.n_steps = 0
+
+    @classmethod
+    def from_env(cls, env, n_workers, **kwargs):
+        """
+        Returns: a distributed flock with the parameters of a FlockingRelativeEnv
+        """
+        return cls(n_workers, env.comm_radius, env.dt, env.centralized, env.mean_pooling, **kwargs)
+
+    def request_all(self, requests):
+        """
+        Send one request to each process, and wait for all results
+        """
+        for k, (conn, request) in enumerate(zip(self.conns, requests)):
+            try:
+                conn.send(request)
+            except OSError:
+                self.terminate()
+                raise RuntimeError('Strip process %d exited.' % k)
+        results = [None] * self.n_workers
+        pending = set(range(self.n_workers))
+        while pending:
+            ready = wait([self.conns[k] for k in pending])
+            for conn in ready:
+                k = self.conns.index(conn)
+                try:
+                    status, result = conn.recv()
+                except (EOFError, OSError):
+                    status, result = 'error', 'Strip process %d exited.' % k
+                if status == 'error':
+                    # the other processes may be waiting for this one, so all of them are stopped
+                    self.terminate()
+                    raise RuntimeError('Error in strip process %d:\n%s' % (k, result))
+                results[k] = result
+                pending.remove(k)
+        return results
+
+    def reduce(self, sums):
+        self.n_agents = sum(s[0] for s in sums)
+        self.sum_vel = np.sum([s[1] for s in sums], axis=0)
+        self.sum_vel2 = np.sum([s[2] for s in sums], axis=0)
+
+    def load(self, x):
+        """
+        Distribute the states of all agents over the strips
+        Args:
+            x (): states of all agents, with shape (n_agents, 4); the row of an agent is its id
+        """
+        x = np.asarray(x, dtype=float)
+        self.bounds = strip_bounds(x[:, 0], self.n_workers, self.halo)
+        strip = np.searchsorted(self.bounds, x[:, 0], side='right')
+        ids = np.arange(x.shape[0])
+        self.request_all([('load', ids[strip == k], x[strip == k], self.bounds) for k in range(self.n_workers)])
+        self.reduce(self.request_all([('compute',)] * self.n_workers))
+        self.n_steps = 0
+
+    def rebalance(self):
+        taken = self.request_all([('take',)] * self.n_workers)
+        x = np.zeros((self.n_agents, 4))
+        for ids, xs in taken:
+            x[ids] = xs
+        self.load(x)
+
+    def step(self, u=None):
+        """
+        Args:
+            u (): actions of all agents with shape (n_agents, 2), or None for the expert controls
+
+        Returns: the cost of the new state, as FlockingRelativeEnv.instant_cost
+
+        """
+        if self.rebalance_interval > 0 and self.n_steps > 0 and self.n_steps % self.rebalance_interval == 0:
+            n_steps = self.n_steps
+            self.rebalance()
+            self.n_steps = n_steps
+
+        # the strips drift with the flock
+        self.bounds = self.bounds + self.sum_vel[0] / max(self.n_agents, 1) * self.dt
+        self.reduce(self.request_all([('step', u, self.bounds, self.sum_vel, self.n_agents)] * self.n_workers))
+        self.n_steps += 1
+        return self.instant_cost()
+
+    def instant_cost(self):
+        mean = self.sum_vel / self.n_agents
+        return -1.0 * np.sum(self.sum_vel2 / self.n_agents - mean * mean)
+
+    def gather(self, network=False):
+        """
+        Collect the whole flock in this process
+        Args:
+            network (): whether to also return the observed network, as a sparse matrix
+
+        Returns: states, observed features and expert controls of all agents, ordered by id, and the network
+
+        """
+        results = self.request_all([('gather', self.sum_vel, self.n_agents, network)] * self.n_workers)
+        x = np.zeros((self.n_agents, 4))
+        state_values = np.zeros((self.n_agents, 6))
+        controls = np.zeros((self.n_agents, 2))
+        for result in results:
+            ids = result[0]
+            x[ids] = result[1]
+            state_values[ids] = result[2]
+            controls[ids] = result[3]
+        if not network:
+            return x, state_values, controls
+
+        rows = np.concatenate([result[4][0] for result in results])
+        cols = np.concatenate([result[4][1] for result in results])
+        weights = np.ones(rows.shape)
+        if self.mean_pooling:
+            weights = weights / np.bincount(rows, minlength=self.n_agents)[rows]
+        state_network = scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(self.n_agents, self.n_agents))
+        return x, state_values, controls, state_network
+
+    def terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+    def close(self):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(('close',))
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self.terminate()
+        for conn in self.conns:
+            conn.close()
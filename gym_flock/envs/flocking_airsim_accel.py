@@ -1,19 +1,19 @@
 import airsim
 import numpy as np
-from time import sleep
+from time import perf_counter, sleep
+from gym_flock.envs.airsim_io import AirsimStateFetcher, ControlPacer, quaternion_to_yaw
 from gym_flock.envs.flocking_relative import FlockingRelativeEnv
 from gym_flock.envs.utils import grid, parse_settings, twoflocks_old
 
 
 class FlockingAirsimAccelEnv(FlockingRelativeEnv):
 
-    def __init__(self):
+    def __init__(self, settings_file='/home/kate/Documents/AirSim/settings.json', ip='', port=41451):
 
         super(FlockingAirsimAccelEnv, self).__init__()
 
         # parse settings file with drone names and home locations
-        fname = '/home/kate/Documents/AirSim/settings.json'
-        self.names, self.home = parse_settings(fname)
+        self.names, self.home = parse_settings(settings_file)
         self.n_agents = len(self.names)
 
         # rescale locations and velocities to avoid changing potential function
@@ -23,14 +23,40 @@ class FlockingAirsimAccelEnv(FlockingRelativeEnv):
         # self.true_dt = 1.0 / 7.5  # average of actual measurements
 
         # connect to the AirSim simulator
-        self.client = airsim.MultirotorClient()
+        self.client = airsim.MultirotorClient(ip=ip, port=port)
         self.client.confirmConnection()
+
+        # states are queried concurrently, over a pool of additional connections
+        self.n_clients = 8
+        self.fetcher = AirsimStateFetcher(self.names, self.home, lambda: airsim.MultirotorClient(ip=ip, port=port),
+                                          n_clients=self.n_clients)
+
+        # stepping mode, see set_stepping()
+        self.pipelined = False
+        self.pacer = None
+        self.pending_commands = []
+        # wall-clock time of the last reset, from which self.time is measured
+        self.reset_time = None
         # self.display_msg('Initializing...')
         self.z = -50
         self.yaws = None
         self.max_accel = 0.5
 
+    def set_stepping(self, pipelined=True, control_period=None):
+        """
+        Choose how step() overlaps its RPCs
+        Args:
+            pipelined (): if True, the states are gathered while the commands of the same step are being sent, and
+                the commands are only waited for at the start of the next step
+            control_period (): if given, steps are paced at this period in seconds, and missed deadlines are counted
+        """
+        self.pipelined = pipelined
+        self.pacer = None if control_period is None else ControlPacer(control_period)
+
     def reset(self):
+        self.join_commands()
+        if self.pacer is not None:
+            self.pacer.reset()
         self.client.reset()
         self.setup_drones()
 
@@ -75,7 +101,13 @@ class FlockingAirsimAccelEnv(FlockingRelativeEnv):
         self.send_velocity_commands(v0, duration=initial_v_dt)
         states, self.yaws = self.get_states()
         self.x = states / self.scale  # get drone locations and velocities
+        # the simulator runs in real time
+        self.reset_time = perf_counter()
+        self.time = 0.0
+        if self.aggregator is not None:
+            self.aggregator.reset()
         self.compute_helpers()
+        self.reset_monitors()
         return (self.state_values, self.state_network)
 
     def step(self, u):
@@ -91,37 +123,43 @@ class FlockingAirsimAccelEnv(FlockingRelativeEnv):
         pitch = (-1.0 * u[:, 0] * np.cos(self.yaws) - 1.0 * u[:, 1] * np.sin(self.yaws))/9.8
 
         roll_pitch = np.hstack((pitch.reshape((-1,1)), roll.reshape((-1,1))))
-        self.send_accel_commands(roll_pitch)
 
-        states, self.yaws = self.get_states()
+        info = {}
+        if self.pacer is not None:
+            info['deadline_missed'] = self.pacer.wait()
+
+        if self.pipelined:
+            # the last step's commands must be done before new ones are sent
+            self.join_commands()
+            self.fetcher.fetch_async()
+            self.pending_commands = self.send_accel_commands(roll_pitch, wait=False)
+            states, self.yaws = self.fetcher.fetch_wait()
+        else:
+            self.send_accel_commands(roll_pitch)
+            states, self.yaws = self.get_states()
+
         self.x = states / self.scale  # get drone locations and velocities
+        self.time = perf_counter() - self.reset_time
         self.compute_helpers()
-        return (self.state_values, self.state_network), self.instant_cost(), False, {}
+        info['rpc_latency'] = self.fetcher.step_latency()
+        done, info = self.update_monitors(info)
+        return (self.state_values, self.state_network), self.instant_cost(), done, info
 
     def quaternion_to_yaw(self, q):
-        # yaw (z-axis rotation) from quaternion
-        w = float(q.w_val)
-        x = float(q.x_val)
-        y = float(q.y_val)
-        z = float(q.z_val)
-        siny_cosp = +2.0 * (w * z + x * y)
-        cosy_cosp = +1.0 - 2.0 * (y * y + z * z)
-        yaw = np.arctan2(siny_cosp, cosy_cosp)
-        return yaw
+        return quaternion_to_yaw(q)
 
     def get_states(self):
-        states = np.zeros(shape=(self.n_agents, 4))
-        yaws = np.zeros(shape=(self.n_agents, 1))
-        for i in range(0, self.n_agents):
-            state = self.client.getMultirotorState(vehicle_name=self.names[i])
-            states[i][0] = float(state.kinematics_estimated.position.x_val) + self.home[i][0]
-            states[i][1] = float(state.kinematics_estimated.position.y_val) + self.home[i][1]
-            states[i][2] = float(state.kinematics_estimated.linear_velocity.x_val)
-            states[i][3] = float(state.kinematics_estimated.linear_velocity.y_val)
-
-            yaws[i] = self.quaternion_to_yaw(state.kinematics_estimated.orientation)
+        """
+        Query the states of all drones concurrently. The returned arrays are reused by the next query.
+        Returns: positions and velocities of the drones, and their yaws
+        """
+        return self.fetcher.fetch()
 
-        return states, yaws
+    def latency_percentiles(self):
+        """
+        Returns: percentiles in milliseconds of the recent state RPCs, and of the recent whole state queries
+        """
+        return self.fetcher.latency_percentiles()
 
     def setup_drones(self):
         for i in range(0, self.n_agents):
@@ -135,12 +173,26 @@ class FlockingAirsimAccelEnv(FlockingRelativeEnv):
         for f in fi:
             f.join()
 
-    def send_accel_commands(self, u, duration=0.01):
+    def send_accel_commands(self, u, duration=0.01, wait=True):
         fi = []
         for i in range(self.n_agents):
             fi.append(self.client.moveByAngleZAsync(float(u[i, 0]), float(u[i, 1]), self.z, 0.0, duration, vehicle_name=self.names[i]))
+        if not wait:
+            return fi
         for f in fi:
             f.join()
+        return []
+
+    def join_commands(self):
+        for f in self.pending_commands:
+            f.join()
+        self.pending_commands = []
+
+    def pacing_stats(self):
+        """
+        Returns: number of paced steps, of missed deadlines, miss rate and worst lateness in milliseconds
+        """
+        return {} if self.pacer is None else self.pacer.stats()
 
     def send_velocity_commands(self, u, duration=0.01):
         fi = []
@@ -160,10 +212,22 @@ class FlockingAirsimAccelEnv(FlockingRelativeEnv):
             f._timeout = 10  # quads sometimes get stuck during a crash and never reach the destination
             f.join()
 
+    def close(self):
+        self.join_commands()
+        self.fetcher.close()
+
     def display_msg(self, msg):
         print(msg)
         self.client.simPrintLogMessage(msg)
 
+    def get_state(self):
+        raise ValueError('The drones of ' + type(self).__name__ + ' fly in AirSim, which cannot move them back to a '
+                         'snapshot, so it has no snapshots.')
+
+    def set_state(self, state):
+        raise ValueError('The drones of ' + type(self).__name__ + ' fly in AirSim, which cannot move them back to a '
+                         'snapshot, so it has no snapshots.')
+
     def controller(self, centralized=None):
         """
         The controller for flocking from Turner 2003.
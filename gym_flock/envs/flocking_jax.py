@@ -0,0 +1,259 @@
+"""
+JAX backend for the flocking dynamics of FlockingRelativeEnv.
+
+The dynamics, helper quantities, cost and expert controller are pure functions of the state, so that they can be
+jit-compiled, vmapped over batches of flocks of the same size, and rolled out over many steps with lax.scan. They give
+the same outputs as the NumPy methods of FlockingRelativeEnv, up to floating point rounding, and are differentiable
+with jax.grad or jax.jacfwd between changes of the communication graph.
+
+    x, helpers, cost = step(x, u, params)
+    (x, helpers), (xs, us, costs) = rollout(x, params, n_steps=1000)
+    x, helpers, costs = batch_step(xs, us, params)
+
+The functions compute in the precision of their inputs, which JAX truncates to 32 bits unless 64-bit floats are
+enabled, e.g. around the calls with jax.experimental.enable_x64(), or for the whole process with
+jax.config.update('jax_enable_x64', True). FlockingRelativeJaxEnv only enables them around its own calls, to match the
+NumPy path, and leaves the setting of the process unchanged.
+"""
+from functools import partial, wraps
+from typing import NamedTuple
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jax import lax
+from jax.experimental import enable_x64
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+class FlockParams(NamedTuple):
+    comm_radius: float
+    comm_radius2: float
+    dt: float
+
+
+class Helpers(NamedTuple):
+    diff: jnp.ndarray
+    r2: jnp.ndarray
+    adj_mat: jnp.ndarray
+    state_values: jnp.ndarray
+    state_network: jnp.ndarray
+
+
+def integrate(x, u, dt):
+    """
+    Double integrator dynamics of all agents
+    Args:
+        x (): positions and velocities, with shape (n_agents, 4)
+        u (): accelerations, with shape (n_agents, 2)
+        dt (): time step
+
+    Returns: the next state
+
+    """
+    pos = x[:, 0:2] + x[:, 2:4] * dt + u * dt * dt * 0.5
+    vel = x[:, 2:4] + u * dt
+    return jnp.concatenate((pos, vel), axis=1)
+
+
+def compute_helpers(x, comm_radius2, mean_pooling=True):
+    """
+    Pairwise differences and distances, communication graph and observations, as FlockingRelativeEnv.compute_helpers
+    """
+    n_agents = x.shape[0]
+    diff = x[:, None, :] - x[None, :, :]
+    r2 = diff[:, :, 0] * diff[:, :, 0] + diff[:, :, 1] * diff[:, :, 1]
+    eye = jnp.eye(n_agents, dtype=bool)
+    # the features divide by a diagonal of ones rather than infinities, which gives the same zero features of each
+    # agent with itself, but keeps their gradients finite
+    r2_div = jnp.where(eye, 1.0, r2)
+    r2 = jnp.where(eye, jnp.inf, r2)
+
+    adj_mat = (r2 < comm_radius2).astype(x.dtype)
+    n_neighbors = jnp.sum(adj_mat, axis=1, keepdims=True)
+    n_neighbors = jnp.where(n_neighbors == 0, 1.0, n_neighbors)
+
+    r4 = r2_div * r2_div
+    x_features = jnp.stack((diff[:, :, 2], diff[:, :, 0] / r4, diff[:, :, 0] / r2_div,
+                            diff[:, :, 3], diff[:, :, 1] / r4, diff[:, :, 1] / r2_div), axis=2)
+    state_values = jnp.sum(x_features * adj_mat[:, :, None], axis=1)
+    state_network = adj_mat / n_neighbors if mean_pooling else adj_mat
+    return Helpers(diff, r2, adj_mat, state_values, state_network)
+
+
+def instant_cost(x):
+    return -1.0 * jnp.sum(jnp.var(x[:, 2:4], axis=0))
+
+
+def potential_grad(pos_diff, r2, comm_radius):
+    """
+    Gradient of the flocking potential of Turner 2003, as FlockingRelativeEnv.potential_grad
+    """
+    grad = -2.0 * pos_diff / (r2 * r2) + 2 * pos_diff / r2
+    return jnp.where(r2 > comm_radius, 0.0, grad)
+
+
+def controller(helpers, comm_radius, centralized=True):
+    """
+    The controller for flocking from Turner 2003, as FlockingRelativeEnv.controller
+    """
+    diff = helpers.diff
+    potentials = jnp.concatenate((diff, potential_grad(diff[:, :, 0], helpers.r2, comm_radius)[:, :, None],
+                                  potential_grad(diff[:, :, 1], helpers.r2, comm_radius)[:, :, None]), axis=2)
+    if not centralized:
+        potentials = potentials * helpers.adj_mat[:, :, None]
+
+    p_sum = jnp.sum(potentials, axis=1)
+    controls = jnp.stack((-p_sum[:, 4] - p_sum[:, 2], -p_sum[:, 3] - p_sum[:, 5]), axis=1)
+    return jnp.clip(controls, -100, 100)
+
+
+compute_helpers_jit = jax.jit(compute_helpers, static_argnames=('mean_pooling',))
+controller_jit = jax.jit(controller, static_argnames=('centralized',))
+
+
+@partial(jax.jit, static_argnames=('mean_pooling',))
+def step(x, u, params, mean_pooling=True):
+    """
+    Returns: the next state, its helper quantities and the cost
+
+    """
+    x = integrate(x, u, params.dt)
+    return x, compute_helpers(x, params.comm_radius2, mean_pooling), instant_cost(x)
+
+
+@partial(jax.jit, static_argnames=('n_steps', 'centralized', 'mean_pooling'))
+def rollout(x, params, n_steps, centralized=True, mean_pooling=True):
+    """
+    Roll out the expert controller
+    Args:
+        x (): initial state, with shape (n_agents, 4)
+        params (): FlockParams
+        n_steps (): number of steps
+        centralized (): whether the controller uses all agents, or only neighbors
+        mean_pooling (): whether the observed network is normalized by the number of neighbors
+
+    Returns: the final state and its helpers, and the states after each step, the controls and the costs
+
+    """
+    def body(carry, _):
+        x, helpers = carry
+        u = controller(helpers, params.comm_radius, centralized)
+        x = integrate(x, u, params.dt)
+        helpers = compute_helpers(x, params.comm_radius2, mean_pooling)
+        return (x, helpers), (x, u, instant_cost(x))
+
+    helpers = compute_helpers(x, params.comm_radius2, mean_pooling)
+    return lax.scan(body, (x, helpers), None, length=n_steps)
+
+
+@partial(jax.jit, static_argnames=('mean_pooling',))
+def batch_step(x, u, params, mean_pooling=True):
+    """
+    Step a batch of flocks of the same size, with states of shape (n_flocks, n_agents, 4)
+    """
+    return jax.vmap(lambda xb, ub: step(xb, ub, params, mean_pooling))(x, u)
+
+
+@partial(jax.jit, static_argnames=('centralized', 'mean_pooling'))
+def batch_controller(x, params, centralized=True, mean_pooling=True):
+    """
+    Expert controls of a batch of flocks of the same size, with states of shape (n_flocks, n_agents, 4)
+    """
+    def flock_controller(xb):
+        return controller(compute_helpers(xb, params.comm_radius2, mean_pooling), params.comm_radius, centralized)
+    return jax.vmap(flock_controller)(x)
+
+
+@partial(jax.jit, static_argnames=('n_steps', 'centralized', 'mean_pooling'))
+def batch_rollout(x, params, n_steps, centralized=True, mean_pooling=True):
+    """
+    Roll out the expert controller on a batch of flocks of the same size, with states of shape (n_flocks, n_agents, 4)
+    """
+    return jax.vmap(lambda xb: rollout(xb, params, n_steps, centralized, mean_pooling))(x)
+
+
+def x64(method):
+    """
+    Run method with 64-bit floats enabled in JAX
+    """
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with enable_x64():
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class FlockingRelativeJaxEnv(FlockingRelativeEnv):
+    """
+    FlockingRelativeEnv with the dynamics, helpers, cost and controller computed by the JAX backend.
+    The helpers are exposed as read-only NumPy arrays, so that monitors and aggregation work as usual.
+    """
+
+    @property
+    def params(self):
+        return FlockParams(self.comm_radius, self.comm_radius2, self.dt)
+
+    def set_helpers(self, helpers):
+        self.stale_helpers = False
+        self.helpers = helpers
+        self.diff = np.asarray(helpers.diff)
+        self.r2 = np.asarray(helpers.r2)
+        self.adj_mat = np.asarray(helpers.adj_mat)
+        self.state_values = np.asarray(helpers.state_values)
+        self.state_network = np.asarray(helpers.state_network)
+        if self.aggregator is not None:
+            self.state_values = self.aggregator.update(self.state_values, self.adj_mat)
+
+    @x64
+    def compute_helpers(self):
+        self.set_helpers(compute_helpers_jit(jnp.asarray(self.x), self.comm_radius2, self.mean_pooling))
+
+    @x64
+    def step(self, u):
+        assert u.shape == (self.n_agents, self.nu)
+        if self.n_substeps > 1:
+            # the substeps are integrated on the host, and only the last helpers are computed by JAX
+            return super(FlockingRelativeJaxEnv, self).step(u)
+        self.u = u
+
+        x, helpers, cost = step(jnp.asarray(self.x), jnp.asarray(u), self.params, self.mean_pooling)
+        # the state stays writable, as subclasses and resets modify it in place
+        self.x = np.array(x)
+        self.time += self.dt
+        self.set_helpers(helpers)
+        done, info = self.update_monitors()
+
+        return (self.state_values, self.state_network), float(cost), done, info
+
+    @x64
+    def instant_cost(self):
+        return float(instant_cost(jnp.asarray(self.x)))
+
+    @x64
+    def controller(self, centralized=None):
+        if centralized is None:
+            centralized = self.centralized
+        self.update_helpers()
+        return np.asarray(controller_jit(self.helpers, self.comm_radius, centralized))
+
+    @x64
+    def rollout(self, n_steps, centralized=None):
+        """
+        Roll out the expert controller from the current state in one compiled loop. The monitors are not updated, and
+        the multi-hop aggregation only advances by one step, with the final state.
+        Args:
+            n_steps (): number of steps
+            centralized (): whether the controller uses all agents, or only neighbors
+
+        Returns: the states after each step, the controls and the costs, as NumPy arrays
+
+        """
+        if centralized is None:
+            centralized = self.centralized
+        (x, helpers), (xs, us, costs) = rollout(jnp.asarray(self.x), self.params, n_steps, centralized,
+                                                self.mean_pooling)
+        self.x = np.array(x)
+        self.u = np.asarray(us[-1])
+        self.time += n_steps * self.dt
+        self.set_helpers(helpers)
+        return np.asarray(xs), np.asarray(us), np.asarray(costs)
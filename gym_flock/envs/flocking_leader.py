@@ -1,6 +1,4 @@
-import gym
 import numpy as np
-import matplotlib.pyplot as plt
 from gym_flock.envs.flocking_relative import FlockingRelativeEnv
 
 
@@ -20,20 +18,14 @@ class FlockingLeaderEnv(FlockingRelativeEnv):
         self.mask = np.ones((self.n_agents,))
         self.mask[0:self.n_leaders] = 0
 
-    def step(self, u):
-        assert u.shape == (self.n_agents, self.nu)
-        # u = np.clip(u, a_min=-self.max_accel, a_max=self.max_accel)
-        self.u = u
-
+    def integrate(self, u):
+        # the leaders ignore the actions
         # x, y position
-        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + self.u[:, 0] * self.dt * self.dt * 0.5 * self.mask
-        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + self.u[:, 1] * self.dt * self.dt * 0.5 * self.mask
+        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + u[:, 0] * self.dt * self.dt * 0.5 * self.mask
+        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + u[:, 1] * self.dt * self.dt * 0.5 * self.mask
         # x, y velocity
-        self.x[:, 2] = self.x[:, 2] + self.u[:, 0] * self.dt * self.mask
-        self.x[:, 3] = self.x[:, 3] + self.u[:, 1] * self.dt * self.mask
-
-        self.compute_helpers()
-        return (self.state_values, self.state_network), self.instant_cost(), False, {}
+        self.x[:, 2] = self.x[:, 2] + u[:, 0] * self.dt * self.mask
+        self.x[:, 3] = self.x[:, 3] + u[:, 1] * self.dt * self.mask
 
     def reset(self):
         super(FlockingLeaderEnv, self).reset()
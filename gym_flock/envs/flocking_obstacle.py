@@ -4,8 +4,6 @@ from gym.utils import seeding
 import numpy as np
 import configparser
 from os import path
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import gca
 from gym_flock.envs.flocking_relative import FlockingRelativeEnv
 
 def grid(N, side=5):
@@ -37,25 +35,16 @@ class FlockingObstacleEnv(FlockingRelativeEnv):
 
 
 
-    def step(self, u):
-
-        #u = np.reshape(u, (-1, 2))
-        assert u.shape == (self.n_agents, self.nu)
-        #u = np.clip(u, a_min=-self.max_accel, a_max=self.max_accel)
-        self.u = u
-
+    def integrate(self, u):
+        # the obstacles ignore the actions
         # x position
-        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + self.u[:, 0] * self.dt * self.dt * 0.5 * self.mask
+        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + u[:, 0] * self.dt * self.dt * 0.5 * self.mask
         # y position
-        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + self.u[:, 1] * self.dt * self.dt * 0.5 * self.mask
+        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + u[:, 1] * self.dt * self.dt * 0.5 * self.mask
         # x velocity
-        self.x[:, 2] = self.x[:, 2] + self.u[:, 0] * self.dt * self.mask
+        self.x[:, 2] = self.x[:, 2] + u[:, 0] * self.dt * self.mask
         # y velocity
-        self.x[:, 3] = self.x[:, 3] + self.u[:, 1] * self.dt * self.mask
-
-        self.compute_helpers()
-
-        return (self.state_values, self.state_network), self.instant_cost(), False, {}
+        self.x[:, 3] = self.x[:, 3] + u[:, 1] * self.dt * self.mask
 
     # def reset(self):
     #     super(FlockingObstacleEnv, self).reset()
@@ -75,12 +64,17 @@ class FlockingObstacleEnv(FlockingRelativeEnv):
         # keep good initialization
         self.mean_vel = np.mean(self.x[self.n_obstacles:, 2:4], axis=0) 
         self.init_vel = self.x[self.n_obstacles:, 2:4]
+        self.time = 0.0
         #self.a_net = self.get_connectivity(self.x)
+        if self.aggregator is not None:
+            self.aggregator.reset()
         self.compute_helpers()
+        self.reset_monitors()
         return (self.state_values, self.state_network)
 
     def compute_helpers(self):
 
+        self.stale_helpers = False
         self.diff = self.x.reshape((self.n_agents, 1, self.nx_system)) - self.x.reshape((1, self.n_agents, self.nx_system))
 
         # broken agents don't contribute to velocity differences
@@ -110,6 +104,15 @@ class FlockingObstacleEnv(FlockingRelativeEnv):
         else:
             self.state_network = self.adj_mat
 
+        if self.aggregator is not None:
+            self.state_values = self.aggregator.update(self.state_values, self.adj_mat)
+
+    def velocity_weights(self):
+        # the velocity differences of compute_helpers are zero for pairs with an obstacle
+        weights = np.ones((self.n_agents,))
+        weights[0:self.n_obstacles] = 0
+        return weights
+
     def render(self, mode='human'):
         """
         Render the environment with agents as points in 2D space
@@ -0,0 +1,304 @@
+import gym
+from gym import spaces
+from gym.utils import seeding
+import numpy as np
+import scipy.sparse
+from scipy.spatial import cKDTree
+
+
+def parse_list(args, key, fallback=None):
+    """
+    Returns: the comma-separated floats of a config key
+    """
+    value = args.get(key, fallback=fallback)
+    if value is None:
+        return None
+    return [float(v) for v in str(value).split(',')]
+
+
+class FlockingRaggedEnv(gym.Env):
+    """
+    A batch of flocks of different sizes and parameters, stepped together, as in graph batching. The agents of all
+    flocks are packed into one array, flock after flock, where flock f holds the rows offsets[f]:offsets[f + 1] and
+    flock_id gives the flock of every agent. Every flock has its own comm_radius, dt and v_max.
+
+    Neighbors are found for all flocks at once with one KD-tree, over the positions scaled by the interaction range of
+    their flock and with the flock id as an extra coordinate, which separates the flocks. Observations are the features
+    of FlockingRelativeEnv for all agents, with shape (n_total, n_features), and the network as one block-diagonal
+    sparse CSR matrix with shape (n_total, n_total), whose block f is the state_network of flock f. Actions and expert
+    controls have shape (n_total, nu), and rewards are the instant costs of the flocks, with shape (n_flocks,).
+    """
+
+    def __init__(self, n_agents=(50, 100), comm_radius=0.9, dt=0.01, v_max=5.0):
+        """
+        Args:
+            n_agents (): number of agents of each flock
+            comm_radius (): communication radius, for all flocks or of each flock
+            dt (): time step, for all flocks or of each flock
+            v_max (): largest initial velocity, for all flocks or of each flock
+        """
+        self.mean_pooling = True  # normalize the adjacency matrix by the number of neighbors or not
+        self.centralized = True
+
+        # number states per agent
+        self.nx_system = 4
+        # numer of observations per agent
+        self.n_features = 6
+        # number of actions per agent
+        self.nu = 2
+
+        self.r_max = 1.0
+        self.max_accel = 1
+
+        self.x = None
+        self.u = None
+        self.state_values = None
+        self.state_network = None
+
+        self.fig = None
+        self.fig_agents = None
+        self.lines = None
+
+        self.set_flocks(n_agents, comm_radius, dt, v_max)
+        self.seed()
+
+    def params_from_cfg(self, args):
+        """
+        Read the flocks from a config section, with comma-separated values of n_agents, comm_radius, dt and v_max
+        """
+        n_agents = [int(n) for n in parse_list(args, 'n_agents')]
+        self.set_flocks(n_agents, parse_list(args, 'comm_radius'), parse_list(args, 'dt'), parse_list(args, 'v_max'))
+
+    def set_flocks(self, n_agents, comm_radius=None, dt=None, v_max=None):
+        """
+        Change the sizes and parameters of the flocks, e.g. between episodes of a curriculum. Parameters that are not
+        given keep their values if the number of flocks is unchanged, and their first value otherwise.
+        """
+        n_agents = np.asarray(n_agents, dtype=int).reshape((-1,))
+        n_flocks = len(n_agents)
+
+        def per_flock(value, old):
+            if value is None:
+                value = old if len(old) == n_flocks else old[0]
+            value = np.asarray(value, dtype=float).reshape((-1,))
+            return np.broadcast_to(value, (n_flocks,)).copy()
+
+        self.comm_radius = per_flock(comm_radius, getattr(self, 'comm_radius', np.array([0.9])))
+        self.dt = per_flock(dt, getattr(self, 'dt', np.array([0.01])))
+        self.v_max = per_flock(v_max, getattr(self, 'v_max', np.array([5.0])))
+        self.comm_radius2 = self.comm_radius * self.comm_radius
+        # the range of the interactions: neighbors within comm_radius, and the potential within sqrt(comm_radius)
+        self.cutoff = np.maximum(self.comm_radius, np.sqrt(self.comm_radius)) * (1 + 1e-6)
+
+        self.n_flocks = n_flocks
+        self.n_agents = n_agents
+        self.offsets = np.concatenate(([0], np.cumsum(n_agents)))
+        self.n_total = int(self.offsets[-1])
+        self.flock_id = np.repeat(np.arange(n_flocks), n_agents)
+
+        self.action_space = spaces.Box(low=-self.max_accel, high=self.max_accel, shape=(self.n_total, self.nu),
+                                       dtype=np.float32)
+        self.observation_space = spaces.Box(low=-np.Inf, high=np.Inf, shape=(self.n_total, self.n_features),
+                                            dtype=np.float32)
+        self.x = None
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def flock(self, f):
+        """
+        Returns: the rows of flock f
+        """
+        return slice(self.offsets[f], self.offsets[f + 1])
+
+    def padded(self, values, fill=0.0):
+        """
+        Pad packed per-agent values to a dense batch
+        Args:
+            values (): per-agent values with shape (n_total, ...)
+            fill (): value of the padding
+
+        Returns: values with shape (n_flocks, max(n_agents), ...), and the mask of the real agents
+
+        """
+        n_max = int(np.max(self.n_agents))
+        index = np.arange(self.n_total) - self.offsets[self.flock_id]
+        padded = np.full((self.n_flocks, n_max) + np.shape(values)[1:], fill, dtype=np.asarray(values).dtype)
+        padded[self.flock_id, index] = values
+        mask = np.zeros((self.n_flocks, n_max), dtype=bool)
+        mask[self.flock_id, index] = True
+        return padded, mask
+
+    def step(self, u):
+        assert u.shape == (self.n_total, self.nu)
+        self.u = u
+        dt = self.dt[self.flock_id].reshape((-1, 1))
+
+        # x, y position
+        self.x[:, 0:2] = self.x[:, 0:2] + self.x[:, 2:4] * dt + self.u * dt * dt * 0.5
+        # x, y velocity
+        self.x[:, 2:4] = self.x[:, 2:4] + self.u * dt
+
+        self.compute_helpers()
+        return (self.state_values, self.state_network), self.instant_cost(), False, {}
+
+    def neighbor_pairs(self):
+        """
+        Returns: arrays i, j, with i < j, of the pairs of agents of the same flock within the interaction range
+        """
+        points = np.empty((self.n_total, 3))
+        points[:, 0:2] = self.x[:, 0:2] / self.cutoff[self.flock_id].reshape((-1, 1))
+        # agents of different flocks are 3 scaled ranges apart
+        points[:, 2] = 3.0 * self.flock_id
+        pairs = cKDTree(points).query_pairs(1.0, output_type='ndarray')
+        return pairs[:, 0], pairs[:, 1]
+
+    def compute_helpers(self):
+        i, j = self.neighbor_pairs()
+        diff = self.x[i] - self.x[j]
+        r2 = np.multiply(diff[:, 0], diff[:, 0]) + np.multiply(diff[:, 1], diff[:, 1])
+        pair_flock = self.flock_id[i]
+
+        adjacent = r2 < self.comm_radius2[pair_flock]
+        self.pair_i = i
+        self.pair_j = j
+        self.pair_diff = diff
+        self.pair_r2 = r2
+        self.pair_adjacent = adjacent
+        self.pair_near = r2 <= self.comm_radius[pair_flock]
+
+        ia = i[adjacent]
+        ja = j[adjacent]
+        da = diff[adjacent]
+        r2a = r2[adjacent]
+        features = (da[:, 2], np.divide(da[:, 0], np.multiply(r2a, r2a)), np.divide(da[:, 0], r2a),
+                    da[:, 3], np.divide(da[:, 1], np.multiply(r2a, r2a)), np.divide(da[:, 1], r2a))
+        # the features are odd in the relative state, so agent j gets the opposite of agent i
+        self.state_values = np.zeros((self.n_total, self.n_features))
+        for k, feature in enumerate(features):
+            self.state_values[:, k] = (np.bincount(ia, weights=feature, minlength=self.n_total)
+                                       - np.bincount(ja, weights=feature, minlength=self.n_total))
+
+        rows = np.concatenate((ia, ja))
+        cols = np.concatenate((ja, ia))
+        weights = np.ones(rows.shape)
+        if self.mean_pooling:
+            weights = weights / np.bincount(rows, minlength=self.n_total)[rows]
+        self.state_network = scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(self.n_total, self.n_total))
+
+    def pair_sums(self, weights):
+        """
+        Returns: sums over the neighbor pairs of each agent, of values odd in the relative state of the pair
+        """
+        return (np.bincount(self.pair_i, weights=weights, minlength=self.n_total)
+                - np.bincount(self.pair_j, weights=weights, minlength=self.n_total))
+
+    def flock_sums(self, values):
+        """
+        Returns: sums over each flock of per-agent values, with shape (n_flocks, n_values)
+        """
+        return np.stack([np.bincount(self.flock_id, weights=values[:, k], minlength=self.n_flocks)
+                         for k in range(values.shape[1])], axis=1)
+
+    def instant_cost(self):  # sum of differences in velocities
+        v = self.x[:, 2:4]
+        mean = self.flock_sums(v) / self.n_agents.reshape((-1, 1))
+        variance = self.flock_sums(np.square(v - mean[self.flock_id])) / self.n_agents.reshape((-1, 1))
+        return -1.0 * np.sum(variance, axis=1)
+
+    def controller(self, centralized=None):
+        """
+        The controller for flocking from Turner 2003, for every flock.
+        Returns: the optimal action
+        """
+        if centralized is None:
+            centralized = self.centralized
+
+        near = self.pair_near if centralized else self.pair_near & self.pair_adjacent
+        grad = np.zeros((self.n_total, 2))
+        for k in range(2):
+            pos_diff = np.where(near, self.pair_diff[:, k], 0.0)
+            r2 = np.where(near, self.pair_r2, 1.0)
+            grad[:, k] = self.pair_sums(-2.0 * np.divide(pos_diff, np.multiply(r2, r2)) + 2 * np.divide(pos_diff, r2))
+
+        v = self.x[:, 2:4]
+        if centralized:
+            alignment = self.n_agents[self.flock_id].reshape((-1, 1)) * v - self.flock_sums(v)[self.flock_id]
+        else:
+            alignment = np.zeros((self.n_total, 2))
+            for k in range(2):
+                alignment[:, k] = self.pair_sums(np.where(self.pair_adjacent, self.pair_diff[:, k + 2], 0.0))
+        return np.clip(-grad - alignment, -100, 100)
+
+    def reset(self):
+        x = np.zeros((self.n_total, self.nx_system))
+        for f in range(self.n_flocks):
+            x[self.flock(f)] = self.reset_flock(f)
+        self.x = x
+        self.compute_helpers()
+        return (self.state_values, self.state_network)
+
+    def reset_flock(self, f):
+        """
+        Returns: initial state of flock f, drawn as by FlockingRelativeEnv.reset
+        """
+        n_agents = self.n_agents[f]
+        r_max = self.r_max * np.sqrt(n_agents)
+        v_max = self.v_max[f]
+        x = np.zeros((n_agents, self.nx_system))
+        degree = 0
+        min_dist = 0
+        min_dist_thresh = 0.1
+
+        # generate an initial configuration with all agents connected,
+        # and minimum distance between agents > min_dist_thresh
+        while degree < 2 or min_dist < min_dist_thresh:
+            length = np.sqrt(np.random.uniform(0, r_max, size=(n_agents,)))
+            angle = np.pi * np.random.uniform(0, 2, size=(n_agents,))
+            x[:, 0] = length * np.cos(angle)
+            x[:, 1] = length * np.sin(angle)
+
+            bias = np.random.uniform(low=-v_max, high=v_max, size=(2,))
+            x[:, 2] = np.random.uniform(low=-v_max, high=v_max, size=(n_agents,)) + bias[0]
+            x[:, 3] = np.random.uniform(low=-v_max, high=v_max, size=(n_agents,)) + bias[1]
+
+            a_net = np.sum(np.square(x[:, np.newaxis, 0:2] - x[np.newaxis, :, 0:2]), axis=2)
+            np.fill_diagonal(a_net, np.Inf)
+            min_dist = np.sqrt(np.min(a_net))
+            degree = np.min(np.sum((a_net < self.comm_radius2[f]).astype(int), axis=1))
+        return x
+
+    def render(self, mode='human'):
+        """
+        Render every flock in its own subplot, with agents as points in 2D space
+        """
+        # the figure is made again when set_flocks changed the flocks
+        if self.fig is None or not np.array_equal(self.fig_agents, self.n_agents):
+            # plotting is only loaded by the first render
+            import matplotlib.pyplot as plt
+
+            if self.fig is not None:
+                plt.close(self.fig)
+            plt.ion()
+            fig, axes = plt.subplots(1, self.n_flocks, squeeze=False, figsize=(4 * self.n_flocks, 4))
+            self.lines = []
+            for f, ax in enumerate(axes[0]):
+                line, = ax.plot(self.x[self.flock(f), 0], self.x[self.flock(f), 1], 'bo')
+                ax.plot([0], [0], 'kx')
+                r_max = self.r_max * np.sqrt(self.n_agents[f])
+                ax.set_xlim(-1.0 * r_max, 1.0 * r_max)
+                ax.set_ylim(-1.0 * r_max, 1.0 * r_max)
+                ax.set_title('Flock %d, %d agents' % (f, self.n_agents[f]))
+                self.lines.append(line)
+            self.fig = fig
+            self.fig_agents = self.n_agents.copy()
+
+        for f, line in enumerate(self.lines):
+            line.set_xdata(self.x[self.flock(f), 0])
+            line.set_ydata(self.x[self.flock(f), 1])
+        self.fig.canvas.draw()
+        self.fig.canvas.flush_events()
+
+    def close(self):
+        pass
@@ -3,9 +3,8 @@ from gym import spaces, error, utils
 from gym.utils import seeding
 import numpy as np
 import configparser
+import os
 from os import path
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import gca
 
 font = {'family': 'sans-serif',
         'weight': 'bold',
@@ -52,6 +51,9 @@ class FlockingRelativeEnv(gym.Env):
         self.mean_vel = None
         self.init_vel = None
 
+        # simulated time since the last reset, advanced by the duration of every integration step
+        self.time = 0.0
+
         self.max_accel = 1
         self.action_space = spaces.Box(low=-self.max_accel, high=self.max_accel, shape=(2 * self.n_agents,),
                                        dtype=np.float32)
@@ -59,6 +61,43 @@ class FlockingRelativeEnv(gym.Env):
         self.observation_space = spaces.Box(low=-np.Inf, high=np.Inf, shape=(self.n_agents, self.n_features),
                                             dtype=np.float32)
 
+        # optional delayed multi-hop aggregation of the observed features
+        self.aggregator = None
+
+        # optional monitors, updated at every step from the helper quantities
+        self.monitors = []
+        self.metrics = None
+        self.graph_health = None
+        self.safety = None
+        self.consensus = None
+
+        # neighbor list of sparse_controller, built on first use
+        self.controller_neighbors = None
+
+        # whether the state was restored by set_state since the helpers were computed
+        self.stale_helpers = False
+
+        # control decimation: every step holds the action for n_substeps integration steps of dt, or recomputes the
+        # expert controls at every substep if expert_substeps, and builds the observation only after the last one
+        self.n_substeps = 1
+        self.expert_substeps = False
+
+        # integrator of the closed-loop expert dynamics in step_expert, see gym_flock.envs.integrators
+        self.integrator = 'euler'
+        self.integrator_tol = (1e-6, 1e-8)
+        self.stepper = None
+        # whether integrate draws the duration of every integration step, which step_expert cannot reproduce
+        self.random_dt = False
+
+        # execution of the dense all-pairs computations: 'dense' materializes the N x N x 4 and N x N x 6 pairwise
+        # tensors, 'tiled' reduces row blocks of agents of at most tile_bytes each, and 'threaded' distributes the
+        # row blocks over n_threads threads, all with identical results
+        self.execution = 'dense'
+        self.tile_bytes = 2 ** 22
+        self.n_threads = None
+        self.executor = None
+        self.executor_pid = None
+
         self.fig = None
         self.line1 = None
 
@@ -83,32 +122,409 @@ class FlockingRelativeEnv(gym.Env):
         self.v_bias = self.v_max
         self.dt = args.getfloat('dt')
 
+        filter_len = args.getint('filter_length', fallback=0)
+        if filter_len > 0:
+            pooling = [pool for pool in ('sum', 'mean', 'min', 'max') if args.getboolean(pool + '_pooling', fallback=False)]
+            self.enable_aggregation(filter_len, pooling or ['sum'])
+        elif self.aggregator is not None:
+            self.enable_aggregation(self.aggregator.filter_len, self.aggregator.pooling)
+
+        if args.getboolean('track_metrics', fallback=False) and self.metrics is None:
+            self.enable_metrics(args.getfloat('collision_radius', fallback=0.1))
+
+        if args.getboolean('track_graph_health', fallback=False) and self.graph_health is None:
+            self.enable_graph_health(terminate_on_fragment=args.getboolean('fragment_terminates', fallback=False),
+                                     min_lambda2=args.getfloat('min_algebraic_connectivity', fallback=None),
+                                     lambda2_interval=args.getint('algebraic_connectivity_interval', fallback=1))
+
+        if args.get('safety_mode', fallback=None) and self.safety is None:
+            self.enable_safety(collision_radius=args.getfloat('collision_radius', fallback=0.1),
+                               max_speed=args.getfloat('safety_max_speed', fallback=None),
+                               max_accel=args.getfloat('safety_max_accel', fallback=None),
+                               mode=args.get('safety_mode'))
+
+        if 'execution' in args:
+            self.set_execution(args.get('execution'), args.getint('tile_bytes', fallback=None),
+                               args.getint('n_threads', fallback=None))
+
+        if 'substeps' in args:
+            self.set_substeps(args.getint('substeps'), args.getboolean('expert_substeps', fallback=False))
+
+        if 'integrator' in args:
+            self.set_integrator(args.get('integrator'), rtol=args.getfloat('integrator_rtol', fallback=1e-6),
+                                atol=args.getfloat('integrator_atol', fallback=1e-8),
+                                max_dt=args.getfloat('integrator_max_dt', fallback=None))
+
+        if args.getint('consensus_window', fallback=0) > 0 and self.consensus is None:
+            self.enable_consensus_detection(window=args.getint('consensus_window'),
+                                            max_variance=args.getfloat('consensus_variance', fallback=1e-3),
+                                            max_rate=args.getfloat('consensus_rate', fallback=1e-2),
+                                            max_edge_changes=args.getint('consensus_edge_changes', fallback=0),
+                                            mode=args.get('consensus_mode', fallback='truncate'))
+
+    def enable_aggregation(self, filter_len, pooling=('sum',)):
+        """
+        Observe delayed multi-hop information: each agent's features, its neighbors' features from the last step,
+        their neighbors' features from two steps ago, and so on
+        Args:
+            filter_len (): number of hops of information kept per agent, including its own features
+            pooling (): pooling operations over neighbors, from 'sum', 'mean', 'min' and 'max'
+        """
+        from gym_flock.envs.aggregation import KHopAggregator
+        self.aggregator = KHopAggregator(self.n_agents, self.n_features, filter_len, pooling)
+        self.observation_space = spaces.Box(low=-np.Inf, high=np.Inf, shape=(self.n_agents, self.aggregator.n_outputs),
+                                            dtype=np.float32)
+
+    def set_execution(self, execution, tile_bytes=None, n_threads=None):
+        """
+        Choose how compute_helpers and controller compute the all-pairs quantities
+        Args:
+            execution (): 'dense', 'tiled' to process row blocks of agents without materializing the pairwise
+                tensors diff and x_features, or 'threaded' to process the row blocks on a thread pool
+            tile_bytes (): size of the pairwise temporaries of one row block, e.g. the size of a cache
+            n_threads (): number of threads of the threaded execution, the number of CPUs by default
+        """
+        if execution not in ('dense', 'tiled', 'threaded'):
+            raise ValueError('Unknown execution: ' + str(execution))
+        self.execution = execution
+        if tile_bytes is not None:
+            self.tile_bytes = tile_bytes
+        if n_threads != self.n_threads:
+            self.shutdown_executor()
+            self.n_threads = n_threads
+
+    def set_substeps(self, n_substeps, expert=False):
+        """
+        Choose the number of integration steps per step, e.g. to act at 10 Hz with dt = 0.01 and n_substeps = 10
+        Args:
+            n_substeps (): number of integration steps of dt per step, between two observations
+            expert (): whether to replace the action by the expert controls of sparse_controller after the first
+                substep, e.g. to roll out the expert with observations only at the control rate
+        """
+        if n_substeps < 1:
+            raise ValueError('The number of substeps must be at least 1, not ' + str(n_substeps))
+        self.n_substeps = n_substeps
+        self.expert_substeps = expert
+
+    def set_integrator(self, integrator, rtol=1e-6, atol=1e-8, max_dt=None):
+        """
+        Choose the integrator of step_expert
+        Args:
+            integrator (): 'euler', 'verlet', 'rk4' or 'adaptive', see gym_flock.envs.integrators
+            rtol (): relative tolerance of the local error, of the adaptive integrator and of the error estimates
+            atol (): absolute tolerance of the local error
+            max_dt (): largest step size of the adaptive integrator, or None
+        """
+        from gym_flock.envs.integrators import INTEGRATORS, AdaptiveStepper
+        if integrator not in INTEGRATORS:
+            raise ValueError('Unknown integrator: ' + str(integrator))
+        if self.random_dt:
+            raise ValueError('The integration steps of ' + type(self).__name__ + ' have random durations, so it has no '
+                             'integrator to choose.')
+        self.integrator = integrator
+        self.integrator_tol = (rtol, atol)
+        self.stepper = None
+        if integrator == 'adaptive':
+            self.stepper = AdaptiveStepper(self.dt, rtol, atol, max_dt)
+
+    def expert_acceleration(self, x):
+        """
+        Returns: the accelerations of the agents in state x under the expert controls of sparse_controller
+        """
+        state = self.x
+        self.x = x
+        try:
+            u = self.sparse_controller()
+        finally:
+            self.x = state
+        mask = getattr(self, 'mask', None)
+        if mask is not None:
+            u = u * mask.reshape((-1, 1))
+        return u
+
+    def step_expert(self):
+        """
+        Step the closed-loop dynamics of the expert controller of sparse_controller, with the integrator chosen by
+        set_integrator, for n_substeps integration steps. The fixed-step integrators advance by dt per integration
+        step, and the adaptive integrator by the step sizes it chooses to meet its tolerances.
+        Returns: observation, cost, done and info as step, with info['integrator'] holding the time advanced, the step
+        sizes, the largest estimated relative error of the integration steps, or None if the integrator does not
+        estimate it, and the number of rejected adaptive steps
+
+        """
+        from gym_flock.envs.integrators import euler_step, rk4_step, verlet_step
+        if self.random_dt:
+            raise ValueError('The integration steps of ' + type(self).__name__ + ' have random durations, which '
+                             'step_expert cannot integrate; use step(controller()) instead.')
+        rtol, atol = self.integrator_tol
+        x = self.x.copy()
+        step_sizes = []
+        errors = []
+        n_rejected = 0
+        for _ in range(self.n_substeps):
+            if self.integrator == 'euler':
+                x = euler_step(x, self.expert_acceleration, self.dt)
+                step_sizes.append(self.dt)
+            elif self.integrator == 'verlet':
+                x, error = verlet_step(x, self.expert_acceleration, self.dt, rtol, atol)
+                step_sizes.append(self.dt)
+                errors.append(error)
+            elif self.integrator == 'rk4':
+                x = rk4_step(x, self.expert_acceleration, self.dt)
+                step_sizes.append(self.dt)
+            else:
+                x, dt, error, rejected = self.stepper.step(x, self.expert_acceleration)
+                step_sizes.append(dt)
+                errors.append(error)
+                n_rejected += rejected
+
+        np.copyto(self.x, x)
+        self.time += float(np.sum(step_sizes))
+        # the controls vary within the integration steps
+        self.u = None
+        self.compute_helpers()
+        info = {'integrator': {'time': float(np.sum(step_sizes)), 'dt': step_sizes,
+                               'error': max(errors) if errors else None, 'rejected': n_rejected}}
+        done, info = self.update_monitors(info)
+        return (self.state_values, self.state_network), self.instant_cost(), done, info
+
+    def map_row_blocks(self, fn, *args):
+        """
+        Apply fn(start, stop, *args) to every row block, on the thread pool in the threaded execution.
+        NumPy releases the GIL in its loops over the pairs of a block, so the blocks run in parallel.
+        Returns: list of the results for each block
+        """
+        blocks = self.row_blocks()
+        if self.execution != 'threaded' or len(blocks) == 1:
+            return [fn(start, stop, *args) for start, stop in blocks]
+
+        # the threads of a pool do not survive a fork, e.g. by gym_flock.worker_pool
+        if self.executor is None or self.executor_pid != os.getpid():
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=self.n_threads or os.cpu_count())
+            self.executor_pid = os.getpid()
+        futures = [self.executor.submit(fn, start, stop, *args) for start, stop in blocks]
+        return [f.result() for f in futures]
+
+    def shutdown_executor(self):
+        if self.executor is not None and self.executor_pid == os.getpid():
+            self.executor.shutdown(wait=True)
+        self.executor = None
+
+    def row_blocks(self):
+        """
+        Returns: start and stop indices of the row blocks of the tiled execution
+        """
+        # the largest temporaries of a row block are its potentials, with nx_system + 2 values per pair
+        block = max(1, self.tile_bytes // (8 * (self.nx_system + 2) * self.n_agents))
+        return [(start, min(start + block, self.n_agents)) for start in range(0, self.n_agents, block)]
+
+    def add_monitor(self, monitor):
+        """
+        Update a monitor at every step, see gym_flock.envs.monitors
+        Args:
+            monitor (): object with reset(env) and update(env, info) methods
+
+        Returns: the monitor
+
+        """
+        self.monitors.append(monitor)
+        return monitor
+
+    def enable_metrics(self, collision_radius=0.1):
+        """
+        Track streaming episode metrics, see EpisodeMetrics
+        Args:
+            collision_radius (): agents closer than this distance are in collision
+
+        Returns: the EpisodeMetrics monitor, also kept in self.metrics
+
+        """
+        from gym_flock.envs.monitors import EpisodeMetrics
+        self.metrics = self.add_monitor(EpisodeMetrics(collision_radius))
+        return self.metrics
+
+    def enable_graph_health(self, terminate_on_fragment=False, min_lambda2=None, lambda2_interval=1):
+        """
+        Report the connected components and algebraic connectivity of the communication graph in info['graph'],
+        see GraphHealth
+        Args:
+            terminate_on_fragment (): end the episode when the graph fragments
+            min_lambda2 (): end the episode when the algebraic connectivity falls below this value
+            lambda2_interval (): estimate the algebraic connectivity every this many steps, or never if 0
+
+        Returns: the GraphHealth monitor, also kept in self.graph_health
+
+        """
+        from gym_flock.envs.monitors import GraphHealth
+        self.graph_health = self.add_monitor(GraphHealth(terminate_on_fragment, min_lambda2, lambda2_interval))
+        return self.graph_health
+
+    def enable_safety(self, collision_radius=0.1, max_speed=None, max_accel=None, mode='terminate'):
+        """
+        End or flag episodes with collisions or blown-up velocities or accelerations, see SafetyMonitor
+        Args:
+            collision_radius (): agents closer than this distance are in collision, or None to ignore collisions
+            max_speed (): speed of any agent above which the velocities have blown up, or None
+            max_accel (): acceleration of any agent above which the controls have blown up, or None
+            mode (): 'terminate', 'truncate' or 'warn'
+
+        Returns: the SafetyMonitor, also kept in self.safety
+
+        """
+        from gym_flock.envs.monitors import SafetyMonitor
+        self.safety = self.add_monitor(SafetyMonitor(collision_radius, max_speed, max_accel, mode))
+        return self.safety
+
+    def enable_consensus_detection(self, window=50, max_variance=1e-3, max_rate=1e-2, max_edge_changes=0,
+                                   mode='truncate'):
+        """
+        End episodes once the flock has held velocity consensus for a window of steps, see ConsensusDetector
+        Args:
+            window (): number of consecutive steps the consensus conditions must hold
+            max_variance (): largest velocity variance at consensus
+            max_rate (): largest absolute rate of change of the velocity variance at consensus, per unit time
+            max_edge_changes (): largest number of links made or broken in a step at consensus
+            mode (): 'terminate' or 'truncate'
+
+        Returns: the ConsensusDetector, also kept in self.consensus
+
+        """
+        from gym_flock.envs.monitors import ConsensusDetector
+        self.consensus = self.add_monitor(ConsensusDetector(window, max_variance, max_rate, max_edge_changes, mode))
+        return self.consensus
+
+    def reset_monitors(self):
+        for monitor in self.monitors:
+            monitor.reset(self)
+
+    def update_monitors(self, info=None):
+        """
+        Args:
+            info (): info dict of the step, to which the monitors add their entries
+
+        Returns: whether any monitor ended the episode, and the info dict
+
+        """
+        if info is None:
+            info = {}
+        done = False
+        for monitor in self.monitors:
+            done = monitor.update(self, info) or done
+        return done, info
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
+    def get_state(self):
+        """
+        Snapshot of the env, from which set_state continues the episode exactly as from this step, e.g. to branch
+        rollouts. The helpers are not copied, as they are rebuilt from the state when needed. The state of the global
+        NumPy generator, which reset and the stochastic env draw from, is included, and set_state restores it.
+        Returns: dict of copies of the state, last action, random number generators, and the state of the adaptive
+        integrator, aggregation and monitors
+
+        """
+        return {
+            'x': self.x.copy(),
+            'u': None if self.u is None else np.array(self.u),
+            'dt': self.dt,
+            'time': self.time,
+            'mean_vel': self.mean_vel,
+            'np_random': self.np_random.bit_generator.state,
+            'global_random': np.random.get_state(),
+            'stepper': None if self.stepper is None else self.stepper.get_state(),
+            'aggregator': None if self.aggregator is None else self.aggregator.get_state(),
+            'monitors': [monitor.get_state() for monitor in self.monitors],
+        }
+
+    def set_state(self, state):
+        """
+        Restore a snapshot of get_state. The helpers are rebuilt at the next step, or by update_helpers.
+        Args:
+            state (): snapshot of the same env, which may be restored any number of times
+        """
+        self.x = state['x'].copy()
+        self.u = None if state['u'] is None else state['u'].copy()
+        self.dt = state['dt']
+        self.time = state['time']
+        self.mean_vel = state['mean_vel']
+        self.np_random.bit_generator.state = state['np_random']
+        np.random.set_state(state['global_random'])
+        if self.stepper is not None and state['stepper'] is not None:
+            self.stepper.set_state(state['stepper'])
+        if self.aggregator is not None:
+            self.aggregator.set_state(state['aggregator'])
+        for monitor, monitor_state in zip(self.monitors, state['monitors']):
+            monitor.set_state(monitor_state)
+        if self.controller_neighbors is not None:
+            self.controller_neighbors.reset()
+        self.stale_helpers = True
+
+    def update_helpers(self):
+        """
+        Rebuild the helpers after set_state, without advancing the multi-hop aggregation, whose restored state
+        already holds the observed features
+        """
+        if not self.stale_helpers:
+            return
+        aggregator = self.aggregator
+        self.aggregator = None
+        try:
+            self.compute_helpers()
+        finally:
+            self.aggregator = aggregator
+        if aggregator is not None:
+            self.state_values = aggregator.get_features()
+
+    def get_observation(self):
+        """
+        Returns: the observation of the current state, as returned by reset and step
+        """
+        self.update_helpers()
+        return (self.state_values, self.state_network)
+
     def step(self, u):
 
         #u = np.reshape(u, (-1, 2))
         assert u.shape == (self.n_agents, self.nu)
         #u = np.clip(u, a_min=-self.max_accel, a_max=self.max_accel)
-        self.u = u
 
+        # the helpers are only needed for the observation after the last substep
+        for substep in range(self.n_substeps):
+            if substep > 0 and self.expert_substeps:
+                u = self.sparse_controller()
+            self.u = u
+            self.integrate(u)
+            # after integrate, which may draw the duration of the step
+            self.time += self.dt
+
+        self.compute_helpers()
+        done, info = self.update_monitors()
+
+        return (self.state_values, self.state_network), self.instant_cost(), done, info
+
+    def integrate(self, u):
+        """
+        Advance the state by one time step dt with the accelerations u, without updating the helpers
+        """
         # x position
-        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + self.u[:, 0] * self.dt * self.dt * 0.5
+        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + u[:, 0] * self.dt * self.dt * 0.5
         # y position
-        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + self.u[:, 1] * self.dt * self.dt * 0.5
+        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + u[:, 1] * self.dt * self.dt * 0.5
         # x velocity
-        self.x[:, 2] = self.x[:, 2] + self.u[:, 0] * self.dt
+        self.x[:, 2] = self.x[:, 2] + u[:, 0] * self.dt
         # y velocity
-        self.x[:, 3] = self.x[:, 3] + self.u[:, 1] * self.dt
-
-        self.compute_helpers()
-
-        return (self.state_values, self.state_network), self.instant_cost(), False, {}
+        self.x[:, 3] = self.x[:, 3] + u[:, 1] * self.dt
 
     def compute_helpers(self):
 
+        self.stale_helpers = False
+        if self.execution != 'dense':
+            self.compute_helpers_tiled()
+            return
+
         self.diff = self.x.reshape((self.n_agents, 1, self.nx_system)) - self.x.reshape((1, self.n_agents, self.nx_system))
         self.r2 =  np.multiply(self.diff[:, :, 0], self.diff[:, :, 0]) + np.multiply(self.diff[:, :, 1], self.diff[:, :, 1])
         np.fill_diagonal(self.r2, np.Inf)
@@ -132,13 +548,86 @@ class FlockingRelativeEnv(gym.Env):
         else:
             self.state_network = self.adj_mat
 
+        if self.aggregator is not None:
+            self.state_values = self.aggregator.update(self.state_values, self.adj_mat)
+
+    def compute_helpers_tiled(self):
+        """
+        compute_helpers over row blocks of agents, which only materializes the N x N outputs. The results are identical,
+        since every row is computed by the same operations as in compute_helpers.
+        """
+        n_agents = self.n_agents
+        # the tiled controller recomputes the differences from the state of the helpers
+        self.diff = None
+        self.x_features = None
+        self.helpers_x = self.x.copy()
+        self.r2 = np.empty((n_agents, n_agents))
+        self.adj_mat = np.empty((n_agents, n_agents))
+        self.adj_mat_mean = np.empty((n_agents, n_agents))
+        self.state_values = np.empty((n_agents, self.n_features))
+        # the row blocks write to disjoint rows of the outputs
+        self.map_row_blocks(self.compute_helpers_rows)
+
+        if self.mean_pooling:
+            self.state_network = self.adj_mat_mean
+        else:
+            self.state_network = self.adj_mat
+
+        if self.aggregator is not None:
+            self.state_values = self.aggregator.update(self.state_values, self.adj_mat)
+
+    def compute_helpers_rows(self, start, stop):
+        n_rows = stop - start
+        diff = self.x[start:stop].reshape((n_rows, 1, self.nx_system)) - self.x.reshape((1, self.n_agents, self.nx_system))
+        r2 = np.multiply(diff[:, :, 0], diff[:, :, 0]) + np.multiply(diff[:, :, 1], diff[:, :, 1])
+        r2[np.arange(n_rows), np.arange(start, stop)] = np.Inf
+        self.r2[start:stop] = r2
+
+        adj_mat = (r2 < self.comm_radius2).astype(float)
+        self.adj_mat[start:stop] = adj_mat
+
+        n_neighbors = np.reshape(np.sum(adj_mat, axis=1), (n_rows, 1))
+        n_neighbors[n_neighbors == 0] = 1
+        self.adj_mat_mean[start:stop] = adj_mat / n_neighbors
+
+        x_features = np.dstack((diff[:, :, 2], np.divide(diff[:, :, 0], np.multiply(r2, r2)), np.divide(diff[:, :, 0], r2),
+                                diff[:, :, 3], np.divide(diff[:, :, 1], np.multiply(r2, r2)), np.divide(diff[:, :, 1], r2)))
+        self.state_values[start:stop] = np.sum(x_features * adj_mat.reshape(n_rows, self.n_agents, 1), axis=1)
+
+    def step_jacobians(self):
+        """
+        Analytic Jacobians of the last step, which are valid while the communication graph does not change.
+        States, actions and features are flattened agent by agent, see gym_flock.envs.jacobians. The features are
+        those of compute_helpers, before any multi-hop aggregation. The n_substeps integration steps of dt with a held
+        action compose exactly into one step of n_substeps * dt.
+        Returns: Jacobians of the state with respect to the previous state and to the action, and of the observed
+        features with respect to the previous state and to the action, as sparse block matrices
+
+        """
+        from gym_flock.envs.jacobians import dynamics_jacobians, feature_jacobian
+        if self.expert_substeps and self.n_substeps > 1:
+            raise ValueError('The expert controls of the substeps replace the action, so the steps have no fixed '
+                             'Jacobians.')
+        self.update_helpers()
+        f_x, f_u = dynamics_jacobians(self.n_agents, self.n_substeps * self.dt, getattr(self, 'mask', None))
+        g_x = feature_jacobian(self.x, self.r2, self.adj_mat, self.velocity_weights())
+        return f_x, f_u, g_x.dot(f_x).tobsr(blocksize=(6, 4)), g_x.dot(f_u).tobsr(blocksize=(6, 2))
+
+    def velocity_weights(self):
+        """
+        Returns: per-agent weights w, with which the velocity difference of agents i and j is scaled by w_i w_j in the
+        features and the expert controller, or None if all weights are 1
+        """
+        return None
+
     def get_stats(self):
 
+        self.update_helpers()
         stats = {}
 
         stats['vel_diffs'] = np.sqrt(np.sum(np.power(self.x[:, 2:4] - np.mean(self.x[:, 2:4], axis=0), 2), axis=1))
 
-        stats['min_dists'] = np.min(np.sqrt(self.r2), axis=0)
+        stats['min_dists'] = np.sqrt(np.min(self.r2, axis=0))
         return stats
 
     def instant_cost(self):  # sum of differences in velocities
@@ -187,7 +676,11 @@ class FlockingRelativeEnv(gym.Env):
         self.init_vel = x[:, 2:4]
         self.x = x
         #self.a_net = self.get_connectivity(self.x)
+        self.time = 0.0
+        if self.aggregator is not None:
+            self.aggregator.reset()
         self.compute_helpers()
+        self.reset_monitors()
         return (self.state_values, self.state_network)
 
     def controller(self, centralized=None):
@@ -199,6 +692,10 @@ class FlockingRelativeEnv(gym.Env):
         if centralized is None:
             centralized = self.centralized
 
+        self.update_helpers()
+        if self.diff is None:
+            return self.controller_tiled(centralized)
+
         # TODO use the helper quantities here more? 
         potentials = np.dstack((self.diff, self.potential_grad(self.diff[:, :, 0], self.r2), self.potential_grad(self.diff[:, :, 1], self.r2)))
         if not centralized:
@@ -209,6 +706,82 @@ class FlockingRelativeEnv(gym.Env):
         controls = np.clip(controls, -100, 100)
         return controls
 
+    def controller_tiled(self, centralized):
+        """
+        controller over the row blocks of compute_helpers_tiled, with identical results
+        """
+        p_sum = np.vstack(self.map_row_blocks(self.controller_rows, centralized))
+
+        controls =  np.hstack(((-  p_sum[:, 4] - p_sum[:, 2]).reshape((-1, 1)), (- p_sum[:, 3] - p_sum[:, 5]).reshape(-1, 1)))
+        controls = np.clip(controls, -100, 100)
+        return controls
+
+    def controller_rows(self, start, stop, centralized):
+        n_rows = stop - start
+        x = self.helpers_x
+        diff = x[start:stop].reshape((n_rows, 1, self.nx_system)) - x.reshape((1, self.n_agents, self.nx_system))
+        r2 = self.r2[start:stop]
+        potentials = np.dstack((diff, self.potential_grad(diff[:, :, 0], r2), self.potential_grad(diff[:, :, 1], r2)))
+        if not centralized:
+            potentials = potentials * self.adj_mat[start:stop].reshape(n_rows, self.n_agents, 1)
+        return np.sum(potentials, axis=1)
+
+    def sparse_controller(self, centralized=None):
+        """
+        The controller for flocking from Turner 2003, as controller(), computed from the state in O(N log N) without
+        the dense helpers. With the velocity weights w of velocity_weights(), the centralized velocity alignment term
+        sum_j w_i w_j (v_i - v_j) is exactly w_i (sum_j w_j v_i - sum_j w_j v_j), and the potential term vanishes
+        beyond a cutoff, so only the pairs of agents within the cutoff are visited, with a NeighborList. The result
+        equals controller() up to floating point rounding.
+        Returns: the optimal action
+        """
+        if centralized is None:
+            centralized = self.centralized
+
+        # potential_grad is cut off where r2 > comm_radius; the neighbor list is slightly larger than both cutoffs
+        # so that the pairs are selected on r2 exactly as in controller()
+        radius = max(np.sqrt(self.comm_radius), self.comm_radius) * (1 + 1e-6)
+        if self.controller_neighbors is None or self.controller_neighbors.radius != radius:
+            from gym_flock.envs.neighbors import NeighborList
+            self.controller_neighbors = NeighborList(radius)
+        i, j, r2 = self.controller_neighbors.update(self.x[:, 0:2])
+
+        n_agents = self.n_agents
+        vel = self.x[:, 2:4]
+        weights = self.velocity_weights()
+        near = r2 <= self.comm_radius
+        if centralized and weights is None:
+            alignment = n_agents * vel - np.sum(vel, axis=0)
+        elif centralized:
+            weights = weights.reshape((-1, 1))
+            alignment = weights * (np.sum(weights) * vel - np.sum(weights * vel, axis=0))
+        else:
+            adjacent = r2 < self.comm_radius2
+            near = near & adjacent
+            i_adj, j_adj = i[adjacent], j[adjacent]
+            pair_weights = None if weights is None else weights[i_adj] * weights[j_adj]
+            degree = (np.bincount(i_adj, weights=pair_weights, minlength=n_agents)
+                      + np.bincount(j_adj, weights=pair_weights, minlength=n_agents))
+            alignment = degree.reshape((-1, 1)) * vel
+            for k in range(2):
+                vel_j = vel[j_adj, k] if weights is None else vel[j_adj, k] * pair_weights
+                vel_i = vel[i_adj, k] if weights is None else vel[i_adj, k] * pair_weights
+                alignment[:, k] -= (np.bincount(i_adj, weights=vel_j, minlength=n_agents)
+                                    + np.bincount(j_adj, weights=vel_i, minlength=n_agents))
+
+        # the gradient is odd in the position difference, so each pair contributes to both agents with opposite signs
+        i, j, r2 = i[near], j[near], r2[near]
+        grad = np.zeros((n_agents, 2))
+        for k in range(2):
+            pos_diff = self.x[i, k] - self.x[j, k]
+            pair_grad = -2.0 * np.divide(pos_diff, np.multiply(r2, r2)) + 2 * np.divide(pos_diff, r2)
+            grad[:, k] = (np.bincount(i, weights=pair_grad, minlength=n_agents)
+                          - np.bincount(j, weights=pair_grad, minlength=n_agents))
+
+        controls = -grad - alignment
+        controls = np.clip(controls, -100, 100)
+        return controls
+
     def potential_grad(self, pos_diff, r2):
         """
         Computes the gradient of the potential function for flocking proposed in Turner 2003.
@@ -234,6 +807,10 @@ class FlockingRelativeEnv(gym.Env):
         Render the environment with agents as points in 2D space
         """
         if self.fig is None:
+            # plotting is only loaded by the first render
+            import matplotlib.pyplot as plt
+            from matplotlib.pyplot import gca
+
             plt.ion()
             fig = plt.figure()
             self.ax = fig.add_subplot(111)
@@ -299,5 +876,5 @@ class FlockingRelativeEnv(gym.Env):
     #         self.fig.canvas.flush_events()
 
     def close(self):
-        pass
+        self.shutdown_executor()
  
\ No newline at end of file
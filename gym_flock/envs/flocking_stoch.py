@@ -10,30 +10,26 @@ class FlockingStochasticEnv(FlockingRelativeEnv):
         self.dt_sigma = 0.018
         self.max_accel = 0.5
         self.scale = 6.0
+        self.random_dt = True
 
     def step(self, u):
         assert u.shape == (self.n_agents, self.nu)
         u = np.clip(u, a_min=-self.max_accel, a_max=self.max_accel)
+        return super(FlockingStochasticEnv, self).step(u)
+
+    def integrate(self, u):
         self.u = u * self.scale
         self.x = self.x * self.scale
 
+        # every integration step has a random duration
         self.dt = np.random.normal(self.dt_mean, self.dt_sigma)
-
-        # x position
-        self.x[:, 0] = self.x[:, 0] + self.x[:, 2] * self.dt + self.u[:, 0] * self.dt * self.dt * 0.5
-        # y position
-        self.x[:, 1] = self.x[:, 1] + self.x[:, 3] * self.dt + self.u[:, 1] * self.dt * self.dt * 0.5
-        # x velocity
-        self.x[:, 2] = self.x[:, 2] + self.u[:, 0] * self.dt
-        # y velocity
-        self.x[:, 3] = self.x[:, 3] + self.u[:, 1] * self.dt
+        super(FlockingStochasticEnv, self).integrate(self.u)
 
         self.x = self.x / self.scale
 
-        self.compute_helpers()
-
-        return (self.state_values, self.state_network), self.instant_cost(), False, {}
-
+    def step_jacobians(self):
+        raise ValueError('The steps of the stochastic env have random durations and clipped actions, so they have no '
+                         'fixed Jacobians.')
 
     def controller(self, centralized=None):
         """
@@ -43,3 +39,8 @@ class FlockingStochasticEnv(FlockingRelativeEnv):
         controls = super(FlockingStochasticEnv, self).controller(centralized)
         controls = np.clip(controls, -1.0 * self.max_accel, self.max_accel)
         return controls
+
+    def sparse_controller(self, centralized=None):
+        controls = super(FlockingStochasticEnv, self).sparse_controller(centralized)
+        controls = np.clip(controls, -1.0 * self.max_accel, self.max_accel)
+        return controls
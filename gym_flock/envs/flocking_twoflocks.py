@@ -22,5 +22,9 @@ class FlockingTwoFlocksEnv(FlockingRelativeEnv):
 
         self.mean_vel = np.mean(self.x[:, 2:4], axis=0)
         self.init_vel = self.x[:, 2:4]
+        self.time = 0.0
+        if self.aggregator is not None:
+            self.aggregator.reset()
         self.compute_helpers()
+        self.reset_monitors()
         return (self.state_values, self.state_network)
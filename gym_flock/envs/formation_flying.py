@@ -4,12 +4,10 @@ from gym.utils import seeding
 import numpy as np
 import configparser
 from os import path
-import matplotlib.pyplot as plt
-from matplotlib.pyplot import gca
-from sklearn.neighbors import NearestNeighbors
-import itertools 
-import random
-import pdb
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from gym_flock.envs.neighbors import NeighborList
+from gym_flock.envs.utils import formation
 font = {'family': 'sans-serif',
         'weight': 'bold',
         'size': 14}
@@ -36,7 +34,7 @@ class FormationFlyingEnv(gym.Env):
         self.nu = 2 
 
         # problem parameters from file
-        self.n_agents = 3
+        self.n_agents = int(config['network_size'])
         self.comm_radius = float(config['comm_radius'])
         self.comm_radius2 = self.comm_radius * self.comm_radius
         self.dt = float(config['system_dt'])
@@ -45,23 +43,64 @@ class FormationFlyingEnv(gym.Env):
         self.r_max = float(config['max_rad_init'])
         self.std_dev = float(config['std_dev']) * self.dt
 
-        # intitialize state matrices
-        self.x = np.zeros((self.n_agents, self.nx_system))
-        
-        self.a_net = np.zeros((self.n_agents, self.n_agents))
+        # goal formation, and the line of starting positions
+        self.formation = config.get('formation', 'line')
+        self.spacing = config.getfloat('formation_spacing', 2.0)
+        self.goal_center = np.array([0.0, config.getfloat('formation_offset', 2.0)])
+        self.start_spacing = config.getfloat('start_spacing', 2.0)
+
+        # the goal assignment only changes with the formation or the agents, so it is cached
+        self.goals = None
+        self.neighbors = NeighborList(self.comm_radius)
+        self.knn_net = None
 
         # TODO : what should the action space be? is [-1,1] OK?
         self.max_accel = 1 
         self.gain = 1.0 # TODO - adjust if necessary - may help the NN performance
+        self.set_formation(self.formation, self.n_agents)
+
+        self.fig = None
+        self.line1 = None
+
+        self.seed()
+
+    def set_formation(self, name, n_agents=None, spacing=None):
+        """
+        Change the goal formation, and optionally the number of agents. Takes effect at the next reset.
+        Args:
+            name (): name of the formation, one of utils.FORMATIONS
+            n_agents (): new number of agents
+            spacing (): distance between adjacent agents in the formation
+        """
+        if n_agents is not None:
+            self.n_agents = n_agents
+        if spacing is not None:
+            self.spacing = spacing
+        self.formation = name
+        self.goals = None
+
+        # intitialize state matrices
+        self.x = np.zeros((self.n_agents, self.nx_system))
+        self.a_net = np.zeros((self.n_agents, self.n_agents))
+
         self.action_space = spaces.Box(low=-self.max_accel, high=self.max_accel, shape=(2 *self.n_agents,),dtype=np.float32)
 
         self.observation_space = spaces.Box(low=-np.Inf, high=np.Inf, shape=(self.n_agents, self.n_features),
                                             dtype=np.float32)
 
-        self.fig = None
-        self.line1 = None
+    def assign_goals(self, starts):
+        """
+        Assign the formation's slots to the agents, minimizing the sum of squared distances to travel
+        Args:
+            starts (): starting positions of the agents
 
-        self.seed()
+        Returns: goal of each agent
+
+        """
+        slots = formation(self.formation, self.n_agents, self.spacing) + self.goal_center
+        cost = np.sum(np.square(starts.reshape((-1, 1, 2)) - slots.reshape((1, -1, 2))), axis=2)
+        _, assignment = linear_sum_assignment(cost)
+        return slots[assignment]
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -70,11 +109,9 @@ class FormationFlyingEnv(gym.Env):
     def step(self, action):
              
         self.u = np.reshape(action,(self.n_agents, self.nu))
-        
-        
-        self.x[:, 0] = self.x[:, 0] + self.u[:, 0]*0.1
-        # update  y position 
-        self.x[:, 1] = self.x[:, 1] + self.u[:, 1]*0.1
+
+        # update x, y position
+        self.x[:, 0:2] = self.x[:, 0:2] + self.u * 0.1
 
         return self._get_obs(), self.instant_cost(), False, {}
 
@@ -92,47 +129,24 @@ class FormationFlyingEnv(gym.Env):
 
     def reset(self):
         x = np.zeros((self.n_agents, self.n_features)) #+2 to account for goal x and goal y
-        degree = 0
-        min_dist = 0
-        min_dist_thresh = 0.01  # 0.25
 
-        #set arbitrary goal 
-        self.goal_x1 = 0
-        self.goal_y1 = 2
+        # agents start on a line, and fly to the goal formation
+        starts = formation('line', self.n_agents, self.start_spacing)
+        if self.goals is None:
+            self.goals = self.assign_goals(starts)
+            self.knn_net = None
 
-        self.goal_x2 = -2
-        self.goal_y2 = 2
-
-        self.goal_x3 = 2
-        self.goal_y3 = 2
-        
+        self.start_xpoints = starts[:, 0]
+        self.start_ypoints = starts[:, 1]
 
-        xpoints = np.array((0,-2,2))
-        ypoints = np.array((0,0,0))
+        self.goal_xpoints = self.goals[:, 0]
+        self.goal_ypoints = self.goals[:, 1]
 
-
-        self.start_xpoints = xpoints
-        self.start_ypoints = ypoints
-
-        self.goal_xpoints = np.array((self.goal_x1,self.goal_x2,self.goal_x3))
-        self.goal_ypoints = np.array((self.goal_y1,self.goal_y2,self.goal_y3))
-        
-        x[:,0] = xpoints
-        x[:,1] = ypoints
-
-        
-        x[:,2] = np.array((self.goal_x1,self.goal_x2,self.goal_x3))
-        x[:,3] = np.array((self.goal_y1,self.goal_y2,self.goal_y3))
-        
-        # compute distances between agents
-        a_net = self.dist2_mat(x)
-
-        # compute minimum distance between agents and degree of network to check if good initial configuration
-        min_dist = np.sqrt(np.min(np.min(a_net)))
-        a_net = a_net < self.comm_radius2
-        degree = np.min(np.sum(a_net.astype(int), axis=1))
+        x[:, 0:2] = starts
+        x[:, 2:4] = self.goals
 
         self.x = x
+        self.neighbors.reset()
 
         self.a_net = self.get_connectivity(self.x)
 
@@ -159,14 +173,18 @@ class FormationFlyingEnv(gym.Env):
 
     def get_connectivity(self, x):
 
-
         if self.degree == 0:
-            a_net = self.dist2_mat(x)
-            a_net = (a_net < self.comm_radius2).astype(float)
+            a_net = self.neighbors.adjacency(x[:, 0:2]).toarray()
         else:
-            neigh = NearestNeighbors(n_neighbors=self.degree)
-            neigh.fit(x[:,2:4])
-            a_net = np.array(neigh.kneighbors_graph(mode='connectivity').todense())
+            # the k nearest neighbors are taken among the goals, which only change with the goal assignment
+            if self.knn_net is None:
+                self.knn_net = np.zeros((self.n_agents, self.n_agents))
+                k = min(self.degree, self.n_agents - 1)
+                if k > 0:
+                    # the nearest point to each goal is the goal itself
+                    _, idx = cKDTree(x[:, 2:4]).query(x[:, 2:4], k=list(range(2, k + 2)))
+                    self.knn_net[np.arange(self.n_agents).reshape((-1, 1)), idx] = 1.0
+            a_net = self.knn_net
 
         if self.mean_pooling:
             # Normalize the adjacency matrix by the number of neighbors - results in mean pooling, instead of sum pooling
@@ -183,6 +201,10 @@ class FormationFlyingEnv(gym.Env):
         """
 
         if self.fig is None:
+            # plotting is only loaded by the first render
+            import matplotlib.pyplot as plt
+            from matplotlib.pyplot import gca
+
             plt.ion()
             fig = plt.figure()
             ax = fig.add_subplot(111)
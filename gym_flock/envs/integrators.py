@@ -0,0 +1,164 @@
+"""
+Integrators of the closed-loop dynamics of a flock, whose state y has one row (x, y, vx, vy) per agent and whose
+accelerations accel(y), with shape (n_agents, 2), are given by a controller such as the expert.
+
+    euler: the constant-acceleration update of FlockingRelativeEnv.step, first order
+    verlet: velocity Verlet, second order. Since the accelerations of the expert also depend on the velocities, the
+        new accelerations are evaluated at the predicted velocities v + a dt. The difference between predicted and
+        corrected velocities estimates the error.
+    rk4: the classical Runge-Kutta method, fourth order
+    adaptive: the embedded Dormand-Prince 5(4) pair, whose step size is adapted to keep the estimated local error
+        below atol + rtol * |y| for every entry of the state
+
+Errors are reported as the root mean square of the estimated local error of each entry, relative to that tolerance,
+so that a step is accurate enough when its error is at most 1.
+"""
+import numpy as np
+
+INTEGRATORS = ('euler', 'verlet', 'rk4', 'adaptive')
+
+# Dormand-Prince 5(4) tableau, without the nodes, since the dynamics do not depend on time
+DOPRI_A = [
+    [],
+    [1.0 / 5],
+    [3.0 / 40, 9.0 / 40],
+    [44.0 / 45, -56.0 / 15, 32.0 / 9],
+    [19372.0 / 6561, -25360.0 / 2187, 64448.0 / 6561, -212.0 / 729],
+    [9017.0 / 3168, -355.0 / 33, 46732.0 / 5247, 49.0 / 176, -5103.0 / 18656],
+    [35.0 / 384, 0.0, 500.0 / 1113, 125.0 / 192, -2187.0 / 6784, 11.0 / 84],
+]
+# weights of the fifth order solution, which are also the last row of the tableau, minus those of the fourth order one
+DOPRI_E = np.array([71.0 / 57600, 0.0, -71.0 / 16695, 71.0 / 1920, -17253.0 / 339200, 22.0 / 525, -1.0 / 40])
+
+
+def derivative(y, accel):
+    """
+    Returns: time derivative (vx, vy, ax, ay) of the state
+    """
+    return np.hstack((y[:, 2:4], accel(y)))
+
+
+def error_norm(error, y0, y1, rtol, atol):
+    """
+    Returns: root mean square of the local error, relative to the tolerance of each entry of the state
+    """
+    scale = atol + rtol * np.maximum(np.abs(y0), np.abs(y1))
+    return float(np.sqrt(np.mean(np.square(error / scale))))
+
+
+def euler_step(y, accel, dt):
+    a = accel(y)
+    y1 = np.empty_like(y)
+    y1[:, 0:2] = y[:, 0:2] + y[:, 2:4] * dt + a * dt * dt * 0.5
+    y1[:, 2:4] = y[:, 2:4] + a * dt
+    return y1
+
+
+def verlet_step(y, accel, dt, rtol, atol):
+    """
+    Returns: the new state, and its estimated relative error
+    """
+    a0 = accel(y)
+    y1 = np.empty_like(y)
+    y1[:, 0:2] = y[:, 0:2] + y[:, 2:4] * dt + a0 * dt * dt * 0.5
+    y1[:, 2:4] = y[:, 2:4] + a0 * dt
+    a1 = accel(y1)
+    predicted = y1[:, 2:4].copy()
+    y1[:, 2:4] = y[:, 2:4] + (a0 + a1) * dt * 0.5
+    error = np.zeros_like(y)
+    error[:, 2:4] = y1[:, 2:4] - predicted
+    return y1, error_norm(error, y, y1, rtol, atol)
+
+
+def rk4_step(y, accel, dt):
+    k1 = derivative(y, accel)
+    k2 = derivative(y + k1 * dt * 0.5, accel)
+    k3 = derivative(y + k2 * dt * 0.5, accel)
+    k4 = derivative(y + k3 * dt, accel)
+    return y + (k1 + 2 * k2 + 2 * k3 + k4) * dt / 6.0
+
+
+def dopri_step(y, accel, dt, k1=None):
+    """
+    One Dormand-Prince 5(4) step
+    Args:
+        y (): state
+        accel (): accelerations as a function of the state
+        dt (): time step
+        k1 (): derivative at y, if known from the last stage of the previous step
+
+    Returns: the fifth order solution, the estimated local error, and the derivative at the solution
+
+    """
+    k = [derivative(y, accel) if k1 is None else k1]
+    for i in range(1, 7):
+        stage = y + dt * sum(a * kj for a, kj in zip(DOPRI_A[i], k) if a != 0.0)
+        k.append(derivative(stage, accel))
+    # the last stage is evaluated at the fifth order solution
+    y1 = stage
+    error = dt * sum(e * kj for e, kj in zip(DOPRI_E, k) if e != 0.0)
+    return y1, error, k[6]
+
+
+class AdaptiveStepper(object):
+    """
+    Dormand-Prince 5(4) steps with step size control. The first stage of a step reuses the last stage of the previous
+    one, as long as the state was not changed in between.
+    """
+
+    def __init__(self, dt, rtol=1e-6, atol=1e-8, max_dt=None, min_dt=1e-8, safety=0.9):
+        """
+        Args:
+            dt (): initial step size
+            rtol (): relative tolerance of the local error
+            atol (): absolute tolerance of the local error
+            max_dt (): largest step size, or None
+            min_dt (): smallest step size, below which steps are accepted regardless of their error
+            safety (): factor of the optimal step size predicted from the error
+        """
+        self.dt = dt
+        self.rtol = rtol
+        self.atol = atol
+        self.max_dt = max_dt
+        self.min_dt = min_dt
+        self.safety = safety
+        self.last_y = None
+        self.last_k = None
+
+    def get_state(self):
+        # the last state and stage are replaced, not modified, by step, so they are shared
+        return self.dt, self.last_y, self.last_k
+
+    def set_state(self, state):
+        self.dt, self.last_y, self.last_k = state
+
+    def next_dt(self, dt, error):
+        factor = 5.0 if error == 0.0 else min(5.0, max(0.2, self.safety * error ** -0.2))
+        dt = dt * factor
+        if self.max_dt is not None:
+            dt = min(dt, self.max_dt)
+        return max(dt, self.min_dt)
+
+    def step(self, y, accel):
+        """
+        Returns: the state after one accepted step, its size, its estimated relative error, and the number of
+        rejected attempts
+        """
+        if self.last_y is not None and np.array_equal(self.last_y, y):
+            k1 = self.last_k
+        else:
+            k1 = derivative(y, accel)
+        dt = self.dt if self.max_dt is None else min(self.dt, self.max_dt)
+        n_rejected = 0
+        while True:
+            y1, error, k7 = dopri_step(y, accel, dt, k1)
+            norm = error_norm(error, y, y1, self.rtol, self.atol)
+            if norm <= 1.0 or dt <= self.min_dt:
+                break
+            n_rejected += 1
+            dt = max(dt * max(0.2, self.safety * norm ** -0.2), self.min_dt)
+
+        self.dt = self.next_dt(dt, norm)
+        self.last_y = y1.copy()
+        self.last_k = k7
+        return y1, dt, norm, n_rejected
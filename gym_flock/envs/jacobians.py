@@ -0,0 +1,98 @@
+"""
+Analytic Jacobians of the flocking dynamics and observations, as sparse block matrices.
+
+States, actions and observed features are flattened agent by agent, i.e. x.reshape(-1) with 4 entries per agent,
+u.reshape(-1) with 2 entries and state_values.reshape(-1) with 6 entries. The observed features are smooth in the state
+as long as the communication graph does not change, and the observed network is piecewise constant, so its Jacobian
+is zero between graph changes.
+"""
+import numpy as np
+import scipy.sparse
+
+
+def dynamics_jacobians(n_agents, dt, mask=None):
+    """
+    Jacobians of the double integrator dynamics x' = F_x x + F_u u, which are constant
+    Args:
+        n_agents (): number of agents
+        dt (): time step
+        mask (): optional per-agent mask of the actions, as used by the leader and obstacle envs
+
+    Returns: F_x with shape (4 n_agents, 4 n_agents) and F_u with shape (4 n_agents, 2 n_agents), as sparse BSR matrices
+
+    """
+    eye = np.eye(2)
+    a = np.block([[eye, dt * eye], [np.zeros((2, 2)), eye]])
+    b = np.vstack((dt * dt * 0.5 * eye, dt * eye))
+
+    index = np.arange(n_agents)
+    f_x = scipy.sparse.bsr_matrix((np.tile(a, (n_agents, 1, 1)), index, np.arange(n_agents + 1)),
+                                  shape=(4 * n_agents, 4 * n_agents))
+    b_blocks = np.tile(b, (n_agents, 1, 1))
+    if mask is not None:
+        b_blocks = b_blocks * np.reshape(mask, (n_agents, 1, 1))
+    f_u = scipy.sparse.bsr_matrix((b_blocks, index, np.arange(n_agents + 1)), shape=(4 * n_agents, 2 * n_agents))
+    return f_x, f_u
+
+
+def pair_feature_jacobians(diff, r2):
+    """
+    Jacobians of the features of pairs of agents with respect to their relative state
+    Args:
+        diff (): relative states (dx, dy, dvx, dvy) of the pairs, with shape (n_pairs, 4)
+        r2 (): squared distances of the pairs
+
+    Returns: Jacobians with shape (n_pairs, 6, 4) of the features (dvx, dx/r^4, dx/r^2, dvy, dy/r^4, dy/r^2)
+
+    """
+    dx = diff[:, 0]
+    dy = diff[:, 1]
+    r4 = r2 * r2
+    r6 = r4 * r2
+
+    jac = np.zeros((diff.shape[0], 6, 4))
+    jac[:, 0, 2] = 1.0
+    jac[:, 1, 0] = 1.0 / r4 - 4.0 * dx * dx / r6
+    jac[:, 1, 1] = -4.0 * dx * dy / r6
+    jac[:, 2, 0] = 1.0 / r2 - 2.0 * dx * dx / r4
+    jac[:, 2, 1] = -2.0 * dx * dy / r4
+    jac[:, 3, 3] = 1.0
+    jac[:, 4, 0] = -4.0 * dx * dy / r6
+    jac[:, 4, 1] = 1.0 / r4 - 4.0 * dy * dy / r6
+    jac[:, 5, 0] = -2.0 * dx * dy / r4
+    jac[:, 5, 1] = 1.0 / r2 - 2.0 * dy * dy / r4
+    return jac
+
+
+def feature_jacobian(x, r2, adj_mat, velocity_weights=None):
+    """
+    Jacobian of the observed features state_values[i] = sum_j adj_mat[i, j] f(x_i - x_j) with respect to the state
+    Args:
+        x (): states of the agents, with shape (n_agents, 4)
+        r2 (): pairwise squared distances, with shape (n_agents, n_agents)
+        adj_mat (): adjacency matrix of the communication graph
+        velocity_weights (): optional per-agent weights w, with which the velocity differences of the features of the
+            pair (i, j) are scaled by w_i w_j, as in the obstacle env, where obstacles have weight 0
+
+    Returns: Jacobian with shape (6 n_agents, 4 n_agents), as a sparse BSR matrix with one block per neighbor pair and
+    per agent
+
+    """
+    n_agents = adj_mat.shape[0]
+    i, j = np.nonzero(adj_mat)
+    pair_jac = pair_feature_jacobians(x[i] - x[j], r2[i, j]) * adj_mat[i, j].reshape((-1, 1, 1))
+    if velocity_weights is not None:
+        # the features dvx and dvy
+        pair_jac[:, [0, 3], :] *= (velocity_weights[i] * velocity_weights[j]).reshape((-1, 1, 1))
+
+    # the features of agent i depend on x_i through all its neighbors, and on x_j with the opposite sign
+    self_jac = np.zeros((n_agents, 6, 4))
+    np.add.at(self_jac, i, pair_jac)
+
+    index = np.arange(n_agents)
+    rows = np.concatenate((i, index))
+    cols = np.concatenate((j, index))
+    blocks = np.concatenate((-pair_jac, self_jac))
+    order = np.lexsort((cols, rows))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_agents))))
+    return scipy.sparse.bsr_matrix((blocks[order], cols[order], indptr), shape=(6 * n_agents, 4 * n_agents))
@@ -5,8 +5,10 @@ import numpy as np
 import configparser
 from os import path
 import scipy.linalg
+import scipy.sparse
 from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics.pairwise import pairwise_kernels
+from gym_flock.envs.aggregation import KHopAggregator
 
 
 class LQREnv(gym.Env):
@@ -28,8 +30,27 @@ class LQREnv(gym.Env):
         self.b_scale = float(config['b_scale'])
         self.alpha = float(config['alpha'])
 
-        # generate node locations
-        node_loc = self.alpha * np.random.uniform(0, 1.0, size=(self.n_nodes, 2))
+        self.build_system()
+        self.aggregator = KHopAggregator(self.n_nodes, 1, self.filter_len)
+
+        # TODO - tune these to be reasonable
+        self.max_u = 40
+        self.max_z = 200  
+
+        self.action_space = spaces.Box(low=-self.max_u, high=self.max_u, shape=(1,) , dtype=np.float32 )
+        self.observation_space = spaces.Box(low=-self.max_z, high=self.max_z, shape=(self.filter_len,), dtype=np.float32)
+
+        self.seed()
+
+
+    def build_system(self, node_loc=None):
+        """
+        Generate the linear system and the geometric network it is coupled over
+        Args:
+            node_loc (): locations of the nodes, drawn uniformly at random if not given
+        """
+        if node_loc is None:
+            node_loc = self.alpha * np.random.uniform(0, 1.0, size=(self.n_nodes, 2))
 
         # generate linear system and geometric network
         a_sys = pairwise_kernels(node_loc, metric='rbf')
@@ -58,18 +79,8 @@ class LQREnv(gym.Env):
         self.cov = q_sys * self.var
         self.std_dev = np.sqrt(self.cov[0, 0])
 
-        self.a_net_nan = self.a_net.reshape((self.n_nodes, self.n_nodes, 1))
-        self.a_net_nan[self.a_net_nan == 0] = np.nan
-
-        # TODO - tune these to be reasonable
-        self.max_u = 40
-        self.max_z = 200  
-
-        self.action_space = spaces.Box(low=-self.max_u, high=self.max_u, shape=(1,) , dtype=np.float32 )
-        self.observation_space = spaces.Box(low=-self.max_z, high=self.max_z, shape=(self.filter_len,), dtype=np.float32)
-
-        self.seed()
-
+        # node j forwards to node i with weight a_net[j, i]
+        self.a_net_t = scipy.sparse.csr_matrix(self.a_net.T)
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
@@ -83,7 +94,7 @@ class LQREnv(gym.Env):
         cost = self.instant_cost(xt, ut)
 
         self.x = xt1
-        self.x_agg = self.aggregate(self.x, self.x_agg)
+        self.x_agg = self.aggregate(self.x)
 
         return self._get_obs(), -cost, False, {}
 
@@ -99,26 +110,20 @@ class LQREnv(gym.Env):
 
     def reset(self):
         self.x = np.random.uniform(low=-self.x_max, high=self.x_max, size=(self.n_nodes,))
-        self.x_agg = np.zeros((self.n_nodes, self.filter_len))
-        self.x_agg = self.aggregate(self.x, self.x_agg)
+        self.aggregator.reset()
+        self.x_agg = self.aggregate(self.x)
         return self._get_obs()
 
     def close(self):
         pass
 
-    def aggregate(self, xt, x_agg):
+    def aggregate(self, xt):
         """
         Perform aggegration operation
         Args:
-            x_agg (): Last time step's aggregated info
             xt (): Current state of all agents
 
         Returns:
             Aggregated state values
         """
-        # get rid of oldest forwarded information
-        last_agg = np.array(x_agg[:, :-1]).reshape((self.n_nodes, 1, self.filter_len - 1))
-
-        # get forwarded information from neighbors
-        features = np.nansum(last_agg * self.a_net_nan, axis=0).reshape((self.n_nodes, self.filter_len - 1))
-        return np.hstack((xt.reshape(self.n_nodes, 1), features))
\ No newline at end of file
+        return self.aggregator.update(xt.reshape((self.n_nodes, -1)), self.a_net_t)
@@ -0,0 +1,93 @@
+from gym import spaces
+import numpy as np
+from gym_flock.envs.aggregation import KHopAggregator
+from gym_flock.envs.lqr import LQREnv
+
+# system matrices shared by every LQRBatchEnv in this process, keyed by system parameters and seed.
+# Worker processes forked after the first env is built inherit these pages copy-on-write, and since
+# the arrays are read-only the pages are never copied.
+_SHARED_SYSTEMS = {}
+
+SYSTEM_ATTRS = ('a_net', 'a_net_t', 'a_sys', 'b_sys', 'q_sys', 'r_sys', 'cov', 'std_dev')
+
+
+class LQRBatchEnv(LQREnv):
+    """
+    A batch of LQREnv copies over the same graph, stepped together with one (N x N) . (N x B) product.
+    States are stored node-major with shape (n_nodes, n_envs), while actions, observations and rewards are
+    batch-major, with shapes (n_envs, n_nodes), (n_envs, n_nodes, filter_len) and (n_envs,).
+    """
+
+    def __init__(self, n_envs=16, system_seed=0):
+        self.n_envs = n_envs
+        self.system_seed = system_seed
+
+        super(LQRBatchEnv, self).__init__()
+        # the batch is aggregated as extra features, since the sum over neighbors is the same for every copy
+        self.aggregator = KHopAggregator(self.n_nodes, self.n_envs, self.filter_len)
+
+        self.action_space = spaces.Box(low=-self.max_u, high=self.max_u, shape=(self.n_envs, self.n_nodes),
+                                       dtype=np.float32)
+        self.observation_space = spaces.Box(low=-self.max_z, high=self.max_z,
+                                            shape=(self.n_envs, self.n_nodes, self.filter_len), dtype=np.float32)
+
+    def build_system(self, node_loc=None):
+        """
+        Look up the system matrices in the per-process cache, building them on first use
+        Args:
+            node_loc (): locations of the nodes, drawn from system_seed if not given
+        """
+        key = (self.n_nodes, self.dt, self.var, self.degree, self.b_scale, self.alpha, self.system_seed)
+        if node_loc is not None:
+            key = None
+
+        system = _SHARED_SYSTEMS.get(key)
+        if system is None:
+            if node_loc is None:
+                rng = np.random.RandomState(self.system_seed)
+                node_loc = self.alpha * rng.uniform(0, 1.0, size=(self.n_nodes, 2))
+            super(LQRBatchEnv, self).build_system(node_loc)
+
+            system = {}
+            for name in SYSTEM_ATTRS:
+                value = getattr(self, name)
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
+                system[name] = value
+            if key is not None:
+                _SHARED_SYSTEMS[key] = system
+
+        self.__dict__.update(system)
+
+    def step(self, ut):
+        ut = np.reshape(ut, (self.n_envs, self.n_nodes)).T
+        xt = self.x
+        xt1 = self.a_sys.dot(xt) + self.b_sys.dot(ut) + np.random.normal(0, self.std_dev, (self.n_nodes, self.n_envs))
+        cost = self.instant_cost(xt, ut)
+
+        self.x = xt1
+        self.x_agg = self.aggregate(self.x)
+
+        return self._get_obs(), -cost, np.zeros((self.n_envs,), dtype=bool), {}
+
+    def instant_cost(self, xt, ut):
+        """
+        Quadratic cost x'Qx + u'Ru of every copy in the batch
+        Args:
+            xt (): states with shape (n_nodes, n_envs)
+            ut (): actions with shape (n_nodes, n_envs)
+
+        Returns: costs with shape (n_envs,)
+
+        """
+        return np.einsum('ij,ij->j', xt, self.q_sys.dot(xt)) + np.einsum('ij,ij->j', ut, self.r_sys.dot(ut))
+
+    def _get_obs(self):
+        reshaped = self.x_agg.reshape((self.n_nodes, self.filter_len, self.n_envs)).transpose((2, 0, 1))
+        return np.clip(reshaped, a_min=-self.max_z, a_max=self.max_z)
+
+    def reset(self):
+        self.x = np.random.uniform(low=-self.x_max, high=self.x_max, size=(self.n_nodes, self.n_envs))
+        self.aggregator.reset()
+        self.x_agg = self.aggregate(self.x)
+        return self._get_obs()
@@ -0,0 +1,563 @@
+"""
+Monitors are updated by FlockingRelativeEnv at every step, from the helper quantities the step has already computed.
+A monitor has two methods:
+    reset(env): called at the end of every reset
+    update(env, info): called at the end of every step, may add entries to the step's info dict, and returns whether
+        the episode should end
+and, for snapshots of the env by FlockingRelativeEnv.get_state and set_state, two more:
+    get_state(): the state of the monitor in the current episode, not shared with the monitor
+    set_state(state): restore that state
+"""
+import numpy as np
+
+
+class RunningStat(object):
+    """
+    Running mean, variance, minimum and maximum of a scalar, with Welford's algorithm
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.Inf
+        self.max = -np.Inf
+
+    def update(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def get_state(self):
+        return self.n, self.mean, self.m2, self.min, self.max
+
+    def set_state(self, state):
+        self.n, self.mean, self.m2, self.min, self.max = state
+
+    @property
+    def var(self):
+        return self.m2 / self.n if self.n > 0 else 0.0
+
+    def summary(self):
+        return {'mean': self.mean, 'std': np.sqrt(self.var), 'min': self.min, 'max': self.max}
+
+
+def velocity_variance(v):
+    return np.sum(np.var(v, axis=0))
+
+
+def order_parameter(v):
+    """
+    Polarization of the flock: 1 if all agents move in the same direction, 0 if their headings cancel out
+    Args:
+        v (): velocities with shape (n_agents, 2)
+    """
+    speed = np.sum(np.sqrt(np.sum(v * v, axis=1)))
+    if speed == 0:
+        return 1.0
+    return np.sqrt(np.sum(np.square(np.sum(v, axis=0)))) / speed
+
+
+class EpisodeMetrics(object):
+    """
+    Streaming metrics of an episode, with memory independent of the episode length: running statistics of the
+    velocity variance, minimum inter-agent distance, mean degree and order parameter of the flock, and collision counts.
+    """
+
+    def __init__(self, collision_radius=0.1):
+        """
+        Args:
+            collision_radius (): agents closer than this distance are in collision
+        """
+        self.collision_radius = collision_radius
+        self.collision_radius2 = collision_radius * collision_radius
+        self.stats = {'vel_variance': RunningStat(), 'min_dist': RunningStat(), 'mean_degree': RunningStat(),
+                      'order': RunningStat()}
+        self.last_episode = None
+        self.n_steps = 0
+        self.agent_min_r2 = None
+        self.agent_collisions = None
+        self.collision_steps = 0
+        self.collisions = 0
+
+    def reset(self, env):
+        if self.n_steps > 0:
+            self.last_episode = self.summary()
+        for stat in self.stats.values():
+            stat.reset()
+        self.n_steps = 0
+        self.agent_min_r2 = np.full((env.n_agents,), np.Inf)
+        self.agent_collisions = np.zeros((env.n_agents,), dtype=int)
+        self.collision_steps = 0
+        self.collisions = 0
+
+    def update(self, env, info):
+        self.n_steps += 1
+        v = env.x[:, 2:4]
+        self.stats['vel_variance'].update(velocity_variance(v))
+        self.stats['order'].update(order_parameter(v))
+        self.stats['mean_degree'].update(np.count_nonzero(env.adj_mat) / env.n_agents)
+
+        # r2 has an infinite diagonal
+        min_r2 = np.min(env.r2, axis=1)
+        np.minimum(self.agent_min_r2, min_r2, out=self.agent_min_r2)
+        self.stats['min_dist'].update(np.sqrt(np.min(min_r2)))
+
+        # only the rows of agents in collision are scanned for collision pairs
+        colliding = np.nonzero(min_r2 < self.collision_radius2)[0]
+        if colliding.size > 0:
+            counts = np.count_nonzero(env.r2[colliding] < self.collision_radius2, axis=1)
+            self.agent_collisions[colliding] += counts
+            self.collisions += int(np.sum(counts)) // 2
+            self.collision_steps += 1
+        return False
+
+    def get_state(self):
+        return ({name: stat.get_state() for name, stat in self.stats.items()}, self.n_steps,
+                self.agent_min_r2.copy(), self.agent_collisions.copy(), self.collision_steps, self.collisions)
+
+    def set_state(self, state):
+        stats, self.n_steps, agent_min_r2, agent_collisions, self.collision_steps, self.collisions = state
+        for name, stat in stats.items():
+            self.stats[name].set_state(stat)
+        # updated in place by update
+        self.agent_min_r2 = agent_min_r2.copy()
+        self.agent_collisions = agent_collisions.copy()
+
+    def summary(self):
+        """
+        Returns: summary of the metrics of the current episode
+        """
+        summary = {name: stat.summary() for name, stat in self.stats.items()}
+        summary['steps'] = self.n_steps
+        summary['collisions'] = self.collisions
+        summary['collision_steps'] = self.collision_steps
+        summary['colliding_agents'] = int(np.count_nonzero(self.agent_collisions))
+        summary['agent_min_dists'] = np.sqrt(self.agent_min_r2)
+        return summary
+
+
+class UnionFind(object):
+    """
+    Connected components of a graph, maintained under edge insertions
+    """
+
+    def __init__(self, n_nodes):
+        self.parent = np.arange(n_nodes)
+        self.n_components = n_nodes
+
+    def rebuild(self, n_nodes, i, j):
+        """
+        Recompute the components from scratch, from the edges (i, j)
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        graph = coo_matrix((np.ones(len(i), dtype=bool), (i, j)), shape=(n_nodes, n_nodes))
+        self.n_components, labels = connected_components(graph, directed=False)
+        roots = np.zeros((self.n_components,), dtype=int)
+        roots[labels[::-1]] = np.arange(n_nodes)[::-1]
+        self.parent = roots[labels]
+
+    def find(self, a):
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+            self.n_components -= 1
+
+    def labels(self):
+        """
+        Returns: the root of every node, after compressing all paths
+        """
+        parent = self.parent
+        grand = parent[parent]
+        while not np.array_equal(grand, parent):
+            parent = grand
+            grand = parent[parent]
+        self.parent = parent
+        return parent.copy()
+
+
+class GraphHealth(object):
+    """
+    Tracks whether the communication graph of the flock fragments. The edges are found with a NeighborList over the
+    communication radius, without any pass over all pairs of agents. Connected components are maintained with
+    union-find over the edge set: added edges merge components in place, and a removed edge is first checked with a
+    search from both of its ends over the kept edges, which in a flock usually reconnects them within a few hops. Only
+    the components of the removed edges that the search could not reconnect are recomputed. The algebraic connectivity
+    (the second smallest eigenvalue of the graph Laplacian) of a connected graph is estimated with Lanczos iterations on
+    the sparse Laplacian, warm-started from the last Fiedler vector.
+    """
+
+    def __init__(self, terminate_on_fragment=False, min_lambda2=None, lambda2_interval=1, tol=1e-4, search_limit=64):
+        """
+        Args:
+            terminate_on_fragment (): end the episode when the graph has more than one connected component
+            min_lambda2 (): end the episode when the algebraic connectivity falls below this value
+            lambda2_interval (): estimate the algebraic connectivity every this many steps, or never if 0
+            tol (): relative tolerance of the Lanczos iterations
+            search_limit (): number of agents the search for a path between the ends of a removed edge visits before
+                giving up and recomputing their component
+        """
+        self.terminate_on_fragment = terminate_on_fragment
+        self.min_lambda2 = min_lambda2
+        self.lambda2_interval = lambda2_interval
+        self.tol = tol
+        self.search_limit = search_limit
+
+        self.n_nodes = 0
+        self.neighbors = None
+        self.edges = None
+        self.components = None
+        self.lambda2 = None
+        self.fiedler = None
+        self.n_steps = 0
+        self.n_rebuilds = 0
+
+    def edge_keys(self, env):
+        """
+        Returns: sorted keys i * n_nodes + j, with i < j, of the edges of the communication graph
+        """
+        if self.neighbors is None or self.neighbors.radius != env.comm_radius:
+            from gym_flock.envs.neighbors import NeighborList
+            self.neighbors = NeighborList(env.comm_radius)
+        i, j, _ = self.neighbors.update(env.x[:, 0:2])
+        return np.sort(i * self.n_nodes + j)
+
+    def reset(self, env):
+        self.n_nodes = env.n_agents
+        if self.neighbors is not None:
+            self.neighbors.reset()
+        self.edges = self.edge_keys(env)
+        self.components = UnionFind(self.n_nodes)
+        self.rebuild()
+        self.fiedler = None
+        self.n_steps = 0
+        self.lambda2 = self.algebraic_connectivity()
+
+    def rebuild(self):
+        self.components.rebuild(self.n_nodes, self.edges // self.n_nodes, self.edges % self.n_nodes)
+        self.n_rebuilds += 1
+
+    def update_components(self, edges):
+        removed = np.setdiff1d(self.edges, edges, assume_unique=True)
+        added = np.setdiff1d(edges, self.edges, assume_unique=True)
+        if removed.size > 0:
+            self.remove_edges(removed, np.intersect1d(self.edges, edges, assume_unique=True))
+        self.edges = edges
+        if self.components.n_components > 1:
+            for a, b in zip(added // self.n_nodes, added % self.n_nodes):
+                self.components.union(a, b)
+
+    def remove_edges(self, removed, kept):
+        """
+        Split the components that the removed edges disconnect
+        Args:
+            removed (): keys of the removed edges
+            kept (): keys of the edges that are in the graph both before and after the removal
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+        i = kept // self.n_nodes
+        j = kept % self.n_nodes
+        graph = csr_matrix((np.ones(2 * len(kept), dtype=bool), (np.concatenate((i, j)), np.concatenate((j, i)))),
+                           shape=(self.n_nodes, self.n_nodes))
+        split = [a for a, b in zip(removed // self.n_nodes, removed % self.n_nodes) if not self.connected(graph, a, b)]
+        if not split:
+            return
+
+        # removing an edge may split a component, which union-find cannot undo, so those components are recomputed
+        labels = self.components.labels()
+        roots = np.unique(labels[split])
+        nodes = np.flatnonzero(np.isin(labels, roots))
+        n_parts, part = connected_components(graph[nodes][:, nodes], directed=False)
+        # the root of every part is its smallest node, as in UnionFind.rebuild
+        part_roots = np.full((n_parts,), self.n_nodes)
+        np.minimum.at(part_roots, part, nodes)
+        self.components.parent[nodes] = part_roots[part]
+        self.components.n_components += n_parts - len(roots)
+        self.n_rebuilds += 1
+
+    def connected(self, graph, a, b):
+        """
+        Search for a path between a and b in a CSR graph, from both ends, expanding the smaller frontier first
+        Returns: whether a path was found before the search visited search_limit agents
+        """
+        indptr = graph.indptr
+        indices = graph.indices
+        seen = ({int(a)}, {int(b)})
+        frontiers = ([int(a)], [int(b)])
+        n_visited = 2
+        while frontiers[0] and frontiers[1] and n_visited < self.search_limit:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            frontier = []
+            for node in frontiers[side]:
+                for neighbor in indices[indptr[node]:indptr[node + 1]].tolist():
+                    if neighbor in seen[1 - side]:
+                        return True
+                    if neighbor not in seen[side]:
+                        seen[side].add(neighbor)
+                        frontier.append(neighbor)
+            n_visited += len(frontier)
+            frontiers = (frontier, frontiers[1]) if side == 0 else (frontiers[0], frontier)
+        return False
+
+    def laplacian(self):
+        from scipy.sparse import coo_matrix
+        i = self.edges // self.n_nodes
+        j = self.edges % self.n_nodes
+        adj = coo_matrix((np.ones(len(i)), (i, j)), shape=(self.n_nodes, self.n_nodes))
+        adj = (adj + adj.T).tocsr()
+        degree = np.asarray(adj.sum(axis=1)).ravel()
+        return adj, degree
+
+    def algebraic_connectivity(self):
+        """
+        Returns: the algebraic connectivity of the graph, 0 if it is disconnected
+        """
+        if self.components.n_components > 1 or self.n_nodes < 2:
+            self.fiedler = None
+            return 0.0
+
+        adj, degree = self.laplacian()
+        if self.n_nodes < 4:
+            lap = np.diag(degree) - adj.toarray()
+            return float(np.linalg.eigvalsh(lap)[1])
+
+        from scipy.sparse.linalg import ArpackNoConvergence, LinearOperator, eigsh
+
+        # the largest eigenvalue of c I - L, on the complement of the constant vector, is c - lambda2.
+        # c bounds the spectrum of L, so that this eigenvalue is also the one of largest magnitude.
+        c = 2.0 * np.max(degree)
+
+        def matvec(v):
+            v = np.ravel(v)
+            v = v - np.mean(v)
+            w = c * v - (degree * v - adj.dot(v))
+            return w - np.mean(w)
+
+        op = LinearOperator((self.n_nodes, self.n_nodes), matvec=matvec, dtype=float)
+        v0 = self.fiedler
+        if v0 is None:
+            v0 = np.random.RandomState(0).uniform(-1, 1, size=(self.n_nodes,))
+        try:
+            vals, vecs = eigsh(op, k=1, which='LA', v0=v0, tol=self.tol)
+        except ArpackNoConvergence as e:
+            if len(e.eigenvalues) == 0:
+                return self.lambda2 if self.lambda2 is not None else 0.0
+            vals, vecs = e.eigenvalues, e.eigenvectors
+        self.fiedler = vecs[:, 0]
+        return max(float(c - vals[0]), 0.0)
+
+    def get_state(self):
+        # the edges and Fiedler vector are replaced, not modified, by update, so they are shared
+        return self.edges, self.components.parent.copy(), self.components.n_components, self.lambda2, self.fiedler, \
+            self.n_steps
+
+    def set_state(self, state):
+        self.edges, parent, n_components, self.lambda2, self.fiedler, self.n_steps = state
+        # the neighbor list is rebuilt at the restored positions
+        if self.neighbors is not None:
+            self.neighbors.reset()
+        self.components = UnionFind(len(parent))
+        self.components.parent = parent.copy()
+        self.components.n_components = n_components
+
+    def update(self, env, info):
+        self.n_steps += 1
+        self.update_components(self.edge_keys(env))
+        if self.lambda2_interval > 0 and self.n_steps % self.lambda2_interval == 0:
+            self.lambda2 = self.algebraic_connectivity()
+
+        info['graph'] = {'components': self.components.n_components, 'lambda2': self.lambda2}
+
+        if self.terminate_on_fragment and self.components.n_components > 1:
+            return True
+        if self.min_lambda2 is not None and self.lambda2 is not None and self.lambda2 < self.min_lambda2:
+            return True
+        return False
+
+
+SAFETY_MODES = ('terminate', 'truncate', 'warn')
+
+
+class SafetyMonitor(object):
+    """
+    Flags collisions between agents, exploding velocities or accelerations, and non-finite states. Colliding pairs are
+    found with a NeighborList over the collision radius, in O(N) per step for a bounded density of agents.
+
+    In 'terminate' mode, a violation ends the episode. In 'truncate' mode, it also ends the episode but sets
+    info['TimeLimit.truncated'], as gym's TimeLimit does, so that learners bootstrap from the last state. In 'warn'
+    mode, violations are only reported. The reasons are always listed in info['safety'].
+    """
+
+    def __init__(self, collision_radius=0.1, max_speed=None, max_accel=None, mode='terminate', skin=None):
+        """
+        Args:
+            collision_radius (): agents closer than this distance are in collision, or None to ignore collisions
+            max_speed (): speed of any agent above which the velocities have blown up, or None
+            max_accel (): acceleration of any agent above which the controls have blown up, or None
+            mode (): 'terminate', 'truncate' or 'warn'
+            skin (): skin of the neighbor list, 4 collision radii by default
+        """
+        if mode not in SAFETY_MODES:
+            raise ValueError('Unknown safety mode: ' + str(mode))
+        self.collision_radius = collision_radius
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.mode = mode
+
+        self.neighbors = None
+        if collision_radius is not None:
+            from gym_flock.envs.neighbors import NeighborList
+            self.neighbors = NeighborList(collision_radius, 4.0 * collision_radius if skin is None else skin)
+        self.violations = {}
+
+    def reset(self, env):
+        if self.neighbors is not None:
+            self.neighbors.reset()
+        self.violations = {}
+
+    def get_state(self):
+        return dict(self.violations)
+
+    def set_state(self, state):
+        # the neighbor list is rebuilt at the restored positions
+        if self.neighbors is not None:
+            self.neighbors.reset()
+        self.violations = dict(state)
+
+    def check(self, env):
+        """
+        Returns: list of the reasons the current state is unsafe, and the colliding pairs
+        """
+        reasons = []
+        pairs = None
+        if not np.all(np.isfinite(env.x)):
+            return ['nonfinite'], pairs
+
+        if self.neighbors is not None:
+            i, j, _ = self.neighbors.update(env.x[:, 0:2])
+            if i.size > 0:
+                reasons.append('collision')
+                pairs = np.stack((i, j), axis=1)
+        if self.max_speed is not None:
+            if np.max(np.sum(np.square(env.x[:, 2:4]), axis=1)) > self.max_speed * self.max_speed:
+                reasons.append('velocity')
+        if self.max_accel is not None and env.u is not None:
+            u = np.asarray(env.u)
+            if not np.all(np.isfinite(u)):
+                reasons.append('nonfinite')
+            elif np.max(np.sum(np.square(u), axis=1)) > self.max_accel * self.max_accel:
+                reasons.append('acceleration')
+        return reasons, pairs
+
+    def update(self, env, info):
+        reasons, pairs = self.check(env)
+        if not reasons:
+            return False
+
+        for reason in reasons:
+            self.violations[reason] = self.violations.get(reason, 0) + 1
+        info['safety'] = {'reasons': reasons}
+        if pairs is not None:
+            info['safety']['collisions'] = pairs
+
+        if self.mode == 'warn':
+            import warnings
+            warnings.warn('Unsafe flock state: ' + ', '.join(reasons))
+            return False
+        if self.mode == 'truncate':
+            info['TimeLimit.truncated'] = True
+        return True
+
+
+class ConsensusDetector(object):
+    """
+    Ends episodes once the flock has reached velocity consensus: the velocity variance of instant_cost and its rate of
+    change are small, and the communication graph is unchanged, for a window of consecutive steps. After that, the
+    flock only translates rigidly, and further steps add little to the collected data.
+
+    In 'terminate' mode, the episode ends as if the task were complete. In 'truncate' mode, it also sets
+    info['TimeLimit.truncated'], so that learners bootstrap from the last state as if the time limit were reached.
+    """
+
+    def __init__(self, window=50, max_variance=1e-3, max_rate=1e-2, max_edge_changes=0, mode='truncate'):
+        """
+        Args:
+            window (): number of consecutive steps the consensus conditions must hold
+            max_variance (): largest velocity variance at consensus
+            max_rate (): largest absolute rate of change of the velocity variance at consensus, per unit time
+            max_edge_changes (): largest number of links made or broken in a step at consensus
+            mode (): 'terminate' or 'truncate'
+        """
+        if mode not in ('terminate', 'truncate'):
+            raise ValueError('Unknown consensus mode: ' + str(mode))
+        self.window = window
+        self.max_variance = max_variance
+        self.max_rate = max_rate
+        self.max_edge_changes = max_edge_changes
+        self.mode = mode
+
+        self.variance = None
+        self.time = None
+        self.adj = None
+        self.n_held = 0
+        self.reached_at = None
+        self.n_steps = 0
+
+    def reset(self, env):
+        self.variance = -env.instant_cost()
+        self.time = env.time
+        self.adj = env.adj_mat > 0
+        self.n_held = 0
+        self.reached_at = None
+        self.n_steps = 0
+
+    def get_state(self):
+        # the adjacency is replaced, not modified, by update, so it is shared
+        return self.variance, self.time, self.adj, self.n_held, self.reached_at, self.n_steps
+
+    def set_state(self, state):
+        self.variance, self.time, self.adj, self.n_held, self.reached_at, self.n_steps = state
+
+    def update(self, env, info):
+        self.n_steps += 1
+        variance = -env.instant_cost()
+        # the time a step advances varies with the substeps, the adaptive integrator and random step durations
+        elapsed = env.time - self.time
+        rate = abs(variance - self.variance) / elapsed if elapsed > 0 else np.Inf
+        self.variance = variance
+        self.time = env.time
+
+        adj = env.adj_mat > 0
+        edge_changes = np.count_nonzero(adj != self.adj) // 2
+        self.adj = adj
+
+        if variance <= self.max_variance and rate <= self.max_rate and edge_changes <= self.max_edge_changes:
+            self.n_held += 1
+        else:
+            self.n_held = 0
+
+        info['consensus'] = {'variance': variance, 'rate': rate, 'steps_held': self.n_held}
+        if self.n_held < self.window:
+            return False
+
+        if self.reached_at is None:
+            self.reached_at = self.n_steps
+        if self.mode == 'truncate':
+            info['TimeLimit.truncated'] = True
+        return True
@@ -0,0 +1,75 @@
+import numpy as np
+import scipy.sparse
+from scipy.spatial import cKDTree
+
+
+class NeighborList(object):
+    """
+    Pairs of agents closer than a radius, maintained with a KD-tree and a Verlet skin.
+
+    The tree is queried for candidate pairs within radius + skin, and is only rebuilt once some agent has moved
+    more than half of the skin since the last build. Until then, every pair within the radius is guaranteed to be
+    a candidate, so each update only filters the candidates, which is O(N) for a bounded density of agents.
+    """
+
+    def __init__(self, radius, skin=None):
+        """
+        Args:
+            radius (): agents strictly closer than this are neighbors
+            skin (): extra search distance, trading larger candidate lists for fewer rebuilds
+        """
+        self.radius = radius
+        self.radius2 = radius * radius
+        self.skin = 0.2 * radius if skin is None else skin
+
+        self.n_builds = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Force a rebuild at the next update, e.g. when agents were teleported
+        """
+        self.build_pos = None
+        self.candidates = None
+
+    def build(self, pos):
+        tree = cKDTree(pos)
+        self.candidates = tree.query_pairs(self.radius + self.skin, output_type='ndarray')
+        self.build_pos = np.array(pos)
+        self.n_builds += 1
+
+    def update(self, pos):
+        """
+        Find the neighboring pairs at the current positions
+        Args:
+            pos (): positions of all agents, with shape (n_agents, 2)
+
+        Returns: arrays i, j of the pairs of neighbors, with i < j, and their squared distances
+
+        """
+        if self.build_pos is None or self.build_pos.shape != pos.shape:
+            self.build(pos)
+        else:
+            moved2 = np.max(np.sum(np.square(pos - self.build_pos), axis=1))
+            if moved2 > 0.25 * self.skin * self.skin:
+                self.build(pos)
+
+        i = self.candidates[:, 0]
+        j = self.candidates[:, 1]
+        r2 = np.sum(np.square(pos[i] - pos[j]), axis=1)
+        close = r2 < self.radius2
+        return i[close], j[close], r2[close]
+
+    def adjacency(self, pos):
+        """
+        Args:
+            pos (): positions of all agents, with shape (n_agents, 2)
+
+        Returns: symmetric sparse adjacency matrix of the agents
+
+        """
+        n_agents = pos.shape[0]
+        i, j, _ = self.update(pos)
+        rows = np.concatenate((i, j))
+        cols = np.concatenate((j, i))
+        return scipy.sparse.csr_matrix((np.ones(rows.shape), (rows, cols)), shape=(n_agents, n_agents))
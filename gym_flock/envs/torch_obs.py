@@ -0,0 +1,86 @@
+"""
+Observations of the flocking envs as PyTorch tensors, with the network in sparse format.
+
+TorchObservationWrapper turns each observation (state_values, state_network) into tensors
+(state_values, (edge_index, edge_weight)): the features of the agents, and the network in sparse COO format, so that
+torch.sparse_coo_tensor(edge_index, edge_weight, (n_agents, n_agents)) is state_network.
+
+The envs allocate new features at every step, in compute_helpers or in the multi-hop aggregation, so when the dtype
+of the wrapper is that of the env, the features tensor shares memory with the env's state_values without any copy.
+Features of another dtype, or read-only ones such as those of the JAX env, are converted into a new array. Either
+way, holding on to observations, e.g. in a replay buffer, is safe. The edges are gathered into new arrays without any
+pass over all pairs of agents: from the sparse networks of the ragged and distributed envs, or from a NeighborList
+over the positions of the agents of a FlockingRelativeEnv, whose network is nonzero only between agents closer than
+the communication radius. Only the dense networks of other envs are scanned for their nonzeros.
+"""
+import gym
+import numpy as np
+import scipy.sparse
+import torch
+from gym import spaces
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.neighbors import NeighborList
+
+
+class TorchObservationWrapper(gym.Wrapper):
+    """
+    Returns the observations of a flocking env as PyTorch tensors, with the network in sparse COO format
+    """
+
+    def __init__(self, env, dtype=np.float32):
+        """
+        Args:
+            env (): flocking env, with observations (state_values, state_network)
+            dtype (): dtype of the features and edge weights, np.float64 to share the features with the env
+        """
+        super(TorchObservationWrapper, self).__init__(env)
+        self.dtype = np.dtype(dtype)
+        self.neighbors = None
+        # the features of the agents, as in the wrapped env, with the dtype of the tensors
+        self.observation_space = spaces.Box(low=-np.Inf, high=np.Inf, shape=env.observation_space.shape,
+                                            dtype=self.dtype)
+
+    def edges(self, state_network):
+        """
+        Returns: the rows, columns and weights of the edges of the network, sorted by row and then column
+        """
+        if scipy.sparse.issparse(state_network):
+            coo = state_network.tocoo()
+            order = np.lexsort((coo.col, coo.row))
+            return coo.row[order], coo.col[order], coo.data[order]
+
+        env = self.env.unwrapped
+        n_agents = state_network.shape[0]
+        if isinstance(env, FlockingRelativeEnv) and env.x.shape[0] == n_agents:
+            if self.neighbors is None or self.neighbors.radius != env.comm_radius:
+                self.neighbors = NeighborList(env.comm_radius)
+            i, j, _ = self.neighbors.update(env.x[:, 0:2])
+            rows = np.concatenate((i, j))
+            cols = np.concatenate((j, i))
+            order = np.argsort(rows * n_agents + cols)
+            rows = rows[order]
+            cols = cols[order]
+            return rows, cols, state_network[rows, cols]
+
+        # finding the nonzeros of a boolean mask is much faster than of a float matrix
+        edges = np.flatnonzero(state_network != 0)
+        rows, cols = np.divmod(edges, n_agents)
+        return rows, cols, np.ravel(state_network).take(edges)
+
+    def observation(self, observation):
+        state_values, state_network = observation
+        rows, cols, weights = self.edges(state_network)
+        edge_index = np.stack((rows, cols)).astype(np.int64, copy=False)
+        # weights are gathered into a new array, so only their dtype may need converting
+        edge_weight = weights.astype(self.dtype, copy=False)
+        values = np.asarray(state_values)
+        if values.dtype != self.dtype or not values.flags.writeable:
+            values = values.astype(self.dtype)
+        return torch.from_numpy(values), (torch.from_numpy(edge_index), torch.from_numpy(edge_weight))
+
+    def reset(self, **kwargs):
+        return self.observation(self.env.reset(**kwargs))
+
+    def step(self, action):
+        observation, reward, done, info = self.env.step(action)
+        return self.observation(observation), reward, done, info
@@ -74,4 +74,55 @@ def parse_settings(fname):
         p = re.findall(r'"X": ([-+]?\d*\.*\d+), "Y": ([-+]?\d*\.*\d+), "Z": ([-+]?\d*\.*\d+)', line)
         if p:
             homes.append(np.array([float(p[0][0]), float(p[0][1]), float(p[0][2])]).reshape((1, 3)))
-    return names, np.concatenate(homes, axis=0)
\ No newline at end of file
+    return names, np.concatenate(homes, axis=0)
+
+
+# formation shapes of N agents, centered at the origin, with adjacent agents spacing apart
+def line_formation(N, spacing=1.0):
+    xs = (np.arange(N) - (N - 1) / 2.0) * spacing
+    return np.hstack((xs.reshape((N, 1)), np.zeros((N, 1))))
+
+
+def column_formation(N, spacing=1.0):
+    return line_formation(N, spacing)[:, ::-1].copy()
+
+
+def wedge_formation(N, spacing=1.0):
+    # leader in front, followers alternating left and right further back
+    ranks = (np.arange(N) + 1) // 2
+    sides = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+    xs = sides * ranks * spacing * np.cos(np.pi / 4)
+    ys = -ranks * spacing * np.sin(np.pi / 4)
+    ys = ys - np.mean(ys)
+    return np.hstack((xs.reshape((N, 1)), ys.reshape((N, 1))))
+
+
+def circle_formation(N, spacing=1.0):
+    if N == 1:
+        return np.zeros((1, 2))
+    r = spacing / (2 * np.sin(np.pi / N))
+    angles = np.linspace(0, 2 * np.pi, N, endpoint=False).reshape((N, 1))
+    return r * np.hstack((np.cos(angles), np.sin(angles)))
+
+
+def grid_formation(N, spacing=1.0):
+    side = int(np.ceil(np.sqrt(N)))
+    xs = np.arange(N) % side
+    ys = np.arange(N) // side
+    locs = np.hstack((xs.reshape((N, 1)), ys.reshape((N, 1)))).astype(float)
+    return (locs - np.mean(locs, axis=0)) * spacing
+
+
+FORMATIONS = {
+    'line': line_formation,
+    'column': column_formation,
+    'wedge': wedge_formation,
+    'circle': circle_formation,
+    'grid': grid_formation,
+}
+
+
+def formation(name, N, spacing=1.0):
+    if name not in FORMATIONS:
+        raise ValueError('Unknown formation: ' + str(name))
+    return FORMATIONS[name](N, spacing)
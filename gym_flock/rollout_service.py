@@ -0,0 +1,332 @@
+"""
+A rollout service generating expert demonstrations with workers on any number of machines, over TCP.
+
+The server queues episodes and dispatches each to an idle worker. Workers connect to the server, register, and build
+the env template sent back by the server. They then run the episodes they are given with the expert controller,
+labelling every observation with its controls, and stream the transitions back in zlib-compressed chunks.
+Transitions are only handed to the consumer once their episode is complete, so the episodes of workers that fail,
+disconnect or stop responding are dispatched again from scratch, with the same seed.
+
+The server only reads from workers while the consumer iterates over the episodes, and a worker waits for its next
+episode until the server has received the previous one. A slow consumer therefore throttles the workers through the
+flow control of TCP, rather than the server buffering their transitions in memory.
+
+    server = RolloutServer(make_flock, address=('0.0.0.0', 6000), authkey=key)
+    server.submit(100, seed=0)
+    for episode in server.episodes():
+        dataset.append(episode.state_values, episode.state_networks, episode.actions)
+    server.close()
+
+and on every machine, with the key in hex in the environment variable GYM_FLOCK_AUTHKEY,
+
+    python -m gym_flock.rollout_service SERVER_HOST:6000 --workers 4
+
+Templates are registered env ids, or picklable callables importable by the workers.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+import traceback
+import zlib
+from multiprocessing.connection import AuthenticationError, Client, Listener, wait
+import numpy as np
+from gym_flock.worker_pool import make_template
+
+
+def compress(obj, level):
+    return zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), level)
+
+
+def decompress(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+class Episode(object):
+    """
+    Transitions of one expert episode, stacked over time
+    """
+
+    def __init__(self, episode_id, seed, worker, transitions):
+        self.episode_id = episode_id
+        self.seed = seed
+        self.worker = worker
+        self.state_values = np.stack([t[0] for t in transitions])
+        self.state_networks = np.stack([t[1] for t in transitions])
+        self.actions = np.stack([t[2] for t in transitions])
+        self.rewards = np.array([t[3] for t in transitions])
+        self.dones = np.array([t[4] for t in transitions])
+
+    def __len__(self):
+        return len(self.rewards)
+
+
+def run_episode(conn, env, episode_id, seed, max_steps, chunk_steps, level):
+    """
+    Run one episode with the expert controller, and stream its transitions to the server
+    """
+    np.random.seed(seed)
+    env.unwrapped.seed(seed)
+    (state_values, state_network) = env.reset()
+    chunk = []
+    for _ in range(max_steps):
+        u = env.unwrapped.controller()
+        obs, reward, done, _ = env.step(u)
+        chunk.append((state_values, state_network, u, reward, done))
+        (state_values, state_network) = obs
+        if done:
+            break
+        if len(chunk) == chunk_steps:
+            conn.send(('chunk', episode_id, compress(chunk, level)))
+            chunk = []
+    conn.send(('done', episode_id, compress(chunk, level)))
+
+
+def run_worker(address, authkey, name=None, chunk_steps=50, level=1):
+    """
+    Serve episodes to a rollout server until it closes
+    Args:
+        address (): address (host, port) of the server
+        authkey (): authentication key of the server
+        name (): name of the worker, by default its host and process id
+        chunk_steps (): number of transitions per chunk sent to the server
+        level (): zlib compression level of the chunks
+    """
+    conn = Client(tuple(address), authkey=authkey)
+    name = '%s:%d' % (socket.gethostname(), os.getpid()) if name is None else name
+    conn.send(('register', name))
+    env = make_template(conn.recv())
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            if request[0] == 'close':
+                return
+            _, episode_id, seed, max_steps = request
+            try:
+                run_episode(conn, env, episode_id, seed, max_steps, chunk_steps, level)
+            except (EOFError, OSError):
+                return
+            except Exception:
+                conn.send(('error', episode_id, traceback.format_exc()))
+    finally:
+        env.close()
+        conn.close()
+
+
+class WorkerState(object):
+    """
+    The server's view of one connected worker
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.name = None
+        self.episode = None
+        self.chunks = []
+        self.last_seen = time.time()
+
+
+class RolloutServer(object):
+    """
+    Dispatches expert episodes to rollout workers, and collects their transitions
+    """
+
+    def __init__(self, template, address=('localhost', 0), authkey=None, max_episode_steps=200, episode_timeout=60.0,
+                 max_attempts=3):
+        """
+        Args:
+            template (): registered env id, or picklable callable returning an env, built by every worker
+            address (): address (host, port) to listen on, with port 0 for any free port
+            authkey (): authentication key of the workers, drawn at random if not given
+            max_episode_steps (): largest number of steps of an episode
+            episode_timeout (): seconds without any message from a worker running an episode before it is given up
+            max_attempts (): number of times an episode is dispatched before the server gives up on it
+        """
+        self.template = template
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self.max_episode_steps = max_episode_steps
+        self.episode_timeout = episode_timeout
+        self.max_attempts = max_attempts
+
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.new_conns = queue.Queue()
+        self.accepting = threading.Thread(target=self.accept, daemon=True)
+        self.accepting.start()
+
+        self.workers = {}
+        self.pending = collections.deque()
+        self.seeds = {}
+        self.attempts = {}
+        self.n_submitted = 0
+        self.n_redispatched = 0
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError, ConnectionError):
+                continue
+            except OSError:
+                # the listener was closed
+                return
+            self.new_conns.put(conn)
+
+    def submit(self, n_episodes, seed=None):
+        """
+        Queue episodes
+        Args:
+            n_episodes (): number of episodes
+            seed (): seed of the first episode, incremented for the following ones, or None for random seeds
+
+        Returns: ids of the episodes
+
+        """
+        ids = list(range(self.n_submitted, self.n_submitted + n_episodes))
+        for k, episode_id in enumerate(ids):
+            self.seeds[episode_id] = int.from_bytes(os.urandom(4), 'little') if seed is None else seed + k
+            self.attempts[episode_id] = 0
+            self.pending.append(episode_id)
+        self.n_submitted += n_episodes
+        return ids
+
+    def n_running(self):
+        return sum(1 for worker in self.workers.values() if worker.episode is not None)
+
+    def dispatch(self):
+        while not self.new_conns.empty():
+            conn = self.new_conns.get()
+            self.workers[conn] = WorkerState(conn)
+
+        for worker in list(self.workers.values()):
+            if not self.pending:
+                return
+            if worker.name is None or worker.episode is not None:
+                continue
+            episode_id = self.pending.popleft()
+            self.attempts[episode_id] += 1
+            try:
+                worker.conn.send(('episode', episode_id, self.seeds[episode_id], self.max_episode_steps))
+            except OSError:
+                self.pending.appendleft(episode_id)
+                self.attempts[episode_id] -= 1
+                self.drop(worker)
+                continue
+            worker.episode = episode_id
+            worker.chunks = []
+            worker.last_seen = time.time()
+
+    def redispatch(self, episode_id, reason):
+        if self.attempts[episode_id] >= self.max_attempts:
+            raise RuntimeError('Episode %d failed %d times, last in a worker:\n%s'
+                               % (episode_id, self.attempts[episode_id], reason))
+        self.n_redispatched += 1
+        self.pending.appendleft(episode_id)
+
+    def drop(self, worker, reason='Worker disconnected.'):
+        del self.workers[worker.conn]
+        worker.conn.close()
+        if worker.episode is not None:
+            episode_id = worker.episode
+            worker.episode = None
+            self.redispatch(episode_id, reason)
+
+    def receive(self, worker):
+        """
+        Handle one message of a worker
+        Returns: the episode completed by the worker, if any
+        """
+        try:
+            message = worker.conn.recv()
+        except (EOFError, OSError):
+            self.drop(worker)
+            return None
+        worker.last_seen = time.time()
+
+        if message[0] == 'register':
+            worker.name = message[1]
+            worker.conn.send(self.template)
+        elif message[0] == 'chunk' and message[1] == worker.episode:
+            worker.chunks.append(message[2])
+        elif message[0] == 'done' and message[1] == worker.episode:
+            worker.chunks.append(message[2])
+            transitions = [t for chunk in worker.chunks for t in decompress(chunk)]
+            episode = Episode(worker.episode, self.seeds[worker.episode], worker.name, transitions)
+            worker.episode = None
+            worker.chunks = []
+            return episode
+        elif message[0] == 'error' and message[1] == worker.episode:
+            episode_id = worker.episode
+            worker.episode = None
+            self.redispatch(episode_id, message[2])
+        return None
+
+    def episodes(self, poll_interval=0.1):
+        """
+        Run the submitted episodes on the workers, including workers connecting meanwhile
+        Args:
+            poll_interval (): seconds between checks for new workers and timeouts
+
+        Returns: generator of the episodes, in order of completion
+
+        """
+        while self.pending or self.n_running() > 0:
+            self.dispatch()
+            ready = wait([worker.conn for worker in self.workers.values()], timeout=poll_interval)
+            if not self.workers:
+                time.sleep(poll_interval)
+            for conn in ready:
+                if conn in self.workers:
+                    episode = self.receive(self.workers[conn])
+                    if episode is not None:
+                        yield episode
+
+            now = time.time()
+            for worker in list(self.workers.values()):
+                if worker.episode is not None and now - worker.last_seen > self.episode_timeout:
+                    self.drop(worker, 'Worker %s timed out.' % worker.name)
+
+    def close(self):
+        for worker in list(self.workers.values()):
+            try:
+                worker.conn.send(('close',))
+            except OSError:
+                pass
+            worker.conn.close()
+        self.workers = {}
+        self.listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run rollout workers for a gym_flock rollout server.')
+    parser.add_argument('server', help='address of the server, as HOST:PORT')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--chunk-steps', type=int, default=50)
+    args = parser.parse_args()
+
+    host, port = args.server.rsplit(':', 1)
+    authkey = bytes.fromhex(os.environ['GYM_FLOCK_AUTHKEY'])
+    processes = [multiprocessing.Process(target=run_worker, args=((host, int(port)), authkey),
+                                         kwargs={'chunk_steps': args.chunk_steps}) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
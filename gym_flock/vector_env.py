@@ -0,0 +1,287 @@
+"""
+Asynchronous vector env of flocking envs, exchanging observations and actions through shared memory.
+
+Every env runs in its own process and writes its observations (state_values, state_network) into preallocated slots
+of one shared memory block, which the learner reads as batched arrays without any copy. Only commands and info dicts
+go through pipes. The network is stored either dense, with shape (n_envs, n_agents, n_agents), or sparse, as edge
+lists padded to max_edges with zero weights:
+
+    envs = SharedMemoryVectorEnv([make_flock] * 8, network='sparse', max_edges=4000, expert=True)
+    state_values, (edge_index, edge_weight, n_edges) = envs.reset()
+    envs.step_async(envs.expert_actions)
+    ...  # overlapped with the simulation
+    (state_values, network), rewards, dones, infos = envs.step_wait()
+
+The returned arrays are views of the shared memory, overwritten by the next step or reset, so observations that are
+kept must be copied. Envs are reset automatically at the end of their episodes, and then return the first observation
+of the next episode.
+"""
+import multiprocessing
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+from gym_flock.worker_pool import _result, make_template
+
+NETWORK_FORMATS = ('dense', 'sparse')
+
+
+class SharedArrays(object):
+    """
+    Named arrays in one shared memory block
+    """
+
+    def __init__(self, specs, name=None):
+        """
+        Args:
+            specs (): list of (name, shape, dtype) of the arrays
+            name (): name of an existing block to attach to, or None to create one
+        """
+        self.specs = specs
+        offsets = []
+        size = 0
+        for _, shape, dtype in specs:
+            offsets.append(size)
+            # aligned to cache lines
+            size += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.arrays = {}
+        for (key, shape, dtype), offset in zip(specs, offsets):
+            self.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def write_observation(arrays, index, observation, network):
+    state_values, state_network = observation
+    arrays['values'][index] = state_values
+    if network == 'dense':
+        arrays['network'][index] = state_network
+        return
+
+    edges = np.flatnonzero(state_network != 0)
+    n_edges = edges.shape[0]
+    max_edges = arrays['edge_weight'].shape[1]
+    if n_edges > max_edges:
+        raise ValueError('The network has %d edges, more than max_edges = %d.' % (n_edges, max_edges))
+    edge_index = arrays['edge_index'][index]
+    np.divmod(edges, state_network.shape[0], out=(edge_index[0, 0:n_edges], edge_index[1, 0:n_edges]))
+    edge_index[:, n_edges:] = 0
+    edge_weight = arrays['edge_weight'][index]
+    edge_weight[0:n_edges] = np.ravel(state_network).take(edges)
+    edge_weight[n_edges:] = 0
+    arrays['n_edges'][index] = n_edges
+
+
+def _shared_worker(index, conn, env_fn, network, expert):
+    env = None
+    arrays = None
+    try:
+        env = make_template(env_fn)
+        observation = env.reset()
+        conn.send(('ok', (np.shape(observation[0]), env.unwrapped.nu)))
+        name, specs = conn.recv()
+        arrays = SharedArrays(specs, name)
+
+        def write(observation):
+            write_observation(arrays, index, observation, network)
+            if expert:
+                arrays['expert'][index] = env.unwrapped.controller()
+
+        write(observation)
+        conn.send(('ok', None))
+    except Exception as e:
+        conn.send(('error', (e, traceback.format_exc())))
+        return
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        command = request[0]
+        try:
+            if command == 'close':
+                conn.send(('ok', None))
+                break
+            elif command == 'reset':
+                write(env.reset())
+                result = None
+            elif command == 'step':
+                observation, reward, done, info = env.step(np.array(arrays['actions'][index]))
+                if done:
+                    observation = env.reset()
+                arrays['rewards'][index] = reward
+                arrays['dones'][index] = done
+                write(observation)
+                result = info
+            elif command == 'call':
+                result = getattr(env.unwrapped, request[1])(*request[2], **request[3])
+            else:
+                raise ValueError('Unknown command: ' + str(command))
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', (e, traceback.format_exc())))
+    arrays.close()
+    env.close()
+
+
+class SharedMemoryVectorEnv(object):
+    """
+    Steps flocking envs in subprocesses, with observations and actions in shared memory
+    """
+
+    def __init__(self, env_fns, network='dense', max_edges=None, expert=False, start_method='spawn'):
+        """
+        Args:
+            env_fns (): registered env ids, or picklable callables returning envs, all with the same number of agents
+            network (): 'dense' or 'sparse' storage of the networks
+            max_edges (): largest number of edges of a sparse network, by default 32 per agent
+            expert (): whether to also compute the expert controls of every observation, in expert_actions
+            start_method (): multiprocessing start method of the workers
+        """
+        if network not in NETWORK_FORMATS:
+            raise ValueError('Unknown network format: ' + str(network))
+        self.num_envs = len(env_fns)
+        self.network = network
+        self.expert = expert
+        self.waiting = False
+        self.closed = False
+
+        ctx = multiprocessing.get_context(start_method)
+        self.conns = []
+        self.processes = []
+        for index, env_fn in enumerate(env_fns):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_shared_worker, args=(index, child_conn, env_fn, network, expert), daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+        try:
+            shapes = set(self.receive_all())
+        except Exception:
+            self.close()
+            raise
+        if len(shapes) != 1:
+            self.close()
+            raise ValueError('The envs have different numbers of agents or features: ' + str(sorted(shapes)))
+        (n_agents, n_features), nu = shapes.pop()
+        self.n_agents = n_agents
+        self.max_edges = 32 * n_agents if max_edges is None else max_edges
+
+        n = self.num_envs
+        specs = [('values', (n, n_agents, n_features), np.float64), ('actions', (n, n_agents, nu), np.float64),
+                 ('rewards', (n,), np.float64), ('dones', (n,), np.bool_)]
+        if network == 'dense':
+            specs.append(('network', (n, n_agents, n_agents), np.float64))
+        else:
+            specs += [('edge_index', (n, 2, self.max_edges), np.int64), ('edge_weight', (n, self.max_edges), np.float64),
+                      ('n_edges', (n,), np.int64)]
+        if expert:
+            specs.append(('expert', (n, n_agents, nu), np.float64))
+        self.arrays = SharedArrays(specs)
+        for conn in self.conns:
+            conn.send((self.arrays.name, specs))
+        try:
+            self.receive_all()
+        except Exception:
+            self.close()
+            raise
+
+        self.expert_actions = self.arrays['expert'] if expert else None
+
+    def receive_all(self):
+        results = []
+        error = None
+        for conn in self.conns:
+            try:
+                results.append(_result(conn.recv()))
+            except Exception as e:
+                # the replies of the other workers are still received, so that they stay in sync
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def observations(self):
+        if self.network == 'dense':
+            return self.arrays['values'], self.arrays['network']
+        return self.arrays['values'], (self.arrays['edge_index'], self.arrays['edge_weight'], self.arrays['n_edges'])
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(('reset',))
+        self.receive_all()
+        return self.observations()
+
+    def step_async(self, actions):
+        """
+        Start a step of every env, and return immediately
+        Args:
+            actions (): actions with shape (n_envs, n_agents, nu)
+        """
+        if self.waiting:
+            raise RuntimeError('step_async was called again before step_wait.')
+        self.arrays['actions'][:] = actions
+        for conn in self.conns:
+            conn.send(('step',))
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Wait for the step of every env
+        Returns: observations, rewards, dones and infos of all envs
+
+        """
+        self.waiting = False
+        infos = self.receive_all()
+        return self.observations(), self.arrays['rewards'], self.arrays['dones'], infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def call(self, method, *args, **kwargs):
+        """
+        Returns: the results of a method of every env
+        """
+        for conn in self.conns:
+            conn.send(('call', method, args, kwargs))
+        return self.receive_all()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.waiting:
+            self.step_wait()
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(('close',))
+                    conn.recv()
+                except (EOFError, OSError):
+                    pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+        if hasattr(self, 'arrays'):
+            self.arrays.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
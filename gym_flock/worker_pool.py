@@ -0,0 +1,274 @@
+"""
+A pool of env workers forked from a prewarmed parent.
+
+The pool starts one fork-server process, which imports gym_flock, builds an env from each template and resets it once.
+Every worker is then forked from that process, so it starts with the imports, parsed configs and built matrices of
+its template already in memory, shared copy-on-write, and is ready to step within milliseconds.
+
+    pool = WorkerPool({'flock': make_flock})
+    worker = pool.spawn('flock', seed=1)
+    obs = worker.reset()
+    obs, reward, done, info = worker.step(worker.controller())
+
+Forking workers requires a POSIX system.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import traceback
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+
+def make_template(template):
+    """
+    Args:
+        template (): a registered env id, or a picklable callable returning an env
+
+    Returns: the env
+
+    """
+    if callable(template):
+        return template()
+    import gym
+    import gym_flock  # noqa: F401, registers the envs
+    return gym.make(template)
+
+
+def _serve_worker(conn, env):
+    """
+    Serve env calls from the parent of the pool until it closes the worker
+    """
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        command = request[0]
+        try:
+            if command == 'close':
+                env.close()
+                conn.send(('ok', None))
+                return
+            elif command == 'reset':
+                result = env.reset()
+            elif command == 'step':
+                result = env.step(request[1])
+            elif command == 'controller':
+                result = env.unwrapped.controller(*request[1:])
+            elif command == 'call':
+                result = getattr(env.unwrapped, request[1])(*request[2], **request[3])
+            elif command == 'getattr':
+                result = getattr(env.unwrapped, request[1])
+            else:
+                raise ValueError('Unknown command: ' + str(command))
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', (e, traceback.format_exc())))
+
+
+def _fork_worker(envs, name, seed, address, authkey):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # in the worker
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # connect first, so that any later failure is reported to the parent instead of leaving it waiting
+        conn = Client(address, authkey=authkey)
+        try:
+            env = envs[name]
+            # forked workers would otherwise all draw the same random numbers as the template
+            seed = int.from_bytes(os.urandom(4), 'little') if seed is None else seed
+            np.random.seed(seed)
+            env.unwrapped.seed(seed)
+        except Exception as e:
+            conn.send(('error', (e, traceback.format_exc())))
+        else:
+            conn.send(('ok', None))
+            _serve_worker(conn, env)
+        conn.close()
+    finally:
+        os._exit(0)
+
+
+def _accept(listener, pid, authkey):
+    """
+    Accept the connection of a forked worker once it is ready to step
+    Args:
+        listener (): listener whose address was sent to the worker
+        pid (): pid of the worker
+        authkey (): authentication key of the listener
+
+    Returns: connection to the worker
+
+    """
+    accepted = threading.Event()
+
+    def watch():
+        # the fork server reaps its workers, so the pid of a worker that exited is gone
+        while not accepted.wait(0.1):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+        else:
+            return
+        # unblock the accept with the error of the worker
+        try:
+            with Client(listener.address, authkey=authkey) as conn:
+                conn.send(('error', (ChildProcessError('Worker ' + str(pid) + ' exited'),
+                                     'Worker ' + str(pid) + ' exited before connecting to the pool\n')))
+        except (OSError, EOFError):
+            pass
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        conn = listener.accept()
+    finally:
+        accepted.set()
+    try:
+        _result(conn.recv())
+    except EOFError:
+        conn.close()
+        raise RuntimeError('Worker ' + str(pid) + ' exited before it was ready to step')
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _fork_server(conn, templates):
+    """
+    Build and reset every template, then fork a worker for every request
+    """
+    # forked workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        envs = {}
+        for name, template in templates.items():
+            envs[name] = make_template(template)
+            envs[name].reset()
+        conn.send(('ok', sorted(envs)))
+    except Exception as e:
+        conn.send(('error', (e, traceback.format_exc())))
+        return
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request[0] == 'close':
+            return
+        _, name, seed, address, authkey = request
+        try:
+            if name not in envs:
+                raise KeyError('Unknown template: ' + str(name))
+            conn.send(('ok', _fork_worker(envs, name, seed, address, authkey)))
+        except Exception as e:
+            conn.send(('error', (e, traceback.format_exc())))
+
+
+def _result(reply):
+    status, value = reply
+    if status == 'error':
+        e, tb = value
+        raise RuntimeError('Error in gym_flock worker:\n' + tb) from e
+    return value
+
+
+class EnvWorker(object):
+    """
+    Handle on an env running in a forked worker
+    """
+
+    def __init__(self, conn, pid, name):
+        self.conn = conn
+        self.pid = pid
+        self.name = name
+
+    def request(self, *request):
+        self.conn.send(request)
+        return _result(self.conn.recv())
+
+    def reset(self):
+        return self.request('reset')
+
+    def step(self, u):
+        return self.request('step', u)
+
+    def controller(self, *args):
+        return self.request('controller', *args)
+
+    def call(self, method, *args, **kwargs):
+        return self.request('call', method, args, kwargs)
+
+    def get_attr(self, name):
+        return self.request('getattr', name)
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            self.request('close')
+        except (EOFError, OSError):
+            pass
+        self.conn.close()
+        self.conn = None
+
+
+class WorkerPool(object):
+    """
+    Forks ready-to-step env workers from a prewarmed fork-server process
+    """
+
+    def __init__(self, templates):
+        """
+        Args:
+            templates (): dict from template names to registered env ids, or to picklable callables returning envs
+        """
+        # the fork server is spawned, so it does not inherit the state of this process
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.server = ctx.Process(target=_fork_server, args=(child_conn, dict(templates)), daemon=True)
+        self.server.start()
+        child_conn.close()
+        self.templates = _result(self.conn.recv())
+        self.workers = []
+
+    def spawn(self, name, seed=None):
+        """
+        Fork a worker from a template
+        Args:
+            name (): name of the template
+            seed (): seed of the worker's random number generators, drawn at random if not given
+
+        Returns: EnvWorker handle
+
+        """
+        authkey = os.urandom(32)
+        with Listener(authkey=authkey) as listener:
+            self.conn.send(('fork', name, seed, listener.address, authkey))
+            pid = _result(self.conn.recv())
+            worker = EnvWorker(_accept(listener, pid, authkey), pid, name)
+        self.workers.append(worker)
+        return worker
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+        if self.server.is_alive():
+            self.conn.send(('close',))
+            self.server.join()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,48 @@
+import configparser
+import numpy as np
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+def make_env(env_cls, n_agents=20, comm_radius=1.0, seed=0, **params):
+    """
+    Build an env from a config section, as in training, and seed both random number generators
+    Args:
+        env_cls (): env class
+        n_agents (): number of agents
+        comm_radius (): communication radius
+        seed (): seed of np.random and of the env
+        **params (): further config keys
+
+    Returns: the env, not yet reset
+
+    """
+    config = configparser.ConfigParser()
+    section = {'n_agents': str(n_agents), 'comm_radius': str(comm_radius), 'v_max': '3.0', 'dt': '0.01'}
+    section.update({key: str(value) for key, value in params.items()})
+    config['flock'] = section
+    env = env_cls()
+    env.params_from_cfg(config['flock'])
+    np.random.seed(seed)
+    env.seed(seed)
+    return env
+
+
+def spread_flock(env, n_neighbors=6.0, seed=0):
+    """
+    Place the agents of a large flock uniformly at random, with about n_neighbors neighbors each, since reset is slow for
+    large flocks
+    """
+    rng = np.random.RandomState(seed)
+    side = np.sqrt(env.n_agents * np.pi * env.comm_radius2 / n_neighbors)
+    env.x = np.zeros((env.n_agents, env.nx_system))
+    env.x[:, 0:2] = rng.uniform(0, side, size=(env.n_agents, 2))
+    env.x[:, 2:4] = rng.uniform(-env.v_max, env.v_max, size=(env.n_agents, 2))
+    env.compute_helpers()
+    return env
+
+
+def make_flock(seed=0):
+    """
+    Template of the worker and rollout tests, importable by their spawned processes
+    """
+    return make_env(FlockingRelativeEnv, n_agents=20, seed=seed)
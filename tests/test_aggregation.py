@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from gym_flock.envs.aggregation import KHopAggregator
+
+
+def reference_pool(values, adj, pool):
+    """
+    Pool the values of the neighbors of every node with dense loops
+    """
+    pooled = np.zeros_like(values)
+    for i in range(adj.shape[0]):
+        neighbors = np.nonzero(adj[i])[0]
+        if neighbors.size == 0:
+            continue
+        weighted = adj[i, neighbors].reshape((-1, 1)) * values[neighbors]
+        if pool == 'sum':
+            pooled[i] = np.sum(weighted, axis=0)
+        elif pool == 'mean':
+            pooled[i] = np.sum(weighted, axis=0) / neighbors.size
+        elif pool == 'min':
+            pooled[i] = np.min(weighted, axis=0)
+        else:
+            pooled[i] = np.max(weighted, axis=0)
+    return pooled
+
+
+@pytest.mark.parametrize('pool', ['sum', 'mean', 'min', 'max'])
+def test_delayed_hops_match_reference(pool):
+    rng = np.random.RandomState(0)
+    n_nodes, n_features, filter_len = 12, 3, 4
+    aggregator = KHopAggregator(n_nodes, n_features, filter_len, (pool,))
+
+    # level k at step t pools the level k - 1 of the neighbors at step t - 1
+    levels = [np.zeros((n_nodes, n_features)) for _ in range(filter_len)]
+    for _ in range(6):
+        values = rng.normal(size=(n_nodes, n_features))
+        adj = (rng.uniform(size=(n_nodes, n_nodes)) < 0.3).astype(float)
+        np.fill_diagonal(adj, 0)
+        levels = [values] + [reference_pool(levels[k - 1], adj, pool) for k in range(1, filter_len)]
+        features = aggregator.update(values, adj)
+
+        expected = np.stack(levels, axis=1).reshape((n_nodes, filter_len * n_features))
+        assert np.allclose(features, expected)
+
+
+def test_reset_forgets_history():
+    rng = np.random.RandomState(1)
+    aggregator = KHopAggregator(5, 2, 3, ('sum', 'max'))
+    adj = np.ones((5, 5)) - np.eye(5)
+    for _ in range(3):
+        aggregator.update(rng.normal(size=(5, 2)), adj)
+    aggregator.reset()
+    values = rng.normal(size=(5, 2))
+    features = aggregator.update(values, adj).reshape((5, 3, 2, 2))
+    assert np.array_equal(features[:, 0, :, 0], values)
+    assert np.array_equal(features[:, 1:], np.zeros((5, 2, 2, 2)))
@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+airsim = pytest.importorskip('airsim')
+
+from time import perf_counter, sleep
+from gym_flock.envs.airsim_io import AirsimStateFetcher, ControlPacer, quaternion_to_yaw
+from gym_flock.envs.airsim_standin import AirsimStandInServer, write_settings
+from gym_flock.envs.flocking_airsim_accel import FlockingAirsimAccelEnv
+from gym_flock.envs.utils import grid
+
+NAMES = ['Drone' + str(i) for i in range(10)]
+
+
+@pytest.fixture
+def server():
+    with AirsimStandInServer(NAMES, port=0, seed=0) as server:
+        yield server
+
+
+def connect(server):
+    client = airsim.MultirotorClient(ip=server.address[0], port=server.address[1])
+    client.confirmConnection()
+    return client
+
+
+def move_all(client, rng):
+    for name in NAMES:
+        client.moveByAngleZAsync(*rng.uniform(-0.2, 0.2, size=(2,)), -5.0, rng.uniform(-1, 1), 0.5,
+                                 vehicle_name=name).join()
+
+
+def serial_states(client, home):
+    states = np.zeros((len(NAMES), 4))
+    yaws = np.zeros((len(NAMES), 1))
+    for i, name in enumerate(NAMES):
+        kinematics = client.getMultirotorState(vehicle_name=name).kinematics_estimated
+        states[i] = [kinematics.position.x_val + home[i][0], kinematics.position.y_val + home[i][1],
+                     kinematics.linear_velocity.x_val, kinematics.linear_velocity.y_val]
+        yaws[i] = quaternion_to_yaw(kinematics.orientation)
+    return states, yaws
+
+
+def test_concurrent_fetch_matches_serial_queries(server):
+    client = connect(server)
+    home = np.random.RandomState(0).uniform(-10, 10, size=(len(NAMES), 3))
+    fetcher = AirsimStateFetcher(NAMES, home, lambda: connect(server), n_clients=4)
+    rng = np.random.RandomState(1)
+    try:
+        move_all(client, rng)
+        states, yaws = fetcher.fetch()
+        first = states.copy()
+        expected_states, expected_yaws = serial_states(client, home)
+        assert np.allclose(states, expected_states)
+        assert np.allclose(yaws, expected_yaws)
+
+        # the arrays of a fetch stay valid during the next one
+        move_all(client, rng)
+        fetcher.fetch()
+        assert np.array_equal(states, first)
+
+        latency = fetcher.step_latency()
+        assert {'p50', 'p90', 'p99', 'max', 'fetch'} <= set(latency)
+        assert len(fetcher.clients) <= 4
+    finally:
+        fetcher.close()
+
+
+def make_airsim_env(server, tmp_path):
+    settings = str(tmp_path / 'settings.json')
+    write_settings(settings, NAMES, np.hstack((grid(len(NAMES)) * 4.0, np.zeros((len(NAMES), 1)))))
+    return FlockingAirsimAccelEnv(settings_file=settings, ip=server.address[0], port=server.address[1])
+
+
+def test_pipelined_stepping_sends_the_same_commands(server, tmp_path):
+    env = make_airsim_env(server, tmp_path)
+    actions = np.random.RandomState(2).uniform(-0.5, 0.5, size=(5, len(NAMES), 2))
+    final = []
+    try:
+        for pipelined in (False, True):
+            env.set_stepping(pipelined=pipelined)
+            np.random.seed(0)
+            env.reset()
+            for u in actions:
+                _, _, _, info = env.step(u)
+                assert 'rpc_latency' in info
+            env.join_commands()
+            final.append((server.standin.pos.copy(), server.standin.vel.copy()))
+    finally:
+        env.close()
+    assert np.allclose(final[0][0], final[1][0])
+    assert np.allclose(final[0][1], final[1][1])
+
+
+def test_control_pacer_counts_missed_deadlines():
+    pacer = ControlPacer(0.02)
+    assert not pacer.wait()
+    assert not pacer.wait()
+    sleep(0.05)
+    assert pacer.wait()
+    stats = pacer.stats()
+    assert stats['ticks'] == 3 and stats['misses'] == 1 and stats['max_lateness'] > 0
+
+
+def test_standin_integrates_tilt_commands(server):
+    client = connect(server)
+    client.moveByAngleZAsync(0.1, 0.0, -5.0, 0.0, 0.5, vehicle_name='Drone3').join()
+    state = client.getMultirotorState(vehicle_name='Drone3').kinematics_estimated
+    # a pitch of 0.1 accelerates the vehicle backwards by 0.1 g
+    accel = -9.8 * 0.1
+    assert np.isclose(state.linear_velocity.x_val, accel * 0.5)
+    assert np.isclose(state.position.x_val, accel * 0.5 * 0.5 * 0.5)
+    assert np.isclose(state.position.z_val, -5.0)
+
+
+def test_standin_injects_latency():
+    with AirsimStandInServer(NAMES, port=0, latency=0.001, method_latency={'getMultirotorState': 0.02}) as server:
+        client = connect(server)
+        start = perf_counter()
+        client.getMultirotorState(vehicle_name='Drone0')
+        assert perf_counter() - start >= 0.02
+        assert server.standin.n_calls >= 1
+
+
+def test_steps_keep_the_aggregation_history(server, tmp_path):
+    env = make_airsim_env(server, tmp_path)
+    env.enable_aggregation(3)
+    try:
+        np.random.seed(0)
+        env.reset()
+        for _ in range(2):
+            env.step(np.zeros((len(NAMES), 2)))
+        features = env.state_values.reshape((len(NAMES), 3, env.n_features))
+        # the 2-hop features of the last step are the pooled 1-hop features of the step before
+        assert np.any(features[:, 2] != 0)
+    finally:
+        env.close()
+
+
+def test_snapshots_are_rejected(server, tmp_path):
+    env = make_airsim_env(server, tmp_path)
+    try:
+        with pytest.raises(ValueError, match='AirSim'):
+            env.get_state()
+        with pytest.raises(ValueError, match='AirSim'):
+            env.set_state({})
+    finally:
+        env.close()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.distributed import DistributedFlock
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+@pytest.mark.parametrize('centralized', [True, False])
+def test_distributed_flock_matches_single_process(centralized):
+    env = make_env(FlockingRelativeEnv, n_agents=60)
+    env.centralized = centralized
+    env.reset()
+    spread_flock(env, n_neighbors=6.0)
+
+    flock = DistributedFlock.from_env(env, n_workers=3, rebalance_interval=4)
+    try:
+        flock.load(env.x)
+        for _ in range(10):
+            x, state_values, controls, state_network = flock.gather(network=True)
+            assert np.allclose(x, env.x, rtol=1e-9, atol=1e-12)
+            assert np.allclose(state_values, env.state_values, rtol=1e-9, atol=1e-9)
+            assert np.allclose(state_network.toarray(), env.state_network)
+            u = env.controller()
+            assert np.allclose(controls, u, rtol=1e-9, atol=1e-9)
+
+            _, cost, _, _ = env.step(u)
+            assert np.isclose(flock.step(), cost, rtol=1e-9)
+    finally:
+        flock.close()
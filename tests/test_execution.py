@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from conftest import make_env
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+def run(execution, n_steps=10, **kwargs):
+    """
+    Returns: the helpers and expert controls along a trajectory of the expert
+    """
+    env = make_env(FlockingRelativeEnv, n_agents=20, filter_length=2)
+    # row blocks of 3 agents
+    env.set_execution(execution, tile_bytes=8 * (env.nx_system + 2) * env.n_agents * 3, **kwargs)
+    assert len(env.row_blocks()) == 7
+    env.reset()
+    trajectory = []
+    for _ in range(n_steps):
+        controls = [env.controller(centralized) for centralized in (True, False)]
+        trajectory.append((env.state_values.copy(), env.r2.copy(), env.adj_mat.copy(), env.state_network.copy(),
+                           controls[0], controls[1]))
+        env.step(controls[0])
+    env.shutdown_executor()
+    return trajectory
+
+
+def test_tiled_execution_is_identical_to_dense():
+    for dense, tiled in zip(run('dense'), run('tiled')):
+        for expected, value in zip(dense, tiled):
+            assert np.array_equal(expected, value)
+
+
+def test_threaded_execution_is_identical_to_dense():
+    for dense, threaded in zip(run('dense'), run('threaded', n_threads=3)):
+        for expected, value in zip(dense, threaded):
+            assert np.array_equal(expected, value)
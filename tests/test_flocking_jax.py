@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+jax = pytest.importorskip('jax')
+
+from conftest import make_env
+from gym_flock.envs.flocking_jax import FlockingRelativeJaxEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+
+@pytest.mark.parametrize('centralized', [True, False])
+def test_jax_env_matches_numpy_env(centralized):
+    envs = [make_env(env_cls, n_agents=20) for env_cls in (FlockingRelativeEnv, FlockingRelativeJaxEnv)]
+    for env in envs:
+        np.random.seed(0)
+        env.reset()
+    for _ in range(10):
+        u = envs[0].controller(centralized)
+        assert np.allclose(envs[1].controller(centralized), u, rtol=1e-9, atol=1e-9)
+        costs = [env.step(u)[1] for env in envs]
+        assert np.isclose(costs[0], costs[1], rtol=1e-9)
+        assert envs[1].x.dtype == np.float64
+        assert np.allclose(envs[0].x, envs[1].x, rtol=1e-9, atol=1e-12)
+        assert np.array_equal(envs[0].adj_mat, envs[1].adj_mat)
+    # 64-bit floats are only enabled around the calls of the env
+    assert not jax.config.jax_enable_x64
+
+
+def test_rollout_matches_steps():
+    env = make_env(FlockingRelativeJaxEnv, n_agents=20)
+    env.reset()
+    state = env.get_state()
+    xs, us, costs = env.rollout(10)
+    assert np.isclose(env.time, 10 * env.dt)
+
+    env.set_state(state)
+    for x, u, cost in zip(xs, us, costs):
+        controls = env.controller()
+        assert np.allclose(controls, u, rtol=1e-9, atol=1e-9)
+        _, step_cost, _, _ = env.step(controls)
+        assert np.allclose(env.x, x, rtol=1e-9, atol=1e-12)
+        assert np.isclose(step_cost, cost, rtol=1e-9)
@@ -0,0 +1,44 @@
+import itertools
+import numpy as np
+import pytest
+from gym_flock.envs.formation_flying import FormationFlyingEnv
+from gym_flock.envs.utils import FORMATIONS
+
+
+@pytest.mark.parametrize('name', sorted(FORMATIONS))
+def test_goal_assignment_is_optimal(name):
+    env = FormationFlyingEnv()
+    env.set_formation(name, n_agents=6)
+    env.reset()
+
+    starts = env.x[:, 0:2]
+    slots = env.goals
+    best = min(np.sum(np.square(starts - slots[list(p)])) for p in itertools.permutations(range(6)))
+    assert np.isclose(np.sum(np.square(starts - env.goals)), best)
+
+
+@pytest.mark.parametrize('degree', [1, 3])
+def test_knn_network_matches_dense(degree):
+    env = FormationFlyingEnv()
+    env.degree = degree
+    env.set_formation('wedge', n_agents=30)
+    env.reset()
+
+    # the goals of a formation are equidistant, so the neighbors are compared by their distances
+    dist2 = env.dist2_mat(env.x[:, 2:4].copy())
+    net = env.get_connectivity(env.x)
+    assert np.array_equal(np.sum(net, axis=1), np.full((30,), degree))
+    for i in range(30):
+        assert np.allclose(np.sort(dist2[i, net[i] > 0]), np.sort(dist2[i])[0:degree])
+
+
+def test_radius_network_matches_dense():
+    env = FormationFlyingEnv()
+    env.degree = 0
+    env.set_formation('circle', n_agents=40)
+    env.reset()
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        env.step(rng.uniform(-1, 1, size=(2 * env.n_agents,)))
+        expected = (env.dist2_mat(env.x) < env.comm_radius2).astype(float)
+        assert np.array_equal(env.get_connectivity(env.x), expected)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.flocking_leader import FlockingLeaderEnv
+from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
+from gym_flock.envs.flocking_twoflocks import FlockingTwoFlocksEnv
+from gym_flock.envs.integrators import AdaptiveStepper, dopri_step, euler_step, rk4_step, verlet_step
+
+
+def oscillator(y):
+    # damped, so that the accelerations depend on the velocities as the expert's do
+    return -y[:, 0:2] - 0.5 * y[:, 2:4]
+
+
+def solve(method, dt, t=1.0):
+    y = np.array([[1.0, 0.0, 0.0, 1.0]])
+    for _ in range(int(round(t / dt))):
+        if method == 'euler':
+            y = euler_step(y, oscillator, dt)
+        elif method == 'verlet':
+            y, _ = verlet_step(y, oscillator, dt, 1e-6, 1e-8)
+        elif method == 'rk4':
+            y = rk4_step(y, oscillator, dt)
+        else:
+            y, _, _ = dopri_step(y, oscillator, dt)
+    return y
+
+
+@pytest.mark.parametrize('method, order', [('euler', 1), ('verlet', 2), ('rk4', 4), ('dopri', 5)])
+def test_integrator_order(method, order):
+    reference = solve('dopri', 1e-3)
+    errors = [np.max(np.abs(solve(method, dt) - reference)) for dt in (0.1, 0.05)]
+    assert np.isclose(np.log2(errors[0] / errors[1]), order, atol=0.3)
+
+
+def test_adaptive_error_follows_the_tolerance():
+    reference = solve('dopri', 1e-3, t=2.0)
+    errors = []
+    for rtol in (1e-4, 1e-7):
+        stepper = AdaptiveStepper(0.1, rtol=rtol, atol=rtol * 1e-2)
+        y = np.array([[1.0, 0.0, 0.0, 1.0]])
+        t = 0.0
+        while t < 2.0:
+            stepper.max_dt = 2.0 - t
+            y, dt, _, _ = stepper.step(y, oscillator)
+            t += dt
+        errors.append(np.max(np.abs(y - reference)))
+    assert errors[0] < 1e-3 and errors[1] < 1e-2 * errors[0]
+
+
+# the mask of the obstacle env only fits its default number of agents
+@pytest.mark.parametrize('env_cls, n_agents', [(FlockingRelativeEnv, 20), (FlockingLeaderEnv, 20),
+                                               (FlockingObstacleEnv, 100), (FlockingTwoFlocksEnv, 20)])
+def test_euler_step_expert_matches_expert_steps(env_cls, n_agents):
+    envs = [make_env(env_cls, n_agents=n_agents) for _ in range(2)]
+    for env in envs:
+        env.reset()
+        spread_flock(env, n_neighbors=6.0)
+    for _ in range(20):
+        envs[0].step_expert()
+        envs[1].step(envs[1].controller())
+    assert np.allclose(envs[0].x, envs[1].x, rtol=1e-9, atol=1e-9)
+    assert np.isclose(envs[0].time, envs[1].time)
+
+
+def test_stochastic_env_rejects_integrators():
+    env = make_env(FlockingStochasticEnv, n_agents=20)
+    env.reset()
+    with pytest.raises(ValueError):
+        env.set_integrator('rk4')
+    with pytest.raises(ValueError):
+        env.step_expert()
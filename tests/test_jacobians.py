@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.flocking_leader import FlockingLeaderEnv
+from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
+
+
+def step_from(env, state, x, u):
+    """
+    Returns: the state and features after a step with action u from state x
+    """
+    env.set_state(state)
+    env.x = x.copy()
+    env.step(u)
+    return env.x.copy(), env.state_values.copy()
+
+
+# the mask of the obstacle env only fits its default number of agents
+@pytest.mark.parametrize('env_cls, n_agents', [(FlockingRelativeEnv, 20), (FlockingLeaderEnv, 20),
+                                               (FlockingObstacleEnv, 100)])
+@pytest.mark.parametrize('n_substeps', [1, 3])
+def test_step_jacobians_match_finite_differences(env_cls, n_agents, n_substeps):
+    env = make_env(env_cls, n_agents=n_agents, substeps=n_substeps)
+    env.reset()
+    spread_flock(env, n_neighbors=4.0)
+    if env_cls is FlockingObstacleEnv:
+        # some neighbor pairs include an obstacle
+        assert np.any(env.adj_mat[0:env.n_obstacles])
+
+    rng = np.random.RandomState(0)
+    x0 = env.x.copy()
+    u = rng.uniform(-1, 1, size=(env.n_agents, env.nu))
+    state = env.get_state()
+    env.step(u)
+    f_x, f_u, g_x, g_u = env.step_jacobians()
+    adj_mat = env.adj_mat.copy()
+
+    eps = 1e-6
+    for _ in range(3):
+        dx = rng.normal(size=x0.shape)
+        du = rng.normal(size=u.shape)
+        x_plus, features_plus = step_from(env, state, x0 + eps * dx, u + eps * du)
+        assert np.array_equal(env.adj_mat, adj_mat)
+        x_minus, features_minus = step_from(env, state, x0 - eps * dx, u - eps * du)
+        assert np.array_equal(env.adj_mat, adj_mat)
+
+        expected_x = f_x.dot(dx.ravel()) + f_u.dot(du.ravel())
+        expected_features = g_x.dot(dx.ravel()) + g_u.dot(du.ravel())
+        assert np.allclose((x_plus - x_minus).ravel() / (2 * eps), expected_x, rtol=1e-5, atol=1e-6)
+        # the features of close pairs are orders of magnitude larger than the others
+        assert np.allclose((features_plus - features_minus).ravel() / (2 * eps), expected_features, rtol=1e-5,
+                           atol=1e-5)
+
+
+def test_stochastic_steps_have_no_jacobians():
+    env = make_env(FlockingStochasticEnv, n_agents=20)
+    env.reset()
+    env.step(env.controller())
+    with pytest.raises(ValueError):
+        env.step_jacobians()
+
+
+def test_expert_substeps_have_no_jacobians():
+    env = make_env(FlockingRelativeEnv, n_agents=20, substeps=3, expert_substeps=True)
+    env.reset()
+    env.step(env.controller())
+    with pytest.raises(ValueError):
+        env.step_jacobians()
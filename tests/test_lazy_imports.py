@@ -0,0 +1,32 @@
+import subprocess
+import sys
+import pytest
+
+HEAVY_MODULES = ('matplotlib', 'sklearn', 'airsim', 'jax', 'torch', 'gym_flock.envs.flocking_obstacle')
+
+
+def loaded_modules(statement):
+    """
+    Returns: the heavy modules loaded by statement in a fresh interpreter
+    """
+    code = statement + '\nimport sys\nprint(" ".join(m for m in %r if m in sys.modules))' % (HEAVY_MODULES,)
+    out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return out.stdout.split()
+
+
+@pytest.mark.parametrize('statement', [
+    'import gym_flock',
+    'import gym, gym_flock; gym.make("FlockingRelative-v0")',
+    'from gym_flock.envs import FlockingRelativeEnv',
+])
+def test_startup_loads_no_heavy_modules(statement):
+    assert loaded_modules(statement) == []
+
+
+def test_env_classes_are_loaded_on_access():
+    import gym_flock.envs
+    from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
+    assert gym_flock.envs.FlockingObstacleEnv is FlockingObstacleEnv
+    assert 'FlockingRaggedEnv' in dir(gym_flock.envs)
+    with pytest.raises(AttributeError):
+        gym_flock.envs.NoSuchEnv
@@ -0,0 +1,39 @@
+import numpy as np
+from gym_flock.envs.lqr import LQREnv
+from gym_flock.envs.lqr_batch import SYSTEM_ATTRS, LQRBatchEnv
+
+
+def test_batch_matches_single_envs():
+    np.random.seed(0)
+    batch = LQRBatchEnv(n_envs=3, system_seed=1)
+    batch.std_dev = 0.0
+    obs = batch.reset()
+
+    singles = []
+    for k in range(batch.n_envs):
+        env = LQREnv()
+        for name in SYSTEM_ATTRS:
+            setattr(env, name, getattr(batch, name))
+        env.std_dev = 0.0
+        env.reset()
+        env.x = batch.x[:, k].copy()
+        env.aggregator.reset()
+        env.x_agg = env.aggregate(env.x)
+        assert np.allclose(env._get_obs(), obs[k])
+        singles.append(env)
+
+    rng = np.random.RandomState(2)
+    for _ in range(5):
+        u = rng.uniform(-1, 1, size=(batch.n_envs, batch.n_nodes))
+        obs, reward, _, _ = batch.step(u)
+        for k, env in enumerate(singles):
+            single_obs, single_reward, _, _ = env.step(u[k].copy())
+            assert np.allclose(single_obs, obs[k])
+            assert np.isclose(np.ravel(single_reward)[0], reward[k])
+
+
+def test_systems_are_shared():
+    first = LQRBatchEnv(n_envs=2, system_seed=3)
+    second = LQRBatchEnv(n_envs=4, system_seed=3)
+    assert first.a_sys is second.a_sys
+    assert not first.a_sys.flags.writeable
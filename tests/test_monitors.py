@@ -0,0 +1,139 @@
+import warnings
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
+from gym_flock.envs.monitors import order_parameter
+
+
+def test_episode_metrics_match_recorded_trajectory():
+    env = make_env(FlockingRelativeEnv, n_agents=20)
+    metrics = env.enable_metrics(collision_radius=0.3)
+    env.reset()
+
+    variances, min_dists, degrees, orders = [], [], [], []
+    collisions = 0
+    for _ in range(20):
+        env.step(env.controller())
+        stats = env.get_stats()
+        variances.append(-env.instant_cost())
+        min_dists.append(np.min(stats['min_dists']))
+        degrees.append(np.sum(env.adj_mat) / env.n_agents)
+        orders.append(order_parameter(env.x[:, 2:4]))
+        collisions += np.count_nonzero(np.triu(env.r2 < 0.3 * 0.3, 1))
+
+    summary = metrics.summary()
+    for name, values in (('vel_variance', variances), ('min_dist', min_dists), ('mean_degree', degrees),
+                         ('order', orders)):
+        assert np.isclose(summary[name]['mean'], np.mean(values))
+        assert np.isclose(summary[name]['std'], np.std(values))
+        assert np.isclose(summary[name]['min'], np.min(values))
+        assert np.isclose(summary[name]['max'], np.max(values))
+    assert summary['steps'] == 20
+    assert summary['collisions'] == collisions
+
+    # the summary of an episode is kept at the next reset
+    env.reset()
+    assert metrics.last_episode['steps'] == 20
+
+
+@pytest.mark.parametrize('search_limit', [2, 64])
+def test_graph_health_matches_dense_graph(search_limit):
+    from scipy.sparse.csgraph import connected_components
+    env = make_env(FlockingRelativeEnv, n_agents=40)
+    graph = env.enable_graph_health()
+    graph.search_limit = search_limit
+    env.reset()
+    spread_flock(env, n_neighbors=10.0)
+    graph.reset(env)
+
+    n_connected = n_fragmented = 0
+    for _ in range(60):
+        _, _, _, info = env.step(np.zeros((env.n_agents, env.nu)))
+        n_components, labels = connected_components(env.adj_mat, directed=False)
+        assert info['graph']['components'] == n_components
+        # the same partition of the agents, up to the names of the components
+        roots = graph.components.labels()
+        assert len(np.unique(np.stack((roots, labels)), axis=1)[0]) == n_components
+        if n_components == 1:
+            lap = np.diag(np.sum(env.adj_mat, axis=1)) - env.adj_mat
+            assert np.isclose(info['graph']['lambda2'], np.linalg.eigvalsh(lap)[1], rtol=1e-3)
+            n_connected += 1
+        else:
+            n_fragmented += 1
+    assert n_connected > 0 and n_fragmented > 0
+
+
+def test_safety_finds_the_colliding_pairs():
+    env = make_env(FlockingRelativeEnv, n_agents=40)
+    safety = env.enable_safety(collision_radius=0.3, mode='warn')
+    env.reset()
+    spread_flock(env, n_neighbors=20.0)
+    safety.reset(env)
+
+    n_collisions = 0
+    for _ in range(20):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            _, _, done, info = env.step(np.zeros((env.n_agents, env.nu)))
+        assert not done
+        i, j = np.nonzero(np.triu(env.r2 < 0.3 * 0.3, 1))
+        if i.size == 0:
+            assert 'safety' not in info
+            continue
+        n_collisions += 1
+        pairs = info['safety']['collisions']
+        assert sorted(map(tuple, pairs.tolist())) == sorted(zip(i.tolist(), j.tolist()))
+    assert n_collisions > 0 and safety.violations['collision'] == n_collisions
+
+
+@pytest.mark.parametrize('mode', ['terminate', 'truncate', 'warn'])
+def test_safety_modes(mode):
+    env = make_env(FlockingRelativeEnv, n_agents=20)
+    env.enable_safety(collision_radius=None, max_speed=10.0, max_accel=100.0, mode=mode)
+    env.reset()
+    _, _, done, info = env.step(np.zeros((env.n_agents, env.nu)))
+    assert not done and 'safety' not in info
+
+    u = np.zeros((env.n_agents, env.nu))
+    u[3] = 200.0
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        _, _, done, info = env.step(u)
+    assert info['safety']['reasons'] == ['acceleration']
+    assert done == (mode != 'warn')
+    assert info.get('TimeLimit.truncated', False) == (mode == 'truncate')
+    assert (len(caught) > 0) == (mode == 'warn')
+
+    env.x[0, 2:4] = np.nan
+    env.compute_helpers()
+    assert env.safety.check(env)[0] == ['nonfinite']
+
+
+@pytest.mark.parametrize('env_cls, n_substeps', [(FlockingRelativeEnv, 1), (FlockingRelativeEnv, 3),
+                                                 (FlockingStochasticEnv, 1), (FlockingStochasticEnv, 2)])
+def test_consensus_rate_is_per_unit_of_simulated_time(env_cls, n_substeps):
+    env = make_env(env_cls, n_agents=20, substeps=n_substeps)
+    env.enable_consensus_detection(window=5)
+    env.reset()
+    assert env.time == 0.0
+
+    variance = -env.instant_cost()
+    time = 0.0
+    for _ in range(5):
+        dts = []
+        integrate = env.integrate
+
+        def record(u):
+            integrate(u)
+            dts.append(env.dt)
+        env.integrate = record
+        _, cost, _, info = env.step(env.controller())
+        del env.integrate
+
+        assert len(dts) == n_substeps
+        assert np.isclose(env.time, time + np.sum(dts))
+        assert np.isclose(info['consensus']['rate'], abs(-cost - variance) / np.sum(dts))
+        variance = -cost
+        time = env.time
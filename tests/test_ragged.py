@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from conftest import make_env
+from gym_flock.envs.flocking_ragged import FlockingRaggedEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+N_AGENTS = (7, 20, 12)
+COMM_RADIUS = (0.9, 1.2, 1.0)
+DT = (0.01, 0.02, 0.005)
+
+
+def single_envs(ragged):
+    """
+    Returns: one FlockingRelativeEnv per flock of the ragged env, in the same state
+    """
+    envs = []
+    for f, (n_agents, comm_radius, dt) in enumerate(zip(N_AGENTS, COMM_RADIUS, DT)):
+        env = make_env(FlockingRelativeEnv, n_agents=n_agents, comm_radius=comm_radius, dt=dt)
+        env.x = ragged.x[ragged.flock(f)].copy()
+        env.compute_helpers()
+        envs.append(env)
+    return envs
+
+
+@pytest.mark.parametrize('centralized', [True, False])
+def test_ragged_env_matches_single_envs(centralized):
+    ragged = FlockingRaggedEnv(n_agents=N_AGENTS, comm_radius=COMM_RADIUS, dt=DT)
+    ragged.centralized = centralized
+    np.random.seed(0)
+    ragged.reset()
+    envs = single_envs(ragged)
+
+    for _ in range(10):
+        u = ragged.controller()
+        state_network = ragged.state_network.toarray()
+        for f, env in enumerate(envs):
+            rows = ragged.flock(f)
+            assert np.allclose(ragged.state_values[rows], env.state_values, rtol=1e-9, atol=1e-9)
+            assert np.allclose(state_network[rows, rows], env.state_network)
+            assert np.allclose(u[rows], env.controller(centralized), rtol=1e-9, atol=1e-9)
+
+        _, costs, _, _ = ragged.step(u)
+        for f, env in enumerate(envs):
+            _, cost, _, _ = env.step(u[ragged.flock(f)])
+            assert np.isclose(costs[f], cost)
+            assert np.allclose(ragged.x[ragged.flock(f)], env.x, rtol=1e-9, atol=1e-12)
+
+
+def test_render_draws_every_flock():
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    ragged = FlockingRaggedEnv(n_agents=N_AGENTS, comm_radius=COMM_RADIUS, dt=DT)
+    np.random.seed(0)
+    ragged.reset()
+    try:
+        ragged.render()
+        ragged.step(ragged.controller())
+        ragged.render()
+        assert len(ragged.fig.axes) == len(N_AGENTS)
+        for f, line in enumerate(ragged.lines):
+            assert np.array_equal(line.get_xdata(), ragged.x[ragged.flock(f), 0])
+            assert np.array_equal(line.get_ydata(), ragged.x[ragged.flock(f), 1])
+
+        # a new figure is made for new flocks
+        ragged.set_flocks((5, 6))
+        ragged.reset()
+        ragged.render()
+        assert len(ragged.fig.axes) == 2
+    finally:
+        plt.close('all')
@@ -0,0 +1,65 @@
+import multiprocessing
+import threading
+from multiprocessing.connection import Client
+import numpy as np
+from conftest import make_flock
+from gym_flock.rollout_service import RolloutServer, run_worker
+
+
+def local_episode(seed, max_steps):
+    env = make_flock()
+    np.random.seed(seed)
+    env.seed(seed)
+    state_values, _ = env.reset()
+    values, actions, rewards = [], [], []
+    for _ in range(max_steps):
+        u = env.controller()
+        (next_values, _), reward, done, _ = env.step(u)
+        values.append(state_values)
+        actions.append(u)
+        rewards.append(reward)
+        state_values = next_values
+        if done:
+            break
+    return np.stack(values), np.stack(actions), np.array(rewards)
+
+
+def failing_worker(server, start_workers):
+    """
+    Register, start the real workers once an episode is received, and disconnect in the middle of that episode
+    """
+    conn = Client(server.address, authkey=server.authkey)
+    conn.send(('register', 'failing'))
+    conn.recv()
+    conn.recv()
+    start_workers()
+    conn.close()
+
+
+def test_episodes_match_local_rollouts():
+    ctx = multiprocessing.get_context('spawn')
+    with RolloutServer(make_flock, max_episode_steps=20) as server:
+        server.submit(3, seed=5)
+        processes = [ctx.Process(target=run_worker, args=(server.address, server.authkey),
+                                 kwargs={'chunk_steps': 7}, daemon=True) for _ in range(2)]
+
+        def start_workers():
+            for process in processes:
+                process.start()
+        thread = threading.Thread(target=failing_worker, args=(server, start_workers), daemon=True)
+        thread.start()
+
+        episodes = sorted(server.episodes(), key=lambda episode: episode.episode_id)
+        thread.join()
+        # the episode of the failing worker was run again from scratch
+        assert server.n_redispatched == 1
+    for process in processes:
+        process.join(timeout=10)
+
+    assert [episode.seed for episode in episodes] == [5, 6, 7]
+    for episode in episodes:
+        assert episode.worker != 'failing'
+        values, actions, rewards = local_episode(episode.seed, 20)
+        assert np.array_equal(episode.state_values, values)
+        assert np.array_equal(episode.actions, actions)
+        assert np.array_equal(episode.rewards, rewards)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from conftest import make_env
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
+
+
+def run(env, n_steps, expert):
+    """
+    Returns: the observations, costs and infos of n_steps steps, followed by the state after a reset
+    """
+    trajectory = []
+    for _ in range(n_steps):
+        (state_values, state_network), cost, done, info = env.step_expert() if expert else env.step(env.controller())
+        trajectory.append((state_values.copy(), state_network.copy(), env.x.copy(), cost, done, env.time,
+                           repr(info)))
+    env.reset()
+    trajectory.append(env.x.copy())
+    return trajectory
+
+
+def assert_same(first, second):
+    for a, b in zip(first[:-1], second[:-1]):
+        for value_a, value_b in zip(a, b):
+            assert np.array_equal(value_a, value_b)
+    assert np.array_equal(first[-1], second[-1])
+
+
+@pytest.mark.parametrize('env_cls, params, expert', [
+    (FlockingRelativeEnv, {'filter_length': 3, 'track_metrics': True, 'track_graph_health': True}, False),
+    (FlockingStochasticEnv, {'consensus_window': 5}, False),
+    (FlockingRelativeEnv, {'integrator': 'adaptive', 'integrator_max_dt': 0.05, 'substeps': 2}, True),
+])
+def test_restored_snapshot_continues_identically(env_cls, params, expert):
+    env = make_env(env_cls, n_agents=20, **params)
+    env.reset()
+    for _ in range(3):
+        env.step_expert() if expert else env.step(env.controller())
+
+    state = env.get_state()
+    first = run(env, 5, expert)
+    # the snapshot may be restored any number of times
+    for _ in range(2):
+        env.set_state(state)
+        assert_same(first, run(env, 5, expert))
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.flocking_leader import FlockingLeaderEnv
+from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_stoch import FlockingStochasticEnv
+from gym_flock.envs.flocking_twoflocks import FlockingTwoFlocksEnv
+
+# the mask of the obstacle env only fits its default number of agents
+ENVS = [(FlockingRelativeEnv, 20), (FlockingLeaderEnv, 20), (FlockingObstacleEnv, 100), (FlockingStochasticEnv, 20),
+        (FlockingTwoFlocksEnv, 20)]
+
+
+@pytest.mark.parametrize('env_cls, n_agents', ENVS)
+@pytest.mark.parametrize('centralized', [True, False])
+def test_sparse_controller_matches_controller(env_cls, n_agents, centralized):
+    env = make_env(env_cls, n_agents=n_agents)
+    env.reset()
+    spread_flock(env, n_neighbors=6.0)
+    for _ in range(10):
+        u = env.controller(centralized)
+        assert np.allclose(env.sparse_controller(centralized), u, rtol=1e-9, atol=1e-9 * np.max(np.abs(u)))
+        env.step(u)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from conftest import make_env, spread_flock
+from gym_flock.envs.flocking_obstacle import FlockingObstacleEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+
+# the mask of the obstacle env only fits its default number of agents
+ENVS = [(FlockingRelativeEnv, 20), (FlockingObstacleEnv, 100)]
+
+
+def pair(env_cls, n_agents, **params):
+    """
+    Returns: an env with substeps and one without, in the same state
+    """
+    envs = [make_env(env_cls, n_agents=n_agents, **params), make_env(env_cls, n_agents=n_agents)]
+    for env in envs:
+        env.reset()
+        spread_flock(env, n_neighbors=6.0)
+    return envs
+
+
+@pytest.mark.parametrize('env_cls, n_agents', ENVS)
+def test_held_action_substeps_equal_single_steps(env_cls, n_agents):
+    env, single = pair(env_cls, n_agents, substeps=4)
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        u = rng.uniform(-1, 1, size=(n_agents, 2))
+        (state_values, _), cost, _, _ = env.step(u)
+        for _ in range(4):
+            (single_values, _), single_cost, _, _ = single.step(u)
+        assert np.array_equal(env.x, single.x)
+        assert np.array_equal(state_values, single_values)
+        assert cost == single_cost
+        assert np.isclose(env.time, single.time)
+
+
+@pytest.mark.parametrize('env_cls, n_agents', ENVS)
+def test_expert_substeps_equal_expert_steps(env_cls, n_agents):
+    env, single = pair(env_cls, n_agents, substeps=4, expert_substeps=True)
+    for _ in range(3):
+        u = env.controller()
+        env.step(u)
+        single.step(u)
+        for _ in range(3):
+            single.step(single.controller())
+        assert np.allclose(env.x, single.x, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from conftest import make_env
+from gym_flock.envs.flocking_ragged import FlockingRaggedEnv
+from gym_flock.envs.flocking_relative import FlockingRelativeEnv
+from gym_flock.envs.flocking_twoflocks import FlockingTwoFlocksEnv
+from gym_flock.envs.torch_obs import TorchObservationWrapper
+
+
+def dense(observation):
+    values, (edge_index, edge_weight) = observation
+    n_agents = values.shape[0]
+    return torch.sparse_coo_tensor(edge_index, edge_weight, (n_agents, n_agents)).to_dense().numpy()
+
+
+def network(env):
+    state_network = env.unwrapped.state_network
+    return state_network.toarray() if hasattr(state_network, 'toarray') else state_network
+
+
+@pytest.mark.parametrize('make', [lambda: make_env(FlockingRelativeEnv, n_agents=20),
+                                  lambda: make_env(FlockingTwoFlocksEnv, n_agents=20),
+                                  lambda: FlockingRaggedEnv(n_agents=(5, 12), comm_radius=(0.9, 1.2))])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_observations_match_the_dense_network(make, dtype):
+    env = TorchObservationWrapper(make(), dtype=dtype)
+    assert env.observation_space.dtype == dtype
+    np.random.seed(0)
+    observations = [env.reset()]
+    states = [(env.unwrapped.state_values.copy(), network(env).copy())]
+    for _ in range(5):
+        observation, _, _, _ = env.step(env.unwrapped.controller())
+        observations.append(observation)
+        states.append((env.unwrapped.state_values.copy(), network(env).copy()))
+
+    # observations held across steps are not overwritten
+    for observation, (values, state_network) in zip(observations, states):
+        assert observation[0].dtype == torch.from_numpy(np.zeros(1, dtype=dtype)).dtype
+        assert np.allclose(observation[0].numpy(), values, rtol=1e-6)
+        assert np.allclose(dense(observation), state_network, rtol=1e-6)
+        edge_index = observation[1][0].numpy()
+        keys = edge_index[0] * values.shape[0] + edge_index[1]
+        assert np.all(np.diff(keys) > 0)
+
+
+@pytest.mark.parametrize('filter_length', [0, 3])
+def test_features_share_memory_with_the_env(filter_length):
+    env = TorchObservationWrapper(make_env(FlockingRelativeEnv, n_agents=20, filter_length=filter_length),
+                                  dtype=np.float64)
+    observation = env.reset()
+    for _ in range(3):
+        state_values = env.unwrapped.state_values
+        assert observation[0].data_ptr() == state_values.ctypes.data
+        observation, _, _, _ = env.step(env.unwrapped.controller())
+
+    # other dtypes are converted
+    env = TorchObservationWrapper(make_env(FlockingRelativeEnv, n_agents=20), dtype=np.float32)
+    observation = env.reset()
+    assert observation[0].data_ptr() != env.unwrapped.state_values.ctypes.data
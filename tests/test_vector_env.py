@@ -0,0 +1,42 @@
+from functools import partial
+import numpy as np
+import pytest
+from conftest import make_flock
+from gym_flock.vector_env import SharedMemoryVectorEnv
+
+
+def dense_network(edge_index, edge_weight, n_edges, n_agents):
+    network = np.zeros((n_agents, n_agents))
+    network[edge_index[0, 0:n_edges], edge_index[1, 0:n_edges]] = edge_weight[0:n_edges]
+    return network
+
+
+@pytest.mark.parametrize('network', ['dense', 'sparse'])
+def test_vector_env_matches_serial_envs(network):
+    # the workers reset their envs right after building them, as the serial envs are reset here
+    templates = [partial(make_flock, seed=seed) for seed in range(2)]
+    envs = []
+    observations = []
+    for template in templates:
+        envs.append(template())
+        observations.append(envs[-1].reset())
+
+    with SharedMemoryVectorEnv(templates, network=network, expert=True) as vector_env:
+        for _ in range(5):
+            values, networks = vector_env.observations()
+            for k, (env, (state_values, state_network)) in enumerate(zip(envs, observations)):
+                assert np.array_equal(values[k], state_values)
+                if network == 'dense':
+                    assert np.array_equal(networks[k], state_network)
+                else:
+                    edge_index, edge_weight, n_edges = networks
+                    assert np.array_equal(dense_network(edge_index[k], edge_weight[k], n_edges[k], env.n_agents),
+                                          state_network)
+                assert np.array_equal(vector_env.expert_actions[k], env.controller())
+
+            actions = np.stack([env.controller() for env in envs])
+            _, rewards, dones, _ = vector_env.step(actions)
+            steps = [env.step(u) for env, u in zip(envs, actions)]
+            observations = [step[0] for step in steps]
+            assert np.array_equal(rewards, [step[1] for step in steps])
+            assert np.array_equal(dones, [step[2] for step in steps])
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from conftest import make_flock
+from gym_flock import worker_pool
+from gym_flock.worker_pool import WorkerPool
+
+
+@pytest.fixture(scope='module')
+def pool():
+    with WorkerPool({'flock': make_flock}) as pool:
+        yield pool
+
+
+def test_workers_match_local_envs(pool):
+    worker = pool.spawn('flock', seed=5)
+    env = make_flock()
+    np.random.seed(5)
+    env.seed(5)
+
+    values, network = worker.reset()
+    expected_values, expected_network = env.reset()
+    assert np.array_equal(values, expected_values)
+    assert np.array_equal(network, expected_network)
+    for _ in range(3):
+        u = worker.controller()
+        assert np.array_equal(u, env.controller())
+        (values, _), reward, _, _ = worker.step(u)
+        (expected_values, _), expected_reward, _, _ = env.step(u)
+        assert np.array_equal(values, expected_values)
+        assert reward == expected_reward
+    assert worker.get_attr('n_agents') == 20
+
+
+def test_workers_are_seeded_independently(pool):
+    first = pool.spawn('flock')
+    second = pool.spawn('flock')
+    assert not np.array_equal(first.reset()[0], second.reset()[0])
+
+
+def test_worker_errors_are_raised(pool):
+    worker = pool.spawn('flock', seed=0)
+    with pytest.raises(RuntimeError):
+        worker.call('no_such_method')
+    # the worker keeps serving after an error
+    assert worker.reset()[0].shape == (20, 6)
+    with pytest.raises(RuntimeError):
+        pool.spawn('no_such_template')
+
+
+def test_failing_spawns_are_raised(pool):
+    # seeding fails in the worker, after it forked
+    with pytest.raises(RuntimeError, match='seed'):
+        pool.spawn('flock', seed=-1)
+
+    # the pool still forks workers
+    worker = pool.spawn('flock', seed=1)
+    assert worker.reset()[0].shape[0] == 20
+    worker.close()
+
+
+def test_workers_exiting_before_connecting_are_raised():
+    # a process that exited without connecting to the listener
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    authkey = os.urandom(32)
+    with worker_pool.Listener(authkey=authkey) as listener:
+        with pytest.raises(RuntimeError, match='exited before connecting'):
+            worker_pool._accept(listener, process.pid, authkey)